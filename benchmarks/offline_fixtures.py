@@ -0,0 +1,451 @@
+"""
+Local stand-ins for every external service the briefer talks to, replaying
+the recorded responses in benchmarks/fixtures/.
+
+- FixtureServer: HTTP server for the Tesla Fleet API and OpenWeatherMap OneCall
+- FakeGoogleMaps: directions / distance_matrix in place of googlemaps.Client
+- FakeAnthropic: messages.create / stream / count_tokens in place of anthropic.Anthropic
+- SMTPSink: an aiosmtpd server that accepts and discards mail
+
+All of them report to one Meter (calls, bytes, injected errors per service)
+and take their latency and error injection from a Profile.
+"""
+import os
+import copy
+import json
+import time
+import socket
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SERVICES = ("tesla", "weather", "maps", "anthropic", "smtp")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# --- Profiles ---
+
+@dataclass
+class Profile:
+    """
+    Latency and error injection for one benchmark scenario.
+
+    Args:
+        latency (dict): Seconds added to every call, per service.
+        tesla_408 (int): vehicle_data calls answered with HTTP 408 (car asleep).
+        tesla_asleep_polls (int): Vehicle state polls that report 'asleep' after a wake_up.
+        maps_over_query_limit (int): Directions calls failing with OVER_QUERY_LIMIT.
+        weather_errors (int): OneCall calls answered with HTTP 500.
+    """
+    name: str
+    description: str = ""
+    latency: dict = field(default_factory=dict)
+    tesla_408: int = 0
+    tesla_asleep_polls: int = 0
+    maps_over_query_limit: int = 0
+    weather_errors: int = 0
+
+    def scaled(self, factor):
+        return Profile(**{**self.__dict__, "latency": {k: v * factor for k, v in self.latency.items()}})
+
+
+# Round-trip times roughly as observed from a home connection
+REALISTIC_LATENCY = {"tesla": 0.25, "weather": 0.12, "maps": 0.18, "anthropic": 2.0, "smtp": 0.08}
+
+PROFILES = {
+    "instant": Profile("instant", "No added latency; measures local overhead only"),
+    "realistic": Profile("realistic", "Typical round-trip times for each API", latency=REALISTIC_LATENCY),
+    "tesla-408-storm": Profile("tesla-408-storm", "Sleeping car: vehicle_data answers 408 repeatedly",
+                               latency=REALISTIC_LATENCY, tesla_408=4, tesla_asleep_polls=3),
+    "maps-over-query-limit": Profile("maps-over-query-limit", "First Directions calls hit OVER_QUERY_LIMIT",
+                                     latency=REALISTIC_LATENCY, maps_over_query_limit=4),
+    "weather-500": Profile("weather-500", "OneCall answers HTTP 500 once",
+                           latency=REALISTIC_LATENCY, weather_errors=1),
+}
+
+
+class Faults:
+    """Counts down the errors a profile injects. Thread-safe."""
+
+    def __init__(self, profile):
+        self._lock = threading.Lock()
+        self._remaining = {
+            "tesla_408": profile.tesla_408,
+            "tesla_asleep_polls": profile.tesla_asleep_polls,
+            "maps_over_query_limit": profile.maps_over_query_limit,
+            "weather_errors": profile.weather_errors,
+        }
+
+    def take(self, kind):
+        with self._lock:
+            if self._remaining[kind] > 0:
+                self._remaining[kind] -= 1
+                return True
+            return False
+
+
+# --- Metering ---
+
+class Meter:
+    """Calls, bytes and injected errors per service. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = {service: {"calls": 0, "bytes_out": 0, "bytes_in": 0, "errors": 0} for service in SERVICES}
+
+    def record(self, service, bytes_out=0, bytes_in=0, error=False):
+        with self._lock:
+            counts = self._counts[service]
+            counts["calls"] += 1
+            counts["bytes_out"] += bytes_out
+            counts["bytes_in"] += bytes_in
+            counts["errors"] += int(error)
+
+    def snapshot(self):
+        with self._lock:
+            return {service: dict(counts) for service, counts in self._counts.items()}
+
+
+class Environment:
+    """Profile, fault counters and meter shared by every stand-in."""
+
+    def __init__(self, profile):
+        self.meter = Meter()
+        self.set_profile(profile)
+
+    def set_profile(self, profile):
+        self.profile = profile
+        self.faults = Faults(profile)
+
+    def delay(self, service):
+        seconds = self.profile.latency.get(service, 0)
+        if seconds:
+            time.sleep(seconds)
+
+
+def _size(payload):
+    return len(json.dumps(payload, default=str).encode("utf-8"))
+
+
+# --- Tesla and OpenWeatherMap over HTTP ---
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Serves the Tesla Fleet API under /api/1 and OneCall under
+    /data/3.0/onecall from recorded fixtures.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, env, port=0):
+        super().__init__(("127.0.0.1", port), FixtureHandler)
+        self.env = env
+        self.vehicles = load_fixture("tesla_vehicles.json")
+        self.vehicle = load_fixture("tesla_vehicle.json")
+        self.vehicle_data = load_fixture("tesla_vehicle_data.json")
+        self.wake_up = load_fixture("tesla_wake_up.json")
+        self.unavailable = load_fixture("tesla_408.json")
+        self.onecall = load_fixture("owm_onecall.json")
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def forecast(self):
+        # Recorded days are shifted so that daily[1] is always tomorrow
+        data = copy.deepcopy(self.onecall)
+        today = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        for i, day in enumerate(data["daily"]):
+            day["dt"] = int((today + timedelta(days=i)).timestamp())
+        return data
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, service, status, payload, bytes_out):
+        body = json.dumps(payload).encode("utf-8")
+        self.server.env.meter.record(service, bytes_out=bytes_out + len(self.requestline), bytes_in=len(body),
+                                     error=status >= 400)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        env, server = self.server.env, self.server
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        path = self.path.split("?")[0].rstrip("/")
+
+        if path == "/data/3.0/onecall" and method == "GET":
+            env.delay("weather")
+            if env.faults.take("weather_errors"):
+                return self._reply("weather", 500, {"cod": 500, "message": "Internal error"}, length)
+            return self._reply("weather", 200, server.forecast(), length)
+
+        if not path.startswith("/api/1/vehicles"):
+            return self._reply("tesla", 404, {"error": f"no fixture for {method} {path}"}, length)
+
+        env.delay("tesla")
+        parts = path[len("/api/1/"):].split("/")
+        if parts == ["vehicles"] and method == "GET":
+            return self._reply("tesla", 200, server.vehicles, length)
+        if len(parts) == 2 and method == "GET":
+            vehicle = copy.deepcopy(server.vehicle)
+            if env.faults.take("tesla_asleep_polls"):
+                vehicle["response"]["state"] = "asleep"
+            return self._reply("tesla", 200, vehicle, length)
+        if len(parts) == 3 and parts[2] == "vehicle_data" and method == "GET":
+            if env.faults.take("tesla_408"):
+                return self._reply("tesla", 408, server.unavailable, length)
+            return self._reply("tesla", 200, server.vehicle_data, length)
+        if len(parts) == 3 and parts[2] == "wake_up" and method == "POST":
+            return self._reply("tesla", 200, server.wake_up, length)
+        return self._reply("tesla", 404, {"error": f"no fixture for {method} {path}"}, length)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+
+# --- Google Maps ---
+
+class FakeGoogleMaps:
+    """
+    Stands in for googlemaps.Client. Directions durations vary with the
+    departure hour so departure ranking has something to rank.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.routes = load_fixture("directions.json")
+        self.element = load_fixture("distance_matrix_element.json")
+
+    def _rush_hour_factor(self, departure_time):
+        if not isinstance(departure_time, datetime):
+            return 1.0
+        hours_from_peak = abs(departure_time.hour + departure_time.minute / 60 - 8.75)
+        return 1.0 + max(0.0, 0.25 - 0.1 * hours_from_peak)
+
+    def directions(self, origin, destination, mode="driving", departure_time=None, traffic_model=None, alternatives=False, **kwargs):
+        import googlemaps
+
+        request = {"origin": origin, "destination": destination, "mode": mode, "departure_time": departure_time,
+                   "traffic_model": traffic_model, "alternatives": alternatives}
+        self.env.delay("maps")
+        if self.env.faults.take("maps_over_query_limit"):
+            self.env.meter.record("maps", bytes_out=_size(request), error=True)
+            raise googlemaps.exceptions.ApiError("OVER_QUERY_LIMIT", "You have exceeded your rate-limit for this API.")
+
+        routes = copy.deepcopy(self.routes if alternatives else self.routes[:1])
+        factor = self._rush_hour_factor(departure_time)
+        for route in routes:
+            leg = route["legs"][0]
+            leg["duration_in_traffic"]["value"] = round(leg["duration_in_traffic"]["value"] * factor)
+        self.env.meter.record("maps", bytes_out=_size(request), bytes_in=_size(routes))
+        return routes
+
+    def distance_matrix(self, origins, destinations, mode="driving", departure_time=None, **kwargs):
+        request = {"origins": origins, "destinations": destinations, "mode": mode, "departure_time": departure_time}
+        self.env.delay("maps")
+        result = {
+            "status": "OK",
+            "origin_addresses": list(origins),
+            "destination_addresses": list(destinations),
+            "rows": [{"elements": [copy.deepcopy(self.element) for _ in destinations]} for _ in origins],
+        }
+        self.env.meter.record("maps", bytes_out=_size(request), bytes_in=_size(result))
+        return result
+
+
+# --- Local road graph ---
+
+def _rush_hour_profile(depth):
+    """Speed factors per 15-minute slot of the week, dipping by `depth` at the weekday peaks."""
+    import math
+
+    factors = []
+    for day in range(7):
+        for slot in range(24 * 4):
+            hour = slot / 4
+            dip = max(math.exp(-((hour - 8.75) / 0.75) ** 2), math.exp(-((hour - 17.5) / 1.0) ** 2)) if day < 5 else 0.0
+            factors.append(1.0 - depth * dip)
+    return factors
+
+
+def build_road_extract(directory, places, size=40, padding=0.05):
+    """
+    Writes a synthetic road-network extract for the local routing backend: a
+    size x size street grid around `places` ({address: (lat, lng)}), with two
+    north-south freeways. US-101 runs east and slows sharply at rush hour;
+    I-280 runs west and is longer but steadier.
+    """
+    import math
+    from utils.local_router import build_extract
+
+    lats = [lat for lat, _ in places.values()]
+    lngs = [lng for _, lng in places.values()]
+    south, north = min(lats) - padding, max(lats) + padding
+    west, east = min(lngs) - padding, max(lngs) + padding
+    coords = [(south + (north - south) * row / (size - 1), west + (east - west) * col / (size - 1))
+              for row in range(size) for col in range(size)]
+
+    def node(row, col):
+        return row * size + col
+
+    def length(a, b):
+        (lat1, lng1), (lat2, lng2) = coords[a], coords[b]
+        dlat, dlng = math.radians(lat2 - lat1), math.radians(lng2 - lng1) * math.cos(math.radians(lat1))
+        return 6371008.8 * math.hypot(dlat, dlng)
+
+    freeways = {size - 4: ("US-101", 0), 3: ("I-280", 1)}  # column -> (name, profile)
+    edges = []
+    for row in range(size):
+        for col in range(size):
+            for next_row, next_col in ((row + 1, col), (row, col + 1)):
+                if next_row >= size or next_col >= size:
+                    continue
+                a, b = node(row, col), node(next_row, next_col)
+                name, profile = freeways.get(col, (None, -1)) if next_col == col else (None, -1)
+                speed = 29.0 if name else 11.0
+                edges.append((a, b, length(a, b), speed, name, profile))
+                edges.append((b, a, length(a, b), speed, name, profile))
+
+    nearest = {address: min(range(len(coords)), key=lambda n: (coords[n][0] - lat) ** 2 + (coords[n][1] - lng) ** 2)
+               for address, (lat, lng) in places.items()}
+    return build_extract(directory, coords, edges, nearest, [_rush_hour_profile(0.55), _rush_hour_profile(0.2)])
+
+
+# --- Anthropic ---
+
+class _FakeStream:
+
+    def __init__(self, env, message, chunks):
+        self._env = env
+        self._message = message
+        self._chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        # All of the latency is time-to-first-token; the rest streams quickly
+        self._env.delay("anthropic")
+        for chunk in self._chunks:
+            yield chunk
+
+    def get_final_message(self):
+        return self._message
+
+
+class FakeMessages:
+
+    def __init__(self, env):
+        self.env = env
+        self.fixture = load_fixture("claude_briefing.json")
+
+    def _message(self, request):
+        usage = dict(self.fixture["usage"])
+        usage["input_tokens"] = max(1, _size(request) // 4)
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=self.fixture["text"])],
+            usage=SimpleNamespace(**usage),
+            stop_reason="end_turn"
+        )
+
+    def create(self, **request):
+        self.env.delay("anthropic")
+        message = self._message(request)
+        self.env.meter.record("anthropic", bytes_out=_size(request), bytes_in=len(self.fixture["text"]))
+        return message
+
+    def stream(self, **request):
+        message = self._message(request)
+        text = self.fixture["text"]
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+        self.env.meter.record("anthropic", bytes_out=_size(request), bytes_in=len(text))
+        return _FakeStream(self.env, message, chunks)
+
+    def count_tokens(self, **request):
+        self.env.meter.record("anthropic", bytes_out=_size(request), bytes_in=24)
+        return SimpleNamespace(input_tokens=max(1, _size(request) // 4))
+
+
+class FakeAnthropic:
+    """Stands in for anthropic.Anthropic (messages only)."""
+
+    def __init__(self, env):
+        self.messages = FakeMessages(env)
+
+
+# --- SMTP ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _SinkHandler:
+
+    def __init__(self, env):
+        self.env = env
+
+    async def handle_DATA(self, server, session, envelope):
+        seconds = self.env.profile.latency.get("smtp", 0)
+        if seconds:
+            await asyncio.sleep(seconds)
+        self.env.meter.record("smtp", bytes_out=len(envelope.content), bytes_in=len(b"250 Message accepted"))
+        return "250 Message accepted"
+
+
+class SMTPSink:
+    """aiosmtpd server on a free local port that accepts and discards every message."""
+
+    def __init__(self, env):
+        from aiosmtpd.controller import Controller
+
+        self.port = _free_port()
+        self._controller = Controller(_SinkHandler(env), hostname="127.0.0.1", port=self.port)
+
+    def start(self):
+        self._controller.start()
+        return self
+
+    def stop(self):
+        self._controller.stop()
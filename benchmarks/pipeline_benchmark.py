@@ -0,0 +1,290 @@
+"""
+Offline pipeline benchmark for the commute briefer.
+
+Replays the recorded responses in benchmarks/fixtures/ through local
+stand-ins (HTTP fixture server for Tesla and OpenWeatherMap, fake Google
+Maps and Anthropic clients, an aiosmtpd sink), so no quota is spent and
+runs are repeatable. Each run has two passes:
+
+- isolated: every stage of run_commute_briefer (and the email) runs on its
+  own, reporting wall time, external calls, bytes transferred, injected
+  errors and peak traced memory.
+- pipeline: the stages run together through the stage scheduler, as in
+  production, reporting per-stage and end-to-end wall time.
+
+Profiles add per-service latency and error storms (see --list-profiles).
+With --routing local, the traffic stage routes over a synthetic road-network
+extract instead of the fake Google Maps client.
+Each run starts with empty caches unless --warm is given, in which case
+caches, token and snapshot files carry over between runs.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--profile realistic] [--runs 3] [--warm] [--routing local] [--json out.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import contextlib
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from offline_fixtures import PROFILES, SERVICES, Environment, FixtureServer, FakeGoogleMaps, FakeAnthropic, SMTPSink, build_road_extract
+
+COLUMNS = ("wall_ms", "calls", "bytes_out", "bytes_in", "errors", "peak_kb")
+
+
+def configure(fixture_server, smtp_sink, profile_name):
+    """Points every setting at the stand-ins. Nothing is read from .env."""
+    os.environ.update({
+        "TESLA_CLIENT_ID": "benchmark",
+        "TESLA_CLIENT_SECRET": "benchmark",
+        "TESLA_API_BASE_URL": f"{fixture_server.base_url}/api/1",
+        "TESLA_WAKE_TIMEOUT": "60",
+        "WEATHER_API_KEY": "benchmark",
+        "WEATHER_API_URL": f"{fixture_server.base_url}/data/3.0/onecall",
+        "GOOGLE_MAPS_API_KEY": "benchmark",
+        "ANTHROPIC_API_KEY": "benchmark",
+        "ORIGIN_ADDRESS": "1600 Amphitheatre Pkwy, Mountain View, CA",
+        "DEST_ADDRESS": "1 Market St, San Francisco, CA",
+        "ORIGIN_LATITUDE": "37.4220",
+        "ORIGIN_LONGITUDE": "-122.0841",
+        "DEST_LATITUDE": "37.7941",
+        "DEST_LONGITUDE": "-122.3951",
+        "SENDER_EMAIL": "briefer@example.com",
+        "RECIPIENT_EMAIL": "commuter@example.com",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_sink.port),
+        "SMTP_USE_SSL": "false",
+        # The Maps token bucket would otherwise dominate the "instant" profile
+        "MAPS_QPS": "1000" if profile_name == "instant" else os.environ.get("MAPS_QPS", "10"),
+    })
+    for name in ("SENDER_PASSWORD", "PROMPT_INPUT_FILENAME", "PROMPT_OUTPUT_FILENAME", "ANTHROPIC_BASE_URL",
+                 "ROUTING_BACKEND", "ROUTING_GRAPH_DIR"):
+        os.environ.pop(name, None)
+
+    from utils.config import load_config
+    load_config(dotenv=False)
+
+
+def prepare_state(state_dir):
+    """Per-run files: a valid Tesla token and empty cache locations."""
+    os.makedirs(state_dir, exist_ok=True)
+    os.environ.update({
+        "TOKEN_FILE": os.path.join(state_dir, "tokens.json"),
+        "VEHICLE_SNAPSHOT_FILE": os.path.join(state_dir, "vehicle_snapshot.json"),
+        "BRIEFING_CACHE_DIR": os.path.join(state_dir, "briefings"),
+        "WEATHER_CACHE_DIR": os.path.join(state_dir, "weather"),
+        "TRAFFIC_HISTORY_DB": os.path.join(state_dir, "traffic_history.sqlite"),
+    })
+    if not os.path.exists(os.environ["TOKEN_FILE"]):
+        with open(os.environ["TOKEN_FILE"], "w") as f:
+            json.dump({"access_token": "benchmark-access", "refresh_token": "benchmark-refresh",
+                       "expires_in": 8 * 60 * 60, "obtained_at": int(time.time())}, f)
+
+
+def install_clients(env):
+    """(Re)builds the client registry around the fakes."""
+    from utils import resilience
+    from utils.config import reset_clients, set_client
+    from utils.get_weather_data import shared_forecasts
+    from utils.get_routes_data import shared_routes, shared_estimates
+
+    reset_clients()
+    resilience.reset()
+    set_client("gmaps", FakeGoogleMaps(env))
+    set_client("anthropic", FakeAnthropic(env))
+    for shared in (shared_forecasts, shared_routes, shared_estimates):
+        shared.clear()
+
+
+def _totals(counts):
+    return {key: sum(counts[service][key] for service in SERVICES) for key in ("calls", "bytes_out", "bytes_in", "errors")}
+
+
+def run_isolated(env, quiet):
+    """Runs each stage on its own; returns {stage: metrics}."""
+    import main
+    from utils.send_email_response import send_email
+
+    stages = main.briefing_stages()
+    values, report = {}, {}
+    steps = [(stage.name, stage.func, stage.deps) for stage in stages]
+    steps.append(("email", lambda claude: send_email(claude), ("claude",)))
+
+    tracemalloc.start()
+    try:
+        for name, func, deps in steps:
+            if any(dep not in values for dep in deps):
+                report[name] = {"skipped": True}
+                continue
+            env.meter.reset()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            error = None
+            try:
+                with _quiet(quiet):
+                    values[name] = func(**{dep: values[dep] for dep in deps})
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            wall = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            counts = env.meter.snapshot()
+            report[name] = {
+                "wall_ms": wall * 1000,
+                **_totals(counts),
+                "peak_kb": peak / 1024,
+                "by_service": {service: c for service, c in counts.items() if c["calls"]},
+                "error": error,
+            }
+    finally:
+        tracemalloc.stop()
+    return report
+
+
+def run_pipeline(env, quiet):
+    """Runs the stages through the scheduler plus the email; returns wall times and totals."""
+    import main
+    from utils import telemetry
+    from utils.stage_scheduler import run_stages
+    from utils.send_email_response import send_email
+
+    env.meter.reset()
+    telemetry.reset()
+    started = time.perf_counter()
+    with _quiet(quiet):
+        results = run_stages(main.briefing_stages())
+        sent = results["claude"].ok and send_email(results["claude"].value)
+    total = time.perf_counter() - started
+    return {
+        "stages": {name: {"wall_ms": result.wall_time * 1000, "ok": result.ok,
+                          "degraded": result.fallback_from is not None,
+                          "error": repr(result.error or result.fallback_from) if not result.ok or result.fallback_from else None}
+                   for name, result in results.items()},
+        "total_ms": total * 1000,
+        "email_sent": bool(sent),
+        **_totals(env.meter.snapshot()),
+        "slowest_spans": [{"name": s.name, "ms": s.duration * 1000, "error": s.error}
+                          for s in sorted(telemetry.finished_spans(), key=lambda s: s.duration, reverse=True)
+                          if not s.name.startswith("stage.")][:5],
+    }
+
+
+@contextlib.contextmanager
+def _quiet(enabled):
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _median(runs, stage, column):
+    values = [run[stage][column] for run in runs if column in run.get(stage, {})]
+    return statistics.median(values) if values else None
+
+
+def print_report(profile, isolated_runs, pipeline_runs, warm):
+    print(f"Profile: {profile.name} - {profile.description}")
+    print(f"Runs: {len(isolated_runs)} ({'warm caches after the first' if warm else 'cold caches'}), medians shown\n")
+
+    print("Isolated stages")
+    print(f"  {'stage':<10}" + "".join(f"{column:>12}" for column in COLUMNS))
+    for stage in isolated_runs[0]:
+        if isolated_runs[0][stage].get("skipped"):
+            print(f"  {stage:<10}{'skipped':>12}")
+            continue
+        cells = []
+        for column in COLUMNS:
+            value = _median(isolated_runs, stage, column)
+            whole = column not in ("wall_ms", "peak_kb") and value == int(value)
+            cells.append(f"{int(value):>12d}" if whole else f"{value:>12.1f}")
+        print(f"  {stage:<10}" + "".join(cells))
+        errors = {run[stage]["error"] for run in isolated_runs if run[stage].get("error")}
+        for error in errors:
+            print(f"  {'':<10}  failed: {error}")
+
+    print("\nPipeline (scheduler)")
+    stages = [run["stages"] for run in pipeline_runs]
+    for stage in stages[0]:
+        failures = sum(not run[stage]["ok"] for run in stages)
+        degraded = sum(run[stage]["degraded"] for run in stages)
+        notes = [f"{failures} failed"] * bool(failures) + [f"{degraded} degraded"] * bool(degraded)
+        print(f"  {stage:<10}{_median(stages, stage, 'wall_ms'):>12.1f} ms" + (f"  ({', '.join(notes)})" if notes else ""))
+    totals = {column: statistics.median(run[column] for run in pipeline_runs) for column in ("total_ms", "calls", "bytes_out", "bytes_in", "errors")}
+    print(f"  {'total':<10}{totals['total_ms']:>12.1f} ms, {int(totals['calls'])} calls, "
+          f"{int(totals['bytes_out'] + totals['bytes_in'])} bytes, {int(totals['errors'])} injected errors, "
+          f"{sum(run['email_sent'] for run in pipeline_runs)}/{len(pipeline_runs)} emails sent")
+
+    print("\nSlowest spans (last run)")
+    for entry in pipeline_runs[-1]["slowest_spans"]:
+        print(f"  {entry['name']:<24}{entry['ms']:>10.1f} ms" + (f"  failed: {entry['error']}" if entry["error"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", default="realistic", choices=sorted(PROFILES))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every profile latency")
+    parser.add_argument("--warm", action="store_true", help="Keep caches, tokens and snapshots between runs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for retry/backoff jitter")
+    parser.add_argument("--routing", default="google", choices=("google", "local"),
+                        help="Route with the fake Google Maps client or a synthetic local road graph")
+    parser.add_argument("--json", help="Write every run's raw numbers to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    parser.add_argument("--list-profiles", action="store_true")
+    args = parser.parse_args()
+
+    if args.list_profiles:
+        for name, profile in sorted(PROFILES.items()):
+            print(f"{name:<24}{profile.description}")
+        return 0
+
+    profile = PROFILES[args.profile].scaled(args.latency_scale)
+    env = Environment(profile)
+    fixture_server = FixtureServer(env).start()
+    smtp_sink = SMTPSink(env).start()
+    configure(fixture_server, smtp_sink, profile.name)
+
+    isolated_runs, pipeline_runs = [], []
+    try:
+        with tempfile.TemporaryDirectory(prefix="briefer-bench-") as root:
+            if args.routing == "local":
+                graph_dir = os.path.join(root, "road_graph")
+                build_road_extract(graph_dir, {
+                    os.environ["ORIGIN_ADDRESS"]: (float(os.environ["ORIGIN_LATITUDE"]), float(os.environ["ORIGIN_LONGITUDE"])),
+                    os.environ["DEST_ADDRESS"]: (float(os.environ["DEST_LATITUDE"]), float(os.environ["DEST_LONGITUDE"])),
+                })
+                os.environ.update({"ROUTING_BACKEND": "local", "ROUTING_GRAPH_DIR": graph_dir})
+            for run in range(args.runs):
+                state_dir = os.path.join(root, "warm" if args.warm else f"run-{run}")
+                for pass_name, runner, results in (("isolated", run_isolated, isolated_runs), ("pipeline", run_pipeline, pipeline_runs)):
+                    # Each pass gets its own state (cold) or shares it (warm),
+                    # and starts with a fresh set of injected faults
+                    prepare_state(state_dir if args.warm else f"{state_dir}-{pass_name}")
+                    random.seed(args.seed + run)
+                    env.set_profile(profile)
+                    install_clients(env)
+                    results.append(runner(env, quiet=not args.verbose))
+    finally:
+        smtp_sink.stop()
+        fixture_server.stop()
+
+    print_report(profile, isolated_runs, pipeline_runs, args.warm)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"profile": profile.__dict__, "warm": args.warm,
+                       "isolated": isolated_runs, "pipeline": pipeline_runs}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
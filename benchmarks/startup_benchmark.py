@@ -0,0 +1,83 @@
+"""
+Startup benchmark for the commute briefer.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters, reports the
+median cumulative import time and the slowest modules, and exits non-zero if
+startup regresses: either a heavy client library is imported eagerly or the
+median import time exceeds the budget.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--budget-ms 250]
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# These must only be imported when the client is first used
+LAZY_MODULES = ("anthropic", "googlemaps", "numpy", "aiohttp")
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+
+def measure_once(target):
+    """Returns {module: (self_us, cumulative_us, depth)} for one fresh interpreter."""
+    # An empty environment keeps .env / shell settings from changing what gets imported
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": REPO_ROOT}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'import {target}' failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="main", help="Module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure")
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="Fail if the median import time exceeds this")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [measure_once(args.target) for _ in range(args.runs)]
+    totals_ms = [run[args.target][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    print(f"import {args.target}: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(totals_ms):.1f} ms, max {max(totals_ms):.1f} ms)")
+
+    last = runs[-1]
+    print(f"\nTop {args.top} top-level imports by cumulative time:")
+    top_level = [(name, cumulative) for name, (_, cumulative, depth) in last.items() if depth <= 1 and name != args.target]
+    for name, cumulative in sorted(top_level, key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = sorted({name.split(".")[0] for name in last if name.split(".")[0] in LAZY_MODULES})
+    if eager:
+        failures.append(f"heavy modules imported at startup: {', '.join(eager)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.1f} ms exceeds budget {args.budget_ms:.1f} ms")
+
+    if failures:
+        print("\nFAIL: " + "; ".join(failures))
+        return 1
+    print("\nOK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
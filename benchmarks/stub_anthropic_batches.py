@@ -0,0 +1,220 @@
+"""
+Local stub of the Anthropic Message Batches endpoints.
+
+Accepts batches, reports them as in progress for a few polls, then serves
+one canned briefing per request as JSONL. Usage figures mimic prompt
+caching: a system block marked with cache_control is written to the cache
+by the first request and read by the rest.
+
+Usage:
+    python benchmarks/stub_anthropic_batches.py [--port 8765] [--polls 2]
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 CLAUDE_BATCH_POLL_INTERVAL=1 \
+        python main.py --roster roster.json --message-batch
+"""
+import json
+import uuid
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BATCHES_PATH = "/v1/messages/batches"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StubBatchServer(ThreadingHTTPServer):
+    """
+    Args:
+        address (tuple): (host, port); port 0 picks a free one.
+        polls_until_ended (int): Status polls a batch stays "in_progress" for.
+        fail_custom_ids (set, optional): custom_ids to report as errored.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, polls_until_ended=2, fail_custom_ids=None):
+        super().__init__(address, StubBatchHandler)
+        self.polls_until_ended = polls_until_ended
+        self.fail_custom_ids = set(fail_custom_ids or ())
+        self.lock = threading.Lock()
+        # batch id -> {"batch": dict, "requests": list, "polls": int}
+        self.batches = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def create_batch(self, requests):
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        created = _now()
+        batch = {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "in_progress",
+            "request_counts": {"processing": len(requests), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": created.isoformat(),
+            "expires_at": (created + timedelta(hours=24)).isoformat(),
+            "ended_at": None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": None,
+        }
+        with self.lock:
+            self.batches[batch_id] = {"batch": batch, "requests": requests, "polls": 0}
+        return batch
+
+    def poll_batch(self, batch_id):
+        with self.lock:
+            entry = self.batches[batch_id]
+            batch = entry["batch"]
+            entry["polls"] += 1
+            if batch["processing_status"] == "in_progress" and entry["polls"] >= self.polls_until_ended:
+                self._end(entry, canceled=False)
+            return dict(batch)
+
+    def cancel_batch(self, batch_id):
+        with self.lock:
+            entry = self.batches[batch_id]
+            entry["batch"]["cancel_initiated_at"] = _now().isoformat()
+            self._end(entry, canceled=True)
+            return dict(entry["batch"])
+
+    def _end(self, entry, canceled):
+        batch = entry["batch"]
+        batch["processing_status"] = "ended"
+        batch["ended_at"] = _now().isoformat()
+        batch["results_url"] = f"{self.base_url}{BATCHES_PATH}/{batch['id']}/results"
+        counts = batch["request_counts"]
+        counts["processing"] = 0
+        for request in entry["requests"]:
+            if canceled:
+                counts["canceled"] += 1
+            elif request["custom_id"] in self.fail_custom_ids:
+                counts["errored"] += 1
+            else:
+                counts["succeeded"] += 1
+
+    def results(self, batch_id):
+        with self.lock:
+            entry = self.batches[batch_id]
+            canceled = entry["batch"]["cancel_initiated_at"] is not None
+            lines = []
+            cache_written = False
+            for request in entry["requests"]:
+                custom_id, params = request["custom_id"], request["params"]
+                if canceled:
+                    result = {"type": "canceled"}
+                elif custom_id in self.fail_custom_ids:
+                    result = {"type": "errored", "error": {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}}
+                else:
+                    result = {"type": "succeeded", "message": self._message(params, cache_written)}
+                    cache_written = True
+                lines.append(json.dumps({"custom_id": custom_id, "result": result}))
+            return "\n".join(lines) + "\n"
+
+    def _message(self, params, cache_written):
+        system = params.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        cached_tokens = sum(_estimate_tokens(block["text"]) for block in system if block.get("cache_control"))
+        uncached_tokens = sum(_estimate_tokens(block["text"]) for block in system if not block.get("cache_control"))
+        prompt = "".join(
+            message["content"] if isinstance(message["content"], str) else json.dumps(message["content"])
+            for message in params["messages"]
+        )
+        text = f"Good evening! Here is your briefing.\n\n{prompt.strip().splitlines()[-1]}"
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": params["model"],
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": uncached_tokens + _estimate_tokens(prompt),
+                "output_tokens": _estimate_tokens(text),
+                "cache_creation_input_tokens": 0 if cache_written else cached_tokens,
+                "cache_read_input_tokens": cached_tokens if cache_written else 0,
+            },
+        }
+
+
+class StubBatchHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        payload = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _not_found(self):
+        self._send(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+    def _batch_id(self, suffix=""):
+        path = self.path.split("?")[0]
+        if not path.startswith(BATCHES_PATH + "/") or not path.endswith(suffix):
+            return None
+        batch_id = path[len(BATCHES_PATH) + 1:len(path) - len(suffix)]
+        return batch_id if batch_id in self.server.batches else None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.split("?")[0] == BATCHES_PATH:
+            self._send(200, self.server.create_batch(body["requests"]))
+            return
+        batch_id = self._batch_id("/cancel")
+        if batch_id:
+            self._send(200, self.server.cancel_batch(batch_id))
+            return
+        self._not_found()
+
+    def do_GET(self):
+        batch_id = self._batch_id("/results")
+        if batch_id:
+            self._send(200, self.server.results(batch_id), "application/binary")
+            return
+        batch_id = self._batch_id()
+        if batch_id:
+            self._send(200, self.server.poll_batch(batch_id))
+            return
+        self._not_found()
+
+
+def start_stub_server(port=0, polls_until_ended=2, fail_custom_ids=None):
+    """Starts the stub on a background thread and returns the server (see `base_url`)."""
+    server = StubBatchServer(("127.0.0.1", port), polls_until_ended, fail_custom_ids)
+    threading.Thread(target=server.serve_forever, name="stub-anthropic", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--polls", type=int, default=2, help="Status polls before a batch ends")
+    parser.add_argument("--fail", action="append", default=[], help="custom_id to report as errored (repeatable)")
+    args = parser.parse_args()
+
+    server = StubBatchServer(("127.0.0.1", args.port), args.polls, args.fail)
+    print(f"Stub Message Batches API on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,246 @@
 # main.py
-from utils.get_weather_data import weather_api_calls
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.get_weather_data import weather_api_calls, shared_forecasts
 # from utils.get_maps_data import maps_api_call
-from utils.get_routes_data import maps_api_call
-from utils.get_tesla_data import make_tesla_api_calls
-from utils.get_claude_response import call_claude_api
-from utils.send_email_response import send_email
+from utils.get_routes_data import maps_api_call, shared_routes, shared_estimates, prefetch_commute_estimates, predicted_traffic_data
+from utils.get_tesla_data import make_tesla_api_calls, last_known_status
+from utils.get_claude_response import call_claude_api, prepare_briefing_prompt, generate_briefings_batch, fallback_briefing
+from utils.send_email_response import send_email, SMTPMailer
+from utils.briefing_context import BriefingContext
+from utils.user_profile import UserProfile, load_roster
+from utils.daemon import BriefingDaemon, send_command, default_socket_path
+from utils.stage_scheduler import Stage, run_stages, print_stage_report
+from utils.config import get_setting
+from utils import telemetry
 
-def run_commute_briefer():
 
-	# Step 1: Get Tesla data
-	print("Fetching Tesla Data....")
-	tesla_data = make_tesla_api_calls()
+def _stage_timeout(name, default):
+	# e.g. STAGE_TIMEOUT_TESLA=180, an empty value disables the timeout
+	value = get_setting(f"STAGE_TIMEOUT_{name.upper()}")
+	if value is None:
+		return default
+	return float(value) if value.strip() else None
+
+
+def generate_briefing(tesla, weather, traffic, user=None):
+	context = BriefingContext(tesla_status=tesla, weather_data=weather, traffic_data=traffic)
+
+	# Persisting the intermediate state is optional (useful for debugging)
+	if get_setting("PROMPT_INPUT_FILENAME") and not user:
+		context.save(get_setting("PROMPT_INPUT_FILENAME"))
 
-	# Step 2: Get weather data
-	print("<---------------------------->")
-	print("Fetching Weather Data....")
-	weather_data = weather_api_calls()
-	
-	# Step 3: Get Maps data
-	print("<---------------------------->")
-	print("Fetching Traffic Data....")
-	maps_data = maps_api_call()
-	
-	# Step 4: Generate LLM Response
-	print("<---------------------------->")
 	print("Generating Claude Response....")
 	print("<---------------------------->")
-	claude_response = call_claude_api()
+	return call_claude_api(context, user)
+
+
+def fetch_stages(user=None):
+	# Tesla, weather and traffic don't depend on each other, so they are
+	# fetched concurrently. Only the LLM step needs all three. A failed fetch
+	# falls back to the last known data (or None, rendered as unavailable),
+	# so one degraded upstream doesn't cost the whole briefing.
+	return [
+		Stage("tesla", partial(make_tesla_api_calls, user), timeout=_stage_timeout("tesla", 240),
+			  fallback=partial(last_known_status, user)),
+		Stage("weather", partial(weather_api_calls, user), timeout=_stage_timeout("weather", 60),
+			  fallback=lambda: None),
+		Stage("traffic", partial(maps_api_call, user), timeout=_stage_timeout("traffic", 120),
+			  fallback=partial(predicted_traffic_data, user)),
+	]
+
+
+def briefing_stages(user=None):
+	return fetch_stages(user) + [
+		Stage("claude", partial(generate_briefing, user=user), deps=("tesla", "weather", "traffic"),
+			  timeout=_stage_timeout("claude", 120)),
+	]
+
+
+def run_commute_briefer(user=None, mailer=None):
+	"""
+	Runs the whole pipeline for one user. Without a user profile the
+	single-user .env settings are used. Returns True if the email was sent.
+	"""
+	# One trace per briefing; every stage and external call nests under it
+	with telemetry.span("briefing", user=user.name if user else "default") as briefing:
+		print("Fetching Tesla, Weather and Traffic Data....")
+		results = run_stages(briefing_stages(user))
+		print_stage_report(results)
+
+		if not results["claude"].ok:
+			print(f"Could not generate briefing: {results['claude'].error}")
+			briefing.fail(results["claude"].error)
+			return False
+
+		print("<---------------------------->")
+		print("Sending Email Update...")
+		sent = send_email(results["claude"].value, user.recipient_email if user else None, mailer)
+		if not sent:
+			briefing.fail("email not sent")
+		return sent
+
+
+def fetch_briefing_context(user):
+	"""Runs only the fetch stages for one user. Returns a BriefingContext, or None if a stage failed."""
+	with telemetry.span("briefing.fetch", user=user.name):
+		results = run_stages(fetch_stages(user))
+	print_stage_report(results)
+	failed = [name for name, result in results.items() if not result.ok]
+	if failed:
+		print(f"Could not fetch {', '.join(failed)} for {user.name}")
+		return None
+	return BriefingContext(
+		tesla_status=results["tesla"].value,
+		weather_data=results["weather"].value,
+		traffic_data=results["traffic"].value
+	)
+
+
+def clear_shared_lookups():
+	shared_forecasts.clear()
+	shared_routes.clear()
+	shared_estimates.clear()
+
+
+def run_batch(roster_path, max_users=None, message_batch=None):
+	"""
+	Briefs every user in the roster from one process. Clients, connection
+	pools and identical weather/route lookups are shared between users, and
+	each external API is bounded by its <API>_MAX_CONCURRENCY setting.
 
+	With `message_batch` (default: CLAUDE_MESSAGE_BATCH), every user's data
+	is fetched first and all briefings are generated through one Anthropic
+	Message Batch, at half the price of individual calls.
+	"""
+	users = load_roster(roster_path)
+	if max_users is None:
+		max_users = int(get_setting("BATCH_MAX_USERS", 8))
+
+	# Share lookups within this batch only
+	clear_shared_lookups()
+
+	# One batched Distance Matrix pass instead of one call per user
+	try:
+		prefetch_commute_estimates([(user.origin_address, user.dest_address) for user in users])
+	except Exception as e:
+		print(f"Batched commute estimates failed, falling back to per-user lookups: {e}")
+
+	if message_batch is None:
+		message_batch = get_setting("CLAUDE_MESSAGE_BATCH", "false").lower() == "true"
+	if message_batch:
+		failed = _run_message_batch(users, max_users)
+	else:
+		failed = _run_users(users, max_users)
+
+	print(f"Batch finished: {len(users) - len(failed)}/{len(users)} briefings sent.")
+	if failed:
+		print(f"Failed: {', '.join(sorted(failed))}")
+	return not failed
+
+
+def _run_users(users, max_users):
+	failed = []
+	# One SMTP connection delivers every briefing in the batch
+	with SMTPMailer() as mailer, ThreadPoolExecutor(max_workers=max(1, min(max_users, len(users))), thread_name_prefix="user") as executor:
+		futures = {executor.submit(run_commute_briefer, user, mailer): user for user in users}
+		for future in as_completed(futures):
+			user = futures[future]
+			try:
+				if not future.result():
+					failed.append(user.name)
+			except Exception as e:
+				print(f"Briefing for {user.name} failed: {e}")
+				failed.append(user.name)
+	return failed
+
+
+def _run_message_batch(users, max_users):
+	failed = []
+	prompts = {}
+	with ThreadPoolExecutor(max_workers=max(1, min(max_users, len(users))), thread_name_prefix="user") as executor:
+		futures = {executor.submit(fetch_briefing_context, user): user for user in users}
+		for future in as_completed(futures):
+			user = futures[future]
+			try:
+				context = future.result()
+			except Exception as e:
+				print(f"Fetching data for {user.name} failed: {e}")
+				context = None
+			if context is None:
+				failed.append(user.name)
+			else:
+				prompts[user.name] = prepare_briefing_prompt(context, user)
+
+	users_by_name = {user.name: user for user in users}
+
+	fallback = get_setting("CLAUDE_FALLBACK_BRIEFING", "true").lower() == "true"
+
+	def deliver(name, briefing, error):
+		if briefing is None:
+			print(f"Briefing for {name} failed: {error}")
+			if not fallback:
+				failed.append(name)
+				return
+			briefing = fallback_briefing(*prompts[name])
+		if not send_email(briefing, users_by_name[name].recipient_email, mailer):
+			failed.append(name)
+
+	with SMTPMailer() as mailer:
+		generate_briefings_batch(prompts, deliver)
+	return failed
+
+
+def run_daemon(roster_path=None, max_users=None):
+	"""
+	Runs as a resident daemon: every user in the roster (or the single .env
+	user) is briefed daily at their briefing_time, with clients, connection
+	pools and the SMTP connection kept warm between briefings.
+	"""
+	def load_users():
+		return load_roster(roster_path) if roster_path else [UserProfile.from_env()]
+
+	# Lookups are shared by the users of one round, not across days
+	BriefingDaemon(load_users, run_commute_briefer, new_round=clear_shared_lookups, max_users=max_users).run()
+
+
+def brief_now(user_name=None):
+	"""Asks the running daemon for a briefing right now. Returns True if it was sent."""
+	try:
+		response = send_command("brief", user=user_name or None)
+	except (FileNotFoundError, ConnectionRefusedError):
+		print(f"No briefing daemon listening on {default_socket_path()}; start one with --daemon.")
+		return False
+	if response.get("error"):
+		print(response["error"])
+	else:
+		print(f"Briefing for {response['user']} {'sent' if response['sent'] else 'failed'} in {response['seconds']:.2f}s.")
+	return response["ok"]
 
-	print("Sending Email Update...")
-	send_email()
 
 if __name__ == "__main__":
-    run_commute_briefer()
+	parser = argparse.ArgumentParser(description="LLM powered commute briefer")
+	parser.add_argument("--roster", help="JSON roster of users to brief in one batch")
+	parser.add_argument("--max-users", type=int, help="Users briefed concurrently in batch mode")
+	parser.add_argument("--message-batch", action="store_true", default=None,
+						help="Generate every briefing through one Anthropic Message Batch")
+	parser.add_argument("--daemon", action="store_true",
+						help="Stay resident and brief each user (or the .env user) at their briefing time")
+	parser.add_argument("--brief-now", nargs="?", const="", metavar="USER",
+						help="Ask the running daemon for a briefing now")
+	args = parser.parse_args()
+
+	if args.brief_now is not None:
+		raise SystemExit(0 if brief_now(args.brief_now) else 1)
+
+	try:
+		if args.daemon:
+			run_daemon(args.roster, args.max_users)
+		elif args.roster:
+			run_batch(args.roster, args.max_users, args.message_batch)
+		else:
+			run_commute_briefer()
+	finally:
+		telemetry.print_slowest_spans()
+		telemetry.flush()
@@ -0,0 +1,77 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from utils import get_routes_data
+from utils.config import set_client, reset_clients
+from utils.route_model import RouteRecord
+from utils.routing_backend import GoogleRoutingBackend
+
+
+def _leg(duration_s, distance_m):
+    return {"duration": {"value": duration_s}, "duration_in_traffic": {"value": duration_s},
+            "distance": {"value": distance_m}, "steps": []}
+
+
+class _NoWait:
+
+    def acquire(self):
+        pass
+
+
+class _FakeGmaps:
+    """Distance Matrix finds no route; Directions does."""
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        return {"rows": [{"elements": [{"status": "ZERO_RESULTS"} for _ in destinations]} for _ in origins]}
+
+    def directions(self, origin, destination, **kwargs):
+        return [{"legs": [_leg(1800, 40000)]}, {"legs": [_leg(2100, 38000)]}]
+
+
+class GetTrafficDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {"TRAFFIC_HISTORY": "false", "DEPARTURE_SEARCH": "grid",
+                                                "DEPARTURE_COUNT": "2"})
+        self.env.start()
+        set_client("gmaps", _FakeGmaps())
+        set_client("maps_rate_limiter", _NoWait())
+        set_client("routing", GoogleRoutingBackend())
+
+    def tearDown(self):
+        reset_clients()
+        get_routes_data.shared_estimates.clear()
+        self.env.stop()
+
+    def test_zero_results_estimate_falls_back_to_probed_routes(self):
+        traffic = get_routes_data.get_traffic_data("Home", "Office")
+
+        # The shortest probed route stands in for the missing estimate
+        self.assertEqual(traffic.commute_distance_m, 38000)
+        self.assertEqual(len(traffic.routes), 4)
+
+    def test_probe_cap_below_the_grid_keeps_the_whole_window(self):
+        routes = get_routes_data.adaptive_departure_search("Home", "Office", start_hour=8, step_minutes=30, count=7,
+                                                           max_probes=3)
+
+        # 8:00 to 11:00 thinned out evenly, not cut off after 9:00
+        self.assertEqual(sorted({route.departure_time.strftime("%H:%M") for route in routes}), ["08:00", "09:30", "11:00"])
+
+
+class RefinementCandidatesTest(unittest.TestCase):
+
+    def test_gaps_near_the_fastest_trip_come_first(self):
+        start = datetime(2025, 9, 8, 8, 0)
+        durations = [3600, 3000, 2400, 2000, 1900, 2300, 2900]
+        routes_by_time = {start + timedelta(minutes=30 * i): [RouteRecord(departure_time=start + timedelta(minutes=30 * i), duration_s=d)]
+                          for i, d in enumerate(durations)}
+
+        candidates = get_routes_data.refinement_candidates(routes_by_time, timedelta(minutes=5), 0.1)
+
+        # Every gap changes by more than 10% or touches 10:00; the ones around 10:00 come first
+        self.assertEqual([c.strftime("%H:%M") for c in candidates[:3]], ["10:15", "09:45", "09:15"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+from utils import resilience
+from utils.config import get_client, set_client, reset_clients
+from utils.routing_backend import GoogleRoutingBackend
+
+
+class _NoWait:
+
+    def acquire(self):
+        pass
+
+
+class _ServerErrorSession:
+    """Stands in for the googlemaps client's requests session; every request gets a 503."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        return mock.Mock(status_code=503)
+
+
+class MapsRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {"GOOGLE_MAPS_API_KEY": "AIza-test-key", "RETRY_MAPS_BASE_DELAY": "0"})
+        self.env.start()
+        resilience.reset()
+        set_client("maps_rate_limiter", _NoWait())
+
+    def tearDown(self):
+        reset_clients()
+        resilience.reset()
+        self.env.stop()
+
+    def test_server_error_is_retried_by_resilience_only(self):
+        session = _ServerErrorSession()
+        get_client("gmaps").session = session
+
+        with self.assertRaises(resilience.UpstreamError):
+            GoogleRoutingBackend().commute_estimates([("Home", "Office")], datetime(2025, 9, 8, 8, 0))
+
+        # One HTTP request per attempt: the client's own 5xx retry loop is off
+        self.assertEqual(session.requests, resilience.policy("maps").attempts)
+
+
+class EndpointIsolationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {"RETRY_MAPS_BASE_DELAY": "0", "MAPS_BREAKER_THRESHOLD": "2"})
+        self.env.start()
+        resilience.reset()
+
+    def tearDown(self):
+        resilience.reset()
+        self.env.stop()
+
+    def test_open_circuit_only_blocks_its_own_endpoint(self):
+        def down():
+            raise ConnectionError("connection reset")
+
+        with self.assertRaises(resilience.UpstreamError):
+            resilience.call("maps.distance_matrix", down)
+        with self.assertRaises(resilience.CircuitOpen):
+            resilience.call("maps.distance_matrix", down)
+
+        self.assertEqual(resilience.call("maps.directions", lambda: "routes"), "routes")
+
+
+if __name__ == "__main__":
+    unittest.main()
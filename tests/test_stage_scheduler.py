@@ -0,0 +1,60 @@
+import time
+import unittest
+from utils.stage_scheduler import Stage, StageSkipped, StageTimeout, run_stages
+
+
+def _sleep_then(seconds, value):
+    def func(**deps):
+        time.sleep(seconds)
+        return value
+    return func
+
+
+def _fail(**deps):
+    raise RuntimeError("upstream down")
+
+
+class RunStagesTest(unittest.TestCase):
+
+    def test_independent_stages_run_in_parallel(self):
+        started = time.monotonic()
+        results = run_stages([
+            Stage("tesla", _sleep_then(0.2, "car")),
+            Stage("weather", _sleep_then(0.2, "sun")),
+            Stage("maps", _sleep_then(0.2, "roads")),
+            Stage("claude", lambda tesla, weather, maps: f"{tesla}, {weather}, {maps}", deps=("tesla", "weather", "maps")),
+        ])
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(results["claude"].value, "car, sun, roads")
+
+    def test_timed_out_stage_uses_its_fallback(self):
+        started = time.monotonic()
+        results = run_stages([
+            Stage("weather", _sleep_then(2, "live"), timeout=0.1, fallback=lambda: "cached"),
+            Stage("claude", lambda weather: f"briefing with {weather} weather", deps=("weather",)),
+        ])
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(results["weather"].ok)
+        self.assertEqual(results["weather"].value, "cached")
+        self.assertIsInstance(results["weather"].fallback_from, StageTimeout)
+        self.assertEqual(results["claude"].value, "briefing with cached weather")
+
+    def test_failed_stage_skips_its_dependents(self):
+        calls = []
+        results = run_stages([
+            Stage("maps", _fail),
+            Stage("weather", _sleep_then(0, "sun")),
+            Stage("claude", lambda maps, weather: calls.append("claude"), deps=("maps", "weather")),
+        ])
+
+        self.assertIsInstance(results["maps"].error, RuntimeError)
+        self.assertTrue(results["weather"].ok)
+        self.assertIsInstance(results["claude"].error, StageSkipped)
+        self.assertEqual(calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import json
+import stat
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from utils.token_store import TokenManager, read_tokens, write_tokens
+
+
+def _tokens(name, expires_in_s):
+    return {"access_token": f"access-{name}", "refresh_token": f"refresh-{name}",
+            "obtained_at": time.time(), "expires_in": expires_in_s}
+
+
+class _FakeRefresh:
+    """Stands in for the OAuth call: counts refreshes and hands out new tokens."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, refresh_token):
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls.append(refresh_token)
+            return _tokens(f"new{len(self.calls)}", 3600)
+
+
+class TokenManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.token_file = os.path.join(self.directory, "tokens.json")
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(self.directory)
+
+    def manager(self, refresh, **kwargs):
+        manager = TokenManager(refresh, refresh_margin=300, refresh_ahead=900, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def test_concurrent_callers_share_one_refresh(self):
+        write_tokens(self.token_file, _tokens("old", 60))
+        refresh = _FakeRefresh(delay=0.1)
+        manager = self.manager(refresh, background=False)
+
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.access_token(self.token_file)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(refresh.calls, ["refresh-old"])
+        self.assertEqual(tokens, ["access-new1"] * 8)
+        self.assertEqual(read_tokens(self.token_file)["refresh_token"], "refresh-new1")
+
+    def test_adopts_a_token_another_process_refreshed(self):
+        write_tokens(self.token_file, _tokens("old", 60))
+        refresh = _FakeRefresh()
+        manager = self.manager(refresh, background=False)
+        manager.watch(self.token_file)  # the stale tokens are now in memory
+
+        # Another process refreshes the account meanwhile
+        write_tokens(self.token_file, _tokens("other", 3600))
+
+        self.assertEqual(manager.access_token(self.token_file), "access-other")
+        self.assertEqual(refresh.calls, [])
+
+    def test_token_file_is_written_atomically_and_owner_only(self):
+        write_tokens(self.token_file, _tokens("old", 3600))
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_file).st_mode), 0o600)
+
+        # A write that fails halfway leaves the previous file whole and no temp file behind
+        with self.assertRaises(TypeError):
+            write_tokens(self.token_file, {"access_token": object()})
+        with open(self.token_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["access_token"], "access-old")
+        self.assertEqual(os.listdir(self.directory), ["tokens.json"])
+
+    def test_refreshes_ahead_of_expiry_in_the_background(self):
+        # Inside refresh_ahead (900s) but outside refresh_margin (300s)
+        write_tokens(self.token_file, _tokens("old", 600))
+        refresh = _FakeRefresh()
+        manager = self.manager(refresh)
+
+        # The caller isn't kept waiting for the refresh
+        self.assertEqual(manager.access_token(self.token_file), "access-old")
+
+        waited = 0.0
+        while not refresh.calls and waited < 5:
+            time.sleep(0.05)
+            waited += 0.05
+        self.assertEqual(refresh.calls, ["refresh-old"])
+        while read_tokens(self.token_file)["access_token"] != "access-new1" and waited < 5:
+            time.sleep(0.05)
+            waited += 0.05
+        self.assertEqual(manager.access_token(self.token_file), "access-new1")
+
+
+if __name__ == "__main__":
+    unittest.main()
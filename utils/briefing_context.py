@@ -0,0 +1,61 @@
+import json
+from dataclasses import dataclass, field, asdict
+
+
+# --- Stage outputs ---
+
+@dataclass(slots=True)
+class TeslaStatus:
+    battery_level: int
+    charge_state: str
+    battery_range: float
+    # True when the reading is the last known one, the car being unreachable
+    stale: bool = False
+
+
+@dataclass(slots=True)
+class WeatherForecast:
+    date: str
+    min_temp: int
+    max_temp: int
+    description: str
+
+
+@dataclass(slots=True)
+class WeatherData:
+    origin: WeatherForecast
+    destination: WeatherForecast
+
+
+@dataclass(slots=True)
+class TrafficData:
+    commute_distance_m: int
+    minimum_battery_drainage: float
+    # RouteRecords (utils.route_model), one per departure time and alternative
+    routes: list = field(default_factory=list)
+
+
+# --- Context passed between stages ---
+
+@dataclass(slots=True)
+class BriefingContext:
+    """
+    Everything the LLM stage needs, handed from stage to stage in memory.
+    Each fetch stage fills in its own field, so they can run concurrently.
+    """
+    tesla_status: TeslaStatus = None
+    weather_data: WeatherData = None
+    traffic_data: TrafficData = None
+
+    def to_dict(self):
+        data = asdict(self)
+        if self.traffic_data:
+            # Interned freeway IDs only mean something inside this process
+            for route, record in zip(data["traffic_data"]["routes"], self.traffic_data.routes):
+                route["freeways"] = record.freeway_names
+        return data
+
+    def save(self, path):
+        """Persists the context once, as compact JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"), default=str)
@@ -0,0 +1,192 @@
+import os
+import threading
+
+# Central, lazily-loaded configuration and client registry.
+#
+# Nothing here runs at import time: .env is read on the first get_setting()
+# call, and each client (and its heavy library import) is built on the first
+# get_client() call for it. A dry run or a single-stage run only pays for
+# what it uses, and a missing API key fails the stage that needs it rather
+# than the whole import.
+
+_config_lock = threading.Lock()
+_config_loaded = False
+
+_clients_lock = threading.RLock()
+_client_factories = {}
+_clients = {}
+
+
+# --- Settings ---
+
+def load_config(dotenv=True):
+    """
+    Reads .env into the environment once per process.
+
+    Args:
+        dotenv (bool): Set to False to use the process environment only, e.g.
+                       in offline benchmarks that must not pick up a local .env.
+    """
+    global _config_loaded
+    if _config_loaded:
+        return
+    with _config_lock:
+        if not _config_loaded:
+            if dotenv:
+                from dotenv import load_dotenv
+                load_dotenv()
+            _config_loaded = True
+
+
+def get_setting(name, default=None, cast=None):
+    """
+    Returns a setting from the environment (.env included).
+
+    Args:
+        name (str): Environment variable name.
+        default: Returned when the variable is unset.
+        cast (callable, optional): Applied to the value when it is set, e.g. float.
+    """
+    load_config()
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return cast(value) if cast else value
+
+
+# --- Clients ---
+
+def register_client(name, factory):
+    """Registers a zero-argument factory that builds the client called `name`."""
+    with _clients_lock:
+        _client_factories[name] = factory
+
+
+def get_client(name):
+    """Returns the shared client called `name`, building it on first use."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            if name not in _client_factories:
+                raise KeyError(f"No client registered under '{name}'")
+            client = _client_factories[name]()
+            _clients[name] = client
+        return client
+
+
+def set_client(name, client):
+    """Replaces the shared client called `name`, e.g. with a fake in benchmarks."""
+    with _clients_lock:
+        _clients[name] = client
+
+
+def reset_clients():
+    """Closes and drops every built client so the next get_client() call rebuilds it."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            close()
+
+
+def _google_maps_client():
+    import googlemaps
+    from utils.resilience import policy
+
+    class SingleAttemptClient(googlemaps.Client):
+        # The client retries 5xx answers by calling _request again, for up to
+        # retry_timeout and regardless of the stage deadline. The second call
+        # fails instead, so each utils.resilience attempt is one HTTP request.
+        def _request(self, url, params, first_request_time=None, retry_counter=0, *args, **kwargs):
+            if retry_counter:
+                raise googlemaps.exceptions.TransportError("Google Maps answered with a retriable 5xx status")
+            return super()._request(url, params, first_request_time, retry_counter, *args, **kwargs)
+
+    # Retries are left to utils.resilience: OVER_QUERY_LIMIT is raised at once too
+    timeout = policy("maps").timeout
+    return SingleAttemptClient(key=get_setting("GOOGLE_MAPS_API_KEY"), timeout=timeout,
+                               retry_timeout=timeout, retry_over_query_limit=False)
+
+
+def _anthropic_client():
+    from anthropic import Anthropic
+    from utils.resilience import policy
+    # ANTHROPIC_BASE_URL points the client at a local stub server in tests.
+    # Retries are left to utils.resilience, which also honours the deadline.
+    return Anthropic(api_key=get_setting("ANTHROPIC_API_KEY"), base_url=get_setting("ANTHROPIC_BASE_URL"),
+                     max_retries=0, timeout=policy("anthropic").timeout)
+
+
+def _maps_rate_limiter():
+    from utils.rate_limiter import TokenBucket
+    return TokenBucket(get_setting("MAPS_QPS", 10, float))
+
+
+def _http_client():
+    from utils.http_client import AsyncHTTPClient
+    return AsyncHTTPClient(
+        connect_timeout=get_setting("HTTP_CONNECT_TIMEOUT", 5, float),
+        read_timeout=get_setting("HTTP_READ_TIMEOUT", 30, float),
+        max_connections=get_setting("HTTP_MAX_CONNECTIONS", 100, int),
+        max_per_host=get_setting("HTTP_MAX_CONNECTIONS_PER_HOST", 8, int)
+    )
+
+
+def _briefing_cache():
+    from utils.disk_cache import DiskCache
+    return DiskCache(
+        get_setting("BRIEFING_CACHE_DIR", ".cache/briefings"),
+        ttl=get_setting("BRIEFING_CACHE_TTL", 12 * 60 * 60, float),
+        max_entries=get_setting("BRIEFING_CACHE_MAX_ENTRIES", 64, int),
+        name="briefing"
+    )
+
+
+def _forecast_cache():
+    from utils.disk_cache import DiskCache
+    return DiskCache(
+        get_setting("WEATHER_CACHE_DIR", ".cache/weather"),
+        ttl=get_setting("WEATHER_CACHE_TTL", 3 * 60 * 60, float),
+        max_entries=get_setting("WEATHER_CACHE_MAX_ENTRIES", 256, int),
+        name="forecast",
+        # Expired forecasts are still better than none when the API is down
+        stale_ttl=get_setting("WEATHER_CACHE_STALE_TTL", 24 * 60 * 60, float)
+    )
+
+
+def _routing_backend():
+    from utils.routing_backend import create_backend
+    return create_backend()
+
+
+def _tesla_tokens():
+    from utils.token_store import TokenManager
+    from utils.get_tesla_data import refresh_access_token
+    return TokenManager(
+        refresh_access_token,
+        refresh_margin=get_setting("TESLA_TOKEN_REFRESH_MARGIN", 300, float),
+        refresh_ahead=get_setting("TESLA_TOKEN_REFRESH_AHEAD", 15 * 60, float),
+        background=get_setting("TESLA_TOKEN_BACKGROUND_REFRESH", "true").lower() == "true",
+        lock_timeout=get_setting("TESLA_TOKEN_LOCK_TIMEOUT", 30, float)
+    )
+
+
+def _traffic_history():
+    from utils.traffic_history import TrafficHistory
+    return TrafficHistory(get_setting("TRAFFIC_HISTORY_DB", ".cache/traffic_history.sqlite"))
+
+
+register_client("gmaps", _google_maps_client)
+register_client("anthropic", _anthropic_client)
+register_client("maps_rate_limiter", _maps_rate_limiter)
+register_client("http", _http_client)
+register_client("briefing_cache", _briefing_cache)
+register_client("forecast_cache", _forecast_cache)
+register_client("traffic_history", _traffic_history)
+register_client("routing", _routing_backend)
+register_client("tesla_tokens", _tesla_tokens)
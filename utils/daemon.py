@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import signal
+import socket
+import threading
+import socketserver
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from utils import telemetry
+from utils.config import get_setting, get_client
+from utils.send_email_response import SMTPMailer
+
+# Resident briefing daemon.
+#
+# One long-running process replaces the cron invocations: clients, connection
+# pools, caches and the SMTP connection stay warm between briefings, every
+# user is briefed at their own time, and "brief me now" requests arrive over
+# a local control socket. A request is one JSON line, answered with one:
+#   {"command": "brief", "user": "alex"}  runs a briefing now and waits for it
+#   {"command": "status"}                 next and last run of every user
+#   {"command": "reload"}                 re-reads the roster
+#   {"command": "stop"}                   finishes running briefings and exits
+
+# Clients built up front, so the first briefing doesn't pay for them
+WARM_CLIENTS = ("gmaps", "anthropic", "maps_rate_limiter", "http",
+                "briefing_cache", "forecast_cache", "traffic_history", "routing", "tesla_tokens")
+
+
+def default_socket_path():
+    return get_setting("DAEMON_SOCKET", ".cache/briefer.sock")
+
+
+def parse_briefing_time(value):
+    """Parses "HH:MM" (24h, local time) into (hour, minute)."""
+    try:
+        hour, minute = (int(part) for part in value.split(":"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Briefing time must look like HH:MM, got {value!r}") from None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Briefing time out of range: {value!r}")
+    return hour, minute
+
+
+def next_run_time(briefing_time, after):
+    """The first datetime strictly after `after` at `briefing_time` ("HH:MM")."""
+    hour, minute = parse_briefing_time(briefing_time)
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def warm_clients():
+    """Builds every shared client (and imports numpy) before the first briefing."""
+    started = time.perf_counter()
+    import numpy  # noqa: F401  (route ranking and prompt trimming)
+    for name in WARM_CLIENTS:
+        try:
+            get_client(name)
+        except Exception as e:
+            # e.g. a missing API key; the stage that needs the client reports it
+            print(f"Could not warm up the {name} client: {e}")
+    print(f"Clients warmed up in {time.perf_counter() - started:.2f}s.")
+
+
+def watch_tokens(users):
+    """Arms the background Tesla token refresh of every user's account."""
+    try:
+        manager = get_client("tesla_tokens")
+    except Exception as e:
+        print(f"Could not start the Tesla token refresh: {e}")
+        return
+    for user in users:
+        token_file = user.token_file or get_setting("TOKEN_FILE")
+        if token_file:
+            manager.watch(token_file)
+
+
+class BriefingDaemon:
+    """
+    Briefs every user at their briefing time and serves the control socket.
+
+    Args:
+        load_users (callable): Returns the UserProfiles to brief. Called at start
+                               and on "reload".
+        brief (callable): brief(user, mailer) runs one briefing and returns True
+                          if it was sent.
+        new_round (callable, optional): Called when a briefing starts while no
+                                        other is running, e.g. to drop lookups
+                                        shared by the previous round.
+        socket_path (str, optional): Control socket. Defaults to DAEMON_SOCKET.
+        max_users (int, optional): Briefings run at once. Defaults to BATCH_MAX_USERS (8).
+    """
+
+    def __init__(self, load_users, brief, new_round=None, socket_path=None, max_users=None):
+        self.load_users = load_users
+        self.brief = brief
+        self.new_round = new_round
+        self.socket_path = socket_path or default_socket_path()
+        self.max_users = max_users or get_setting("BATCH_MAX_USERS", 8, int)
+        self.default_time = get_setting("BRIEFING_TIME", "20:00")
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._users = {}
+        self._next_runs = {}
+        self._last_runs = {}    # name -> {"at", "sent", "seconds"}
+        self._user_locks = {}
+        self._in_flight = 0
+        self._executor = None
+        self._mailer = None
+        self._server = None
+
+    # --- Users and schedule ---
+
+    def _briefing_time(self, user):
+        return user.briefing_time or self.default_time
+
+    def reload(self):
+        """Re-reads the users and reschedules each one's next briefing."""
+        users = self.load_users()
+        for user in users:
+            parse_briefing_time(self._briefing_time(user))  # fail on a bad roster before swapping it in
+        now = datetime.now()
+        with self._lock:
+            self._users = {user.name: user for user in users}
+            self._next_runs = {user.name: next_run_time(self._briefing_time(user), now) for user in users}
+            for name in self._users:
+                self._user_locks.setdefault(name, threading.Lock())
+        self._wakeup.set()
+        # Tokens are refreshed ahead of expiry rather than during a briefing
+        watch_tokens(users)
+        print(f"Scheduled {len(users)} user(s): " + ", ".join(
+            f"{name} at {self._briefing_time(user)}" for name, user in self._users.items()))
+
+    def _due_users(self, now):
+        with self._lock:
+            due = [name for name, at in self._next_runs.items() if at <= now]
+            for name in due:
+                self._next_runs[name] = next_run_time(self._briefing_time(self._users[name]), now)
+            return [self._users[name] for name in due]
+
+    def _seconds_to_next_run(self):
+        with self._lock:
+            if not self._next_runs:
+                return None
+            return max((min(self._next_runs.values()) - datetime.now()).total_seconds(), 0)
+
+    # --- Briefings ---
+
+    def run_briefing(self, user, wait=True):
+        """
+        Briefs one user now. Runs for the same user are serialized; with
+        `wait` False a run is skipped (returns None) if one is in progress.
+        """
+        user_lock = self._user_locks[user.name]
+        if not user_lock.acquire(blocking=wait):
+            print(f"Briefing for {user.name} is already running; skipping.")
+            return None
+        try:
+            with self._lock:
+                first = self._in_flight == 0
+                self._in_flight += 1
+            if first and self.new_round:
+                self.new_round()
+
+            started = time.perf_counter()
+            try:
+                sent = bool(self.brief(user, self._mailer))
+            except Exception as e:
+                print(f"Briefing for {user.name} failed: {e}")
+                sent = False
+            seconds = time.perf_counter() - started
+            telemetry.increment("daemon_briefings_total", result="sent" if sent else "failed")
+            with self._lock:
+                self._last_runs[user.name] = {"at": datetime.now().isoformat(timespec="seconds"),
+                                              "sent": sent, "seconds": round(seconds, 3)}
+            return sent
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                last = self._in_flight == 0
+            user_lock.release()
+            if last:
+                # Export this round's spans, then drop them so memory stays flat
+                telemetry.flush()
+                telemetry.clear_spans()
+
+    def status(self):
+        with self._lock:
+            return {
+                "users": [{
+                    "name": name,
+                    "briefing_time": self._briefing_time(user),
+                    "next_run": self._next_runs[name].isoformat(timespec="seconds"),
+                    "last_run": self._last_runs.get(name),
+                } for name, user in self._users.items()],
+                "running": self._in_flight,
+            }
+
+    def handle(self, request):
+        """Answers one control request (a dict); returns the response dict."""
+        command = request.get("command")
+        if command == "brief":
+            name = request.get("user")
+            with self._lock:
+                if name is None and len(self._users) == 1:
+                    name = next(iter(self._users))
+                user = self._users.get(name)
+            if user is None:
+                return {"ok": False, "error": f"Unknown user: {name}" if name else "Which user? Pass \"user\"."}
+            started = time.perf_counter()
+            sent = self.run_briefing(user)
+            return {"ok": bool(sent), "user": user.name, "sent": bool(sent), "seconds": round(time.perf_counter() - started, 3)}
+        if command == "status":
+            return {"ok": True, **self.status()}
+        if command == "reload":
+            try:
+                self.reload()
+            except Exception as e:
+                return {"ok": False, "error": f"Reload failed, keeping the current roster: {e}"}
+            return {"ok": True, **self.status()}
+        if command == "stop":
+            self.stop()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+    # --- Lifecycle ---
+
+    def _remove_stale_socket(self):
+        """
+        Removes a control socket left behind by a daemon that didn't shut down cleanly.
+
+        Raises:
+            RuntimeError: If a daemon is still answering on the socket.
+        """
+        if not os.path.exists(self.socket_path):
+            return
+        try:
+            send_command("status", socket_path=self.socket_path, timeout=1)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Nobody is listening (or the file went away meanwhile)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            return
+        except (OSError, ValueError) as e:
+            # Something holds the socket but doesn't answer like a daemon; leave it alone
+            raise RuntimeError(f"{self.socket_path} is in use ({e}); not starting a second daemon") from None
+        raise RuntimeError(f"A briefing daemon is already running on {self.socket_path}. "
+                           f"Stop it first (\"stop\" command) or set DAEMON_SOCKET to run another.")
+
+    def _serve_control_socket(self):
+        self._server = _ControlServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._server.serve_forever, name="daemon-control", daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def run(self):
+        """
+        Runs until stopped by the "stop" command, SIGTERM or Ctrl-C.
+
+        Raises:
+            RuntimeError: If another daemon is already serving the control socket.
+        """
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Before anything else, so a second daemon can't double up the schedules
+        self._remove_stale_socket()
+        self.reload()
+        warm_clients()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self.stop())
+
+        self._mailer = SMTPMailer()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.max_users), thread_name_prefix="user")
+        self._serve_control_socket()
+        print(f"Briefing daemon listening on {self.socket_path}.")
+        try:
+            while not self._stopping.is_set():
+                for user in self._due_users(datetime.now()):
+                    self._executor.submit(telemetry.bind(self.run_briefing), user, False)
+                # Re-check at least every minute, in case the clock jumps
+                wait_for = self._seconds_to_next_run()
+                self._wakeup.wait(60 if wait_for is None else min(wait_for, 60))
+                self._wakeup.clear()
+        finally:
+            print("Stopping the briefing daemon...")
+            self._server.shutdown()
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self._executor.shutdown(wait=True)
+            self._mailer.close()
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            response = self.server.briefer.handle(request)
+        except ValueError as e:
+            response = {"ok": False, "error": f"Bad request: {e}"}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, briefer):
+        self.briefer = briefer
+        super().__init__(path, _ControlHandler)
+
+
+def send_command(command, socket_path=None, timeout=None, **fields):
+    """
+    Sends one request to a running daemon and returns its response.
+
+    Args:
+        command (str): "brief", "status", "reload" or "stop".
+        socket_path (str, optional): Defaults to DAEMON_SOCKET.
+        timeout (float, optional): Seconds to wait for the answer. Defaults to
+                                   waiting as long as the briefing takes.
+        **fields: Extra request fields, e.g. user="alex".
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path or default_socket_path())
+        client.sendall(json.dumps({"command": command, **fields}).encode("utf-8") + b"\n")
+        with client.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without answering")
+    return json.loads(line)
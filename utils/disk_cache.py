@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from utils import telemetry
+
+
+def cache_key(*parts):
+    """Builds a content-addressed key (sha256 hex digest) from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Small on-disk JSON cache with TTL and size-bounded eviction.
+
+    Every entry is one file named after its key, so concurrent runs never
+    rewrite a shared index. Writes go through a temp file and an atomic rename.
+
+    Args:
+        directory (str): Directory holding the cache entries. Created if missing.
+        ttl (float, optional): Seconds an entry stays valid. None means no expiry.
+        max_entries (int, optional): Oldest entries are evicted beyond this count.
+        name (str, optional): Reported with hit/miss counts in the telemetry metrics.
+        stale_ttl (float, optional): Seconds an expired entry is kept for get_stale(),
+            the fallback when the upstream is down. Defaults to `ttl`.
+    """
+
+    def __init__(self, directory, ttl=None, max_entries=None, name=None, stale_ttl=None):
+        self.directory = directory
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = ttl if ttl is None or stale_ttl is None else max(ttl, stale_ttl)
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None if it is missing or expired."""
+        value, _ = self._read(key, self.ttl)
+        if self.name:
+            telemetry.cache_result(self.name, value is not None)
+        return value
+
+    def get_stale(self, key):
+        """
+        Returns the value for `key` even if it has expired, as long as it is
+        within `stale_ttl`. Returns (value, age in seconds), or (None, None).
+        """
+        return self._read(key, self.stale_ttl)
+
+    def _read(self, key, max_age):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+
+        age = time.time() - entry.get("stored_at", 0)
+        if max_age is not None and age > max_age:
+            if self.stale_ttl is not None and age > self.stale_ttl:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return None, None
+        return entry.get("value"), age
+
+    def set(self, key, value):
+        """Stores `value` (JSON-serializable) under `key`, then enforces TTL and size limits."""
+        entry = {"stored_at": time.time(), "value": value}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, separators=(",", ":"))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes entries past `stale_ttl`, then the oldest ones beyond `max_entries`."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self.stale_ttl is not None and now - mtime > self.stale_ttl:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            entries.append((mtime, path))
+
+        if self.max_entries is not None and len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
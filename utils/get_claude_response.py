@@ -1,51 +1,333 @@
-import os
+import sys
 import json
-from anthropic import Anthropic
-from dotenv import load_dotenv
-
-load_dotenv()
-client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-input_filename = os.getenv("PROMPT_INPUT_FILENAME")
-output_filename = os.getenv("PROMPT_OUTPUT_FILENAME")
-
-def generate_claude3_briefing(weather_info, tesla_info, commute_info):
-    response = client.messages.create(
-        model="claude-opus-4-20250514",
-        max_tokens=512,
-        temperature=0.6,
-        messages=[
-            {
-                "role": "user",
-                "content": f"""
-You're a friendly and cheerful daily commute assistant, sending a briefing the night prior to the commute. Based on the information below, generate a short daily briefing that includes:
+import time
+from utils.disk_cache import cache_key
+from utils.rate_limiter import api_slot
+from utils import telemetry, resilience
+from utils.config import get_setting, get_client
+from utils.prompt_renderer import render_weather, render_tesla, fit_commute, estimate_tokens
+
+MODEL = "claude-opus-4-20250514"
+MAX_TOKENS = 512
+TEMPERATURE = 0.6
+
+# USD per million tokens, for the per-briefing cost line
+INPUT_COST_PER_MTOK = 15.0
+OUTPUT_COST_PER_MTOK = 75.0
+
+# Shared by every user and every run, so it is sent as a cached system block
+SYSTEM_PROMPT = """You're a friendly and cheerful daily commute assistant, sending a briefing the night prior to the commute. Based on the information you are given, generate a short daily briefing that includes:
 - A specific outfit recommendation for the day based on temperature, weather conditions, and season. Mention tops, bottoms, layers, shoes, and accessories (e.g., umbrella, sunglasses, scarf, gloves). Vary your recommendations so they don’t sound repetitive.
 - commute recommendation (when to leave, traffic, battery drain). Don't suggest leaving too late, aim to be at the destination by 10:30AM max.
-- car battery level and whether charging is needed
+- car battery level and whether charging is needed"""
 
-Weather: {weather_info}
-Commute Info: {commute_info}
+def build_briefing_prompt(weather_info, tesla_info, commute_info):
+    return f"""Weather:
+{weather_info}
+Commute Info:
+{commute_info}
 Tesla Status: {tesla_info}
 """
+
+def fallback_briefing(weather_info, tesla_info, commute_info):
+    """The data itself, sent when Claude can't write the briefing."""
+    return ("Claude was unavailable, so here is tomorrow's information without the write-up.\n\n"
+            + build_briefing_prompt(weather_info, tesla_info, commute_info))
+
+def build_briefing_request(prompt):
+    """Messages API parameters for one briefing prompt."""
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "system": [
+            {
+                "type": "text",
+                "text": SYSTEM_PROMPT,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ],
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
             }
         ]
-    )
+    }
+
+def _briefing_cache_key(prompt):
+    return cache_key(MODEL, TEMPERATURE, MAX_TOKENS, SYSTEM_PROMPT, prompt)
+
+def count_prompt_tokens(prompt):
+    """
+    Input tokens for a prompt. Estimated locally unless CLAUDE_COUNT_TOKENS
+    is true, in which case the token counting endpoint is asked.
+    """
+    estimate = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt)
+    if get_setting("CLAUDE_COUNT_TOKENS", "false").lower() != "true":
+        return estimate
+    request = build_briefing_request(prompt)
+
+    def count():
+        with api_slot("anthropic"):
+            return get_client("anthropic").messages.count_tokens(
+                model=request["model"],
+                system=request["system"],
+                messages=request["messages"]
+            ).input_tokens
+
+    try:
+        return resilience.call("anthropic.count_tokens", count)
+    except resilience.UpstreamError as e:
+        print(f"Token counting unavailable ({e}), using the local estimate.")
+        return estimate
+
+def _report_usage(usage, cost_factor=1.0):
+    if usage is None:
+        return
+    # Cache reads bill at a tenth of the input price, cache writes at 1.25x
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    input_cost = (usage.input_tokens + cache_read * 0.1 + cache_write * 1.25) * INPUT_COST_PER_MTOK
+    cost = (input_cost + usage.output_tokens * OUTPUT_COST_PER_MTOK) / 1_000_000 * cost_factor
+    for kind, tokens in (("input", usage.input_tokens), ("output", usage.output_tokens),
+                         ("cache_read", cache_read), ("cache_write", cache_write)):
+        telemetry.increment("anthropic_tokens_total", tokens, model=MODEL, type=kind)
+    telemetry.increment("anthropic_cost_usd_total", cost, model=MODEL)
+    print(f"Claude usage: {usage.input_tokens} input ({cache_read} cached) / {usage.output_tokens} output tokens, ${cost:.4f}")
+
+class StreamInterrupted(Exception):
+    """The stream broke after text was shown; retrying would show it twice."""
+
+def _stream_briefing(client, request, on_text):
+    """Consumes the Messages streaming API, passing each text delta to `on_text` as it arrives."""
+    started = time.perf_counter()
+    first_token_s = None
+    chunks = []
+    try:
+        with client.messages.stream(**request) as stream:
+            for text in stream.text_stream:
+                if first_token_s is None:
+                    first_token_s = time.perf_counter() - started
+                chunks.append(text)
+                on_text(text)
+            _report_usage(stream.get_final_message().usage)
+    except Exception as e:
+        if chunks:
+            raise StreamInterrupted(f"stream broke after {len(chunks)} chunks: {e}") from e
+        raise
+    total_s = time.perf_counter() - started
+    telemetry.observe("anthropic_time_to_first_token_seconds", first_token_s or total_s, model=MODEL)
+    print(f"\nClaude stream: first token {first_token_s or total_s:.2f}s, total {total_s:.2f}s")
+    return "".join(chunks)
+
+def generate_claude3_briefing(weather_info, tesla_info, commute_info, use_cache=True, on_text=None):
+    """
+    Args:
+        use_cache (bool): Reuse a cached briefing for identical inputs.
+        on_text (callable, optional): When given, the briefing is streamed and
+            each text delta is passed to it as soon as it arrives.
+
+    Raises:
+        resilience.UpstreamError: If Claude can't be reached after retries.
+    """
+    prompt = build_briefing_prompt(weather_info, tesla_info, commute_info)
+    key = _briefing_cache_key(prompt)
+
+    # Briefings for identical inputs (e.g. a re-run after an SMTP failure) are reused
+    briefing_cache = get_client("briefing_cache")
+    if use_cache:
+        cached = briefing_cache.get(key)
+        if cached is not None:
+            print("Using cached briefing for identical inputs.")
+            if on_text:
+                on_text(cached)
+            return cached
+
+    request = build_briefing_request(prompt)
+
+    def attempt():
+        with telemetry.span("anthropic.messages", model=MODEL, stream=bool(on_text)), api_slot("anthropic"):
+            client = get_client("anthropic")
+            if on_text:
+                return _stream_briefing(client, request, on_text)
+            started = time.perf_counter()
+            response = client.messages.create(**request)
+            _report_usage(getattr(response, "usage", None))
+            print(f"Claude response: total {time.perf_counter() - started:.2f}s")
+            return response.content[0].text
+
+    briefing = resilience.call("anthropic.messages", attempt)
+    briefing_cache.set(key, briefing)
+    return briefing
+
+def _write_to_stdout(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def prepare_briefing_prompt(context, user=None):
+	"""
+	Renders a BriefingContext as the user message, trimmed to PROMPT_TOKEN_BUDGET.
+	Sections whose stage fell back to None are rendered as unavailable.
+	"""
+	weather_data, tesla_status, traffic_data = context.weather_data, context.tesla_status, context.traffic_data
+	if user:
+		origin_address, dest_address = user.origin_address, user.dest_address
+	else:
+		origin_address, dest_address = get_setting("ORIGIN_ADDRESS"), get_setting("DEST_ADDRESS")
+
+	weather = "\n".join([
+		render_weather("Origin", origin_address, weather_data.origin if weather_data else None),
+		render_weather("Destination", dest_address, weather_data.destination if weather_data else None)
+	])
+	tesla = render_tesla(tesla_status)
+	commute, tokens, trimmed = fit_commute(
+		traffic_data,
+		lambda section: count_prompt_tokens(build_briefing_prompt(weather, tesla, section)),
+		get_setting("PROMPT_TOKEN_BUDGET", 1200, int)
+	)
+	print(f"Prompt: {tokens} input tokens" + (f" after trimming {', '.join(trimmed)} options" if trimmed else ""))
+	return weather, tesla, commute
+
+def call_claude_api(context, user=None):
+	"""
+	Generates the briefing from an in-memory BriefingContext. The output file
+	(PROMPT_OUTPUT_FILENAME) is only written for the single-user setup.
+
+	If Claude can't be reached, the rendered data is sent as the briefing
+	instead, unless CLAUDE_FALLBACK_BRIEFING is false.
+	"""
+	weather, tesla, commute = prepare_briefing_prompt(context, user)
+
+	# Stream to the terminal for single-user, on-demand runs; concurrent batch
+	# users would interleave their output
+	stream = get_setting("CLAUDE_STREAM", "true").lower() == "true" and not user
+	try:
+		briefing = generate_claude3_briefing(weather, tesla, commute, on_text=_write_to_stdout if stream else None)
+	except resilience.UpstreamError as e:
+		if get_setting("CLAUDE_FALLBACK_BRIEFING", "true").lower() != "true":
+			raise
+		print(f"Claude unavailable ({e}). Sending the data without the write-up.")
+		briefing, stream = fallback_briefing(weather, tesla, commute), False
+
+	output_filename = get_setting("PROMPT_OUTPUT_FILENAME")
+	if output_filename and not user:
+		with open(output_filename, "w") as f:
+			json.dump({"claude_output": briefing}, f, indent=4)
+
+	if not stream:
+		print(briefing)
+	return briefing
+
+
+# --- Message Batches ---
+
+BATCH_COST_FACTOR = 0.5  # batch requests bill at half price
+
+def generate_briefings_batch(prompts, on_result, use_cache=True, poll_interval=None, timeout=None):
+    """
+    Generates many briefings through one Message Batch and calls
+    `on_result(key, briefing, error)` for each as soon as its result is read.
+    Cached briefings are reported straight away and not submitted.
+
+    Args:
+        prompts (dict): key -> (weather_info, tesla_info, commute_info).
+        on_result (callable): Called once per key; `briefing` is None on failure.
+        use_cache (bool): Reuse cached briefings for identical inputs.
+        poll_interval (float, optional): Seconds between status polls (CLAUDE_BATCH_POLL_INTERVAL, default 30).
+        timeout (float, optional): Seconds to wait for the batch (CLAUDE_BATCH_TIMEOUT, default 6 hours).
+    """
+    if poll_interval is None:
+        poll_interval = get_setting("CLAUDE_BATCH_POLL_INTERVAL", 30, float)
+    if timeout is None:
+        timeout = get_setting("CLAUDE_BATCH_TIMEOUT", 6 * 60 * 60, float)
+    briefing_cache = get_client("briefing_cache")
+
+    # custom_id only allows [a-zA-Z0-9_-], so keys are mapped to positions
+    pending = {}
+    for i, (key, parts) in enumerate(prompts.items()):
+        prompt = build_briefing_prompt(*parts)
+        cached = briefing_cache.get(_briefing_cache_key(prompt)) if use_cache else None
+        if cached is not None:
+            on_result(key, cached, None)
+        else:
+            pending[f"briefing-{i}"] = (key, prompt)
+    if not pending:
+        return
+
+    client = get_client("anthropic")
+
+    def create():
+        with telemetry.span("anthropic.batch_create", requests=len(pending)), api_slot("anthropic"):
+            return client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": build_briefing_request(prompt)}
+                for custom_id, (_, prompt) in pending.items()
+            ])
+
+    def poll():
+        with telemetry.span("anthropic.batch_poll", batch_id=batch.id), api_slot("anthropic"):
+            return client.messages.batches.retrieve(batch.id)
 
-    return response.content[0].text
+    # A retried create could submit (and bill) the batch twice
+    batch = resilience.call("anthropic.batch_create", create, resilience.with_overrides(resilience.policy("anthropic"), attempts=1))
+    print(f"Submitted message batch {batch.id} with {len(pending)} briefings.")
 
-def call_claude_api():
-	
-	# Example
-	with open(input_filename, "r") as f:
-		data = json.load(f)
-		
+    started = time.perf_counter()
+    while batch.processing_status != "ended":
+        if time.perf_counter() - started > timeout:
+            try:
+                resilience.call("anthropic.batch_cancel", lambda: client.messages.batches.cancel(batch.id))
+            except resilience.UpstreamError as e:
+                print(f"Could not cancel message batch {batch.id}: {e}")
+            for key, _ in pending.values():
+                on_result(key, None, f"message batch {batch.id} timed out")
+            return
+        time.sleep(poll_interval)
+        try:
+            batch = resilience.call("anthropic.batch_poll", poll)
+        except resilience.UpstreamError as e:
+            # The batch carries on server-side; try again at the next poll
+            print(f"Polling message batch {batch.id} failed: {e}")
+    print(f"Message batch {batch.id} ended after {time.perf_counter() - started:.1f}s.")
 
-	weather = "Weather in {}: high of {}F and low of {} with description {}. Weather in {}: high of {}F and low of {} with description {}".format(os.getenv("ORIGIN_ADDRESS"), os.getenv("DEST_ADDRESS"), data["weather_data"]["origin"]["min_temp"], data["weather_data"]["origin"]["max_temp"], data["weather_data"]["origin"]["description"],
-	data["weather_data"]["destination"]["min_temp"], data["weather_data"]["destination"]["max_temp"], data["weather_data"]["destination"]["description"])
-	tesla = "{}% battery remaining. Charging state: {} . Estimated range: {} miles.".format(data["tesla_status"]["battery_level"],data["tesla_status"]["charge_state"], data["tesla_status"]["battery_range"] )
-	commute = "Commute Distance: {}, Minimum Battery Drainage: {}, Commute Options: {}".format(data["traffic_data"]["commute_distance"], data["traffic_data"]["minimum_battery_drainage"], data["traffic_data"]["commute_options"])
+    try:
+        results = resilience.call("anthropic.batch_results", lambda: client.messages.batches.results(batch.id))
+    except resilience.UpstreamError as e:
+        for key, _ in pending.values():
+            on_result(key, None, f"results of message batch {batch.id} unavailable: {e}")
+        return
 
+    # Results stream in as JSONL; each briefing is handed off as it is decoded
+    stream_error = None
+    entries = iter(results)
+    while True:
+        try:
+            entry = next(entries)
+        except StopIteration:
+            break
+        except Exception as e:
+            # A dropped connection or a malformed line ends the stream; every
+            # briefing not read yet is reported as failed below
+            stream_error = f"results of message batch {batch.id} cut off: {str(e) or type(e).__name__}"
+            print(f"Reading the {stream_error}")
+            break
+        found = pending.pop(getattr(entry, "custom_id", None), None)
+        if found is None:
+            continue
+        key, prompt = found
+        try:
+            if entry.result.type == "succeeded":
+                message = entry.result.message
+                briefing, error = message.content[0].text, None
+                _report_usage(message.usage, BATCH_COST_FACTOR)
+                briefing_cache.set(_briefing_cache_key(prompt), briefing)
+            else:
+                # errored results wrap an API error body; canceled/expired carry nothing
+                body = getattr(getattr(entry.result, "error", None), "error", None)
+                briefing, error = None, f"{entry.result.type}: {body.message}" if body else entry.result.type
+        except (AttributeError, IndexError, TypeError) as e:
+            briefing, error = None, f"malformed batch result: {str(e) or type(e).__name__}"
+        on_result(key, briefing, error)
 
-	with open(output_filename, "w") as f:
-		json.dump({"claude_output": generate_claude3_briefing(weather, tesla, commute)}, f, indent=4)
-		
-	print(generate_claude3_briefing(weather, tesla, commute))
+    for key, _ in pending.values():
+        on_result(key, None, stream_error or "missing from batch results")
@@ -1,39 +1,17 @@
-import os
-import googlemaps
 from datetime import datetime, timedelta
-import time
-from dotenv import load_dotenv
-import json
+from utils.briefing_context import TrafficData
+from utils.route_model import RouteRecord
+from utils.config import get_setting
+from utils.routing_backend import routing_backend
 
-load_dotenv()
-gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"))
-output_filename = os.getenv("PROMPT_INPUT_FILENAME")
-
-def estimate_battery_drain(distance_miles, drain_per_mile=0.5):
-    return round(distance_miles * drain_per_mile, 1)
-    
-    
 def get_commute_estimate(origin, destination, departure_time=None):
     if not departure_time:
         departure_time = datetime.now()
 
-    result = gmaps.distance_matrix(
-        origins=origin,
-        destinations=destination,
-        departure_time=departure_time,
-        units="imperial",
-        traffic_model="best_guess"
-    )
-
-    duration_in_traffic = result["rows"][0]["elements"][0]["duration_in_traffic"]["text"]
-    distance = result["rows"][0]["elements"][0]["distance"]["text"]
-    # print(distance)
-    
-    return {
-        "duration": duration_in_traffic,
-        "distance": distance,
-		"battery_drainage": estimate_battery_drain(float(distance.split(" ")[0]))
-    }
+    estimate = routing_backend().commute_estimates([(origin, destination)], departure_time).get((origin, destination))
+    if estimate is None:
+        raise ValueError(f"No commute estimate available from {origin} to {destination}")
+    return estimate
 
 
 def get_30_min_intervals(origin, destination):
@@ -46,72 +24,21 @@ def get_30_min_intervals(origin, destination):
     results = []
     for departure_time in intervals:
         try:
-            directions_result = gmaps.directions(
-                origin,
-                destination,
-                mode="driving",
-                departure_time=departure_time,
-                traffic_model="best_guess"
-            )
-            if not directions_result:
-                results.append({
-                    "departure_time": departure_time,
-                    "duration_in_traffic": None,
-                    "error": "No results"
-                })
-                continue
-
-			
-            leg = directions_result[0]["legs"][0]
-            duration_in_traffic = leg["duration_in_traffic"]["text"]
-            results.append({
-                "departure_time": departure_time,
-                "duration_in_traffic": duration_in_traffic,
-                "error": None
-            })
-
-            time.sleep(1)  # to avoid rate limits
-
+            # Best route only; the backend paces Maps calls itself
+            results.append(routing_backend().departure_routes(origin, destination, departure_time, alternatives=False)[0])
         except Exception as e:
-            results.append({
-                "departure_time": departure_time,
-                "duration_in_traffic": None,
-                "error": str(e)
-            })
+            results.append(RouteRecord(departure_time=departure_time, error=str(e)))
     
     return results
 
 def maps_api_call():
 
-	estimate = get_commute_estimate(os.getenv("ORIGIN_ADDRESS"), os.getenv("DEST_ADDRESS"))
+	estimate = get_commute_estimate(get_setting("ORIGIN_ADDRESS"), get_setting("DEST_ADDRESS"))
 #	print(estimate)
 
-	traffic_data = get_30_min_intervals(os.getenv("ORIGIN_ADDRESS"), os.getenv("DEST_ADDRESS"))
-#	for entry in traffic_data:
-#			dt_str = entry["departure_time"].strftime("%Y-%m-%d %I:%M %p")
-#			if entry["error"]:
-#				print(f"{dt_str} - Error: {entry['error']}")
-#			else:
-#				print(f"{dt_str} - Duration in traffic: {entry['duration_in_traffic']}")
+	traffic_data = get_30_min_intervals(get_setting("ORIGIN_ADDRESS"), get_setting("DEST_ADDRESS"))
 
-	output_object = {"commute_distance": estimate['distance'], "minimum_battery_drainage": estimate['battery_drainage']}
-	
-	times_to_commute = []
-	
-	for entry in traffic_data:
-		dt = entry["departure_time"].strftime("%Y-%m-%d %I:%M %p")
-		duration_mins = entry['duration_in_traffic']
-		times_to_commute.append({"departure_datetime": dt, "commute_duration": duration_mins})
-
-	output_object['commute_options'] = times_to_commute
-	
-	with open(output_filename, "r") as f:
-		data = json.load(f)
-		
-	data["traffic_data"] = output_object
-	
-	with open(output_filename, "w") as f:
-		json.dump(data, f, indent=4)
+	return TrafficData(commute_distance_m=estimate['distance_m'], minimum_battery_drainage=estimate['battery_drainage'], routes=traffic_data)
 		
 #if __name__ == '__main__':
 #	main()
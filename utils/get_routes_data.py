@@ -1,144 +1,345 @@
-import os
-import googlemaps
 from datetime import datetime, timedelta
-import time
-from dotenv import load_dotenv
-import json
-import re
-
-load_dotenv()
-gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"))
-output_filename = os.getenv("PROMPT_INPUT_FILENAME")
-
-def estimate_battery_drain(distance_miles, drain_per_mile=0.5):
-    return round(distance_miles * drain_per_mile, 1)
-    
-    
-def get_commute_estimate(origin, destination, departure_time=None):
+from utils.briefing_context import TrafficData
+from utils.route_model import RouteRecord, battery_drain, freeways as freeway_registry
+from concurrent.futures import ThreadPoolExecutor
+from utils import telemetry, resilience
+from utils.single_flight import SingleFlight
+from utils.config import get_setting, get_client
+from utils.traffic_history import route_key, departure_slot
+from utils.routing_backend import routing_backend
+
+
+def get_commute_estimates(pairs, departure_time=None):
+    """
+    Estimates many commutes through the routing backend (batched Distance
+    Matrix calls with the default Google backend).
+
+    Args:
+        pairs (iterable): (origin, destination) tuples. Duplicates are fetched once.
+        departure_time (datetime, optional): Defaults to now.
+
+    Returns:
+        dict: (origin, destination) -> estimate dict, or None if there is no route.
+
+    Raises:
+        resilience.UpstreamError: If the backend can't be reached.
+    """
     if not departure_time:
         departure_time = datetime.now()
+    return routing_backend().commute_estimates(list(dict.fromkeys(pairs)), departure_time)
+
+
+def get_commute_estimate(origin, destination, departure_time=None):
+    estimate = get_commute_estimates([(origin, destination)], departure_time).get((origin, destination))
+    if estimate is None:
+        raise ValueError(f"No commute estimate available from {origin} to {destination}")
+    return estimate
+
+
+def get_departure_times(start_hour=None, step_minutes=None, count=None):
+    """
+    Builds tomorrow's departure window. Defaults come from DEPARTURE_START_HOUR,
+    DEPARTURE_STEP_MINUTES and DEPARTURE_COUNT (8:00 to 11:00 every 30 minutes).
+    """
+    if start_hour is None:
+        start_hour = float(get_setting("DEPARTURE_START_HOUR", 8))
+    if step_minutes is None:
+        step_minutes = int(get_setting("DEPARTURE_STEP_MINUTES", 30))
+    if count is None:
+        count = int(get_setting("DEPARTURE_COUNT", 7))
+
+    tomorrow = datetime.now() + timedelta(days=1)
+    start_time = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=start_hour)
+
+    return [start_time + timedelta(minutes=step_minutes * i) for i in range(count)]
 
-    result = gmaps.distance_matrix(
-        origins=origin,
-        destinations=destination,
+
+def get_departure_routes(origin, destination, departure_time):
+    """
+    Fetches every alternative route for a single departure time. A failed
+    lookup (after retries) is returned as one record with `error` set.
+    """
+    return routing_backend().departure_routes(origin, destination, departure_time)
+
+
+def predicted_route(departure_time, prediction):
+    """Builds a route record for a slot answered from the traffic history."""
+    return RouteRecord(
         departure_time=departure_time,
-        units="imperial",
-        traffic_model="best_guess"
+        duration_s=round(prediction.p50),
+        distance_m=prediction.distance_m,
+        freeway_ids=freeway_registry.intern_all(prediction.freeways),
+        source="history",
+        p10_s=prediction.p10,
+        p90_s=prediction.p90,
+        history_samples=prediction.samples
     )
 
-    duration_in_traffic = result["rows"][0]["elements"][0]["duration_in_traffic"]["text"]
-    distance = result["rows"][0]["elements"][0]["distance"]["text"]
-    # print(distance)
-    
-    return {
-        "duration": duration_in_traffic,
-        "distance": distance,
-		"battery_drainage": estimate_battery_drain(float(distance.split(" ")[0]))
-    }
 
+def _history_settings():
+    # Only live traffic is worth recording, or worth skipping a lookup for
+    enabled = get_setting("TRAFFIC_HISTORY", "true").lower() == "true" and routing_backend().live_traffic
+    history = get_client("traffic_history") if enabled else None
+    max_age_s = get_setting("HISTORY_MAX_AGE_DAYS", 14, float) * 24 * 60 * 60
+    return history, get_setting("HISTORY_MIN_SAMPLES", 4, int), get_setting("HISTORY_MAX_SPREAD", 0.2, float), max_age_s
+
+
+def probe_departures(origin, destination, departure_times, max_workers=None):
+    """
+    Looks up every alternative route for each departure time. Requests are
+    paced by the shared Maps token bucket (MAPS_QPS) rather than a fixed
+    sleep per call.
+
+    With the traffic history enabled (TRAFFIC_HISTORY, on by default), times
+    whose slot history is plentiful, tight and recent are predicted instead of
+    probed, and every live result is recorded for future runs. A probe that
+    fails is answered from whatever history the slot has, however thin.
 
-def get_30_min_intervals(origin, destination):
-    now = datetime.now()
-    tomorrow = now + timedelta(days=1)
-    start_time = tomorrow.replace(hour=8, minute=0, second=0, microsecond=0)
+    Returns:
+        tuple: ({departure time: [RouteRecord, ...]}, number of live Directions probes)
+    """
+    if max_workers is None:
+        max_workers = int(get_setting("MAPS_MAX_WORKERS", 8))
+
+    history, min_samples, max_spread, max_age_s = _history_settings()
+    key = route_key(origin, destination)
+    predictions = {}
+    if history and departure_times:
+        predictions = history.predict(key, departure_times[0].weekday(), [departure_slot(t) for t in departure_times])
+
+    live_times = []
+    for departure_time in departure_times:
+        prediction = predictions.get(departure_slot(departure_time))
+        confident = bool(prediction and prediction.is_confident(min_samples, max_spread, max_age_s))
+        if history:
+            telemetry.cache_result("traffic_history", confident)
+        if not confident:
+            live_times.append(departure_time)
 
-    intervals = [start_time + timedelta(minutes=30 * i) for i in range(7)]  # 8:00 to 11:00
     print("Retreiving...")
-    results = []
-    for departure_time in intervals:
-        try:
-            directions_result = gmaps.directions(
-                origin,
-                destination,
-                mode="driving",
-                departure_time=departure_time,
-                traffic_model="best_guess",
-                alternatives=True
-            )
-            if not directions_result:
-                results.append({
-                    "departure_time": departure_time,
-                    "duration_in_traffic": None,
-                    "distance":None,
-                    "route_freeways": None,
-                    "error": "No results"
-                })
-                continue
-                
-            for route in directions_result:
-                leg = route["legs"][0]
-                duration_in_traffic = leg["duration_in_traffic"]["text"]
-                distance_ = leg["distance"]["text"]
-                
-                
-                ## Extract freeway info
-                freeways = []
-                for step in leg["steps"]:
-                    instr = step.get("html_instructions", "")
-                    frwy = re.findall(r"\b(?:I|US|CA)[- ]?\d+\b", instr)
-                    freeways.extend(frwy)
-                        
-                # Deduplicate while keeping order
-                seen, ordered = set(), []
-                for h in freeways:
-                    if h not in seen:
-                        seen.add(h)
-                        ordered.append(h)
-
-                results.append({
-                    "departure_time": departure_time,
-                    "duration_in_traffic": duration_in_traffic,
-                    "distance":distance_,
-                    "route_freeways": ordered,
-                    "error": None
-                })
-
-            time.sleep(1)  # to avoid rate limits
-
-        except Exception as e:
-            results.append({
-                "departure_time": departure_time,
-                "duration_in_traffic": None,
-                "distance":None,
-                "route_freeways": None,
-                "error": str(e)
-            })
+    if len(live_times) < len(departure_times):
+        print(f"Using traffic history for {len(departure_times) - len(live_times)} of {len(departure_times)} departure times.")
+
+    live_results = {}
+    if live_times:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(live_times)))) as executor:
+            # Each probe gets its own copy of the caller's span context
+            futures = [executor.submit(telemetry.bind(get_departure_routes), origin, destination, t) for t in live_times]
+            for departure_time, future in zip(live_times, futures):
+                live_results[departure_time] = future.result()
+
+    results = {}
+    for departure_time in departure_times:
+        prediction = predictions.get(departure_slot(departure_time))
+        if departure_time not in live_results:
+            results[departure_time] = [predicted_route(departure_time, prediction)]
+            continue
+
+        routes = live_results[departure_time]
+        if prediction and all(route.error for route in routes):
+            results[departure_time] = [predicted_route(departure_time, prediction)]
+            continue
+        observed = [(r.duration_s, r.distance_m, r.freeway_names) for r in routes if not r.error]
+        if history and observed:
+            history.record(key, departure_time, observed)
+        for route in routes:
+            if prediction and not route.error:
+                route.p10_s, route.p90_s, route.history_samples = prediction.p10, prediction.p90, prediction.samples
+        results[departure_time] = routes
+    return results, len(live_times)
+
+
+def get_30_min_intervals(origin, destination, start_hour=None, step_minutes=None, count=None, max_workers=None):
+    """
+    Probes every departure time in the window concurrently (see probe_departures).
+    Results are returned in departure time order.
+    """
+    intervals = get_departure_times(start_hour, step_minutes, count)
+    routes_by_time, _ = probe_departures(origin, destination, intervals, max_workers)
     # print(results)
-    return results
+    return [route for departure_time in intervals for route in routes_by_time[departure_time]]
+
+
+# --- Adaptive departure search ---
+
+def _floor_to_resolution(departure_time, resolution):
+    midnight = departure_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + ((departure_time - midnight) // resolution) * resolution
+
+
+def refinement_candidates(routes_by_time, resolution, change_threshold):
+    """
+    Picks the departure times worth probing next: the midpoints of the gaps
+    next to the fastest departure, and of gaps across which the fastest trip
+    changes by at least `change_threshold` (relative to the overall fastest).
+    Gaps narrower than twice `resolution` are left alone.
+
+    Returns:
+        list: Midpoints, most promising first: by how close the faster end of the
+              gap is to the fastest trip, then by size of the change.
+    """
+    fastest_by_time = {}
+    for departure_time, routes in routes_by_time.items():
+        durations = [route.duration_s for route in routes if not route.error and route.duration_s is not None]
+        if durations:
+            fastest_by_time[departure_time] = min(durations)
+    known = sorted(fastest_by_time.items())
+    if len(known) < 2:
+        return []
+
+    fastest = min(duration for _, duration in known)
+    scored = []
+    for (t0, d0), (t1, d1) in zip(known, known[1:]):
+        if t1 - t0 < 2 * resolution:
+            continue
+        near_fastest = min(d0, d1) == fastest
+        change = abs(d1 - d0) / fastest if fastest else 0
+        if not near_fastest and change < change_threshold:
+            continue
+        midpoint = _floor_to_resolution(t0 + (t1 - t0) / 2, resolution)
+        if t0 < midpoint < t1 and midpoint not in routes_by_time:
+            # A gap whose faster end is near the fastest trip is likelier to hide a faster one
+            distance = (min(d0, d1) - fastest) / fastest if fastest else 0
+            scored.append((distance, -change, midpoint))
+    scored.sort(key=lambda entry: (entry[0], entry[1]))
+    return [midpoint for _, _, midpoint in scored]
+
+
+def _spread(departure_times, count):
+    """Up to `count` of the departure times, spread evenly and keeping both ends of the window."""
+    if count >= len(departure_times):
+        return list(departure_times)
+    if count < 2:
+        return list(departure_times[:count])
+    last = len(departure_times) - 1
+    return [departure_times[round(i * last / (count - 1))] for i in range(count)]
+
+
+def adaptive_departure_search(origin, destination, start_hour=None, step_minutes=None, count=None,
+                              resolution_minutes=None, max_probes=None, change_threshold=None, round_probes=None,
+                              max_workers=None):
+    """
+    Coarse-to-fine departure search. The usual departure grid is probed
+    first; then each round bisects the gaps around the fastest departure and
+    across sharp changes in duration_in_traffic, until the gaps are down to
+    DEPARTURE_RESOLUTION_MINUTES or DEPARTURE_MAX_PROBES live Directions
+    probes have been made. Departures answered from the traffic history
+    don't count against the cap.
+
+    Args:
+        resolution_minutes (int, optional): Finest spacing between departures. Defaults to 5.
+        max_probes (int, optional): Cap on live Directions probes. Defaults to twice the grid size.
+        change_threshold (float, optional): Relative change in the fastest trip that
+            marks a gap for refinement (DEPARTURE_CHANGE_THRESHOLD, default 0.1).
+        round_probes (int, optional): Probes per refinement round, spent on the most
+            promising gaps (DEPARTURE_ROUND_PROBES, default 4).
 
-def maps_api_call():
+    Returns:
+        list: RouteRecords in departure time order.
+    """
+    grid = get_departure_times(start_hour, step_minutes, count)
+    if resolution_minutes is None:
+        resolution_minutes = get_setting("DEPARTURE_RESOLUTION_MINUTES", 5, int)
+    if max_probes is None:
+        max_probes = get_setting("DEPARTURE_MAX_PROBES", 2 * len(grid), int)
+    if change_threshold is None:
+        change_threshold = get_setting("DEPARTURE_CHANGE_THRESHOLD", 0.1, float)
+    if round_probes is None:
+        round_probes = get_setting("DEPARTURE_ROUND_PROBES", 4, int)
+    if max_workers is None:
+        max_workers = int(get_setting("MAPS_MAX_WORKERS", 8))
+    resolution = timedelta(minutes=max(resolution_minutes, 1))
+    round_probes = max(round_probes, 1)
 
-	estimate = get_commute_estimate(os.getenv("ORIGIN_ADDRESS"), os.getenv("DEST_ADDRESS"))
+    # A cap below the grid size thins the grid out rather than cutting off the late departures
+    routes_by_time, probes = probe_departures(origin, destination, _spread(grid, max_probes), max_workers)
+    rounds = 1
+    while probes < max_probes:
+        candidates = refinement_candidates(routes_by_time, resolution, change_threshold)
+        if not candidates:
+            break
+        # One concurrent round of probes at a time, so each round can use the last one's results
+        refined, calls = probe_departures(origin, destination, candidates[:min(round_probes, max_probes - probes)], max_workers)
+        routes_by_time.update(refined)
+        probes += calls
+        rounds += 1
+
+    telemetry.increment("departure_search_probes_total", probes, mode="adaptive")
+    print(f"Adaptive departure search: {len(routes_by_time)} departure times in {rounds} round(s), {probes} Directions probes.")
+    return [route for departure_time in sorted(routes_by_time) for route in routes_by_time[departure_time]]
+
+
+def _estimate_from_routes(routes):
+	distances = [route.distance_m for route in routes if not route.error and route.distance_m is not None]
+	if not distances:
+		return None
+	return {"distance_m": min(distances), "battery_drainage": float(battery_drain(min(distances)))}
+
+def get_traffic_data(origin, destination):
+	"""
+	Builds the TrafficData for one origin/destination pair. If the Distance
+	Matrix estimate fails or has no route (e.g. ZERO_RESULTS), the shortest
+	route found by the probes stands in.
+	"""
+	try:
+		estimate = shared_estimates.do((origin, destination), get_commute_estimate, origin, destination)
+	except (resilience.UpstreamError, ValueError) as e:
+		print(f"Commute estimate unavailable ({e}), using the probed routes instead.")
+		estimate = None
 #	print(estimate)
 
-	traffic_data = get_30_min_intervals(os.getenv("ORIGIN_ADDRESS"), os.getenv("DEST_ADDRESS"))
-#	for entry in traffic_data:
-#			dt_str = entry["departure_time"].strftime("%Y-%m-%d %I:%M %p")
-#			if entry["error"]:
-#				print(f"{dt_str} - Error: {entry['error']}")
-#			else:
-#				print(f"{dt_str} - Duration in traffic: {entry['duration_in_traffic']}")
-
-	output_object = {"commute_distance": estimate['distance'], "minimum_battery_drainage": estimate['battery_drainage']}
-	
-	times_to_commute = []
-	
-	for entry in traffic_data:
-		dt = entry["departure_time"].strftime("%Y-%m-%d %I:%M %p")
-		duration_mins = entry['duration_in_traffic']
-		route_distance = entry["distance"]
-		route_info = entry["route_freeways"]
-		times_to_commute.append({"departure_datetime": dt, "commute_duration": duration_mins, "route_info": route_info, "route_distance": route_distance})
-
-	output_object['commute_options'] = times_to_commute
-	
-	with open(output_filename, "r") as f:
-		data = json.load(f)
-		
-	data["traffic_data"] = output_object
-	
-	with open(output_filename, "w") as f:
-		json.dump(data, f, indent=4)
+	# DEPARTURE_SEARCH=adaptive refines around the best departure instead of a fixed grid
+	if get_setting("DEPARTURE_SEARCH", "grid").lower() == "adaptive":
+		traffic_data = adaptive_departure_search(origin, destination)
+	else:
+		traffic_data = get_30_min_intervals(origin, destination)
+
+	estimate = estimate or _estimate_from_routes(traffic_data)
+	if estimate is None:
+		raise RuntimeError(f"No route from {origin} to {destination} could be fetched")
+	return TrafficData(commute_distance_m=estimate['distance_m'], minimum_battery_drainage=estimate['battery_drainage'], routes=traffic_data)
+
+def predicted_traffic_data(user=None):
+	"""
+	Fallback for the traffic stage: every departure time answered from the
+	traffic history, whatever its confidence. Returns None without history.
+	"""
+	if user:
+		origin, destination = user.origin_address, user.dest_address
+	else:
+		origin, destination = get_setting("ORIGIN_ADDRESS"), get_setting("DEST_ADDRESS")
+	if get_setting("TRAFFIC_HISTORY", "true").lower() != "true":
+		return None
+
+	intervals = get_departure_times()
+	predictions = get_client("traffic_history").predict(
+		route_key(origin, destination), intervals[0].weekday(), [departure_slot(t) for t in intervals]) if intervals else {}
+	routes = [predicted_route(t, predictions[departure_slot(t)]) for t in intervals if departure_slot(t) in predictions]
+	if not routes:
+		print("Traffic data unavailable and no traffic history to fall back to.")
+		return None
+	print(f"Traffic data unavailable. Using traffic history for {len(routes)} of {len(intervals)} departure times.")
+	estimate = _estimate_from_routes(routes)
+	return TrafficData(commute_distance_m=estimate['distance_m'], minimum_battery_drainage=estimate['battery_drainage'], routes=routes)
+
+
+# Users with the same origin and destination share one set of lookups
+shared_routes = SingleFlight()
+shared_estimates = SingleFlight()
+
+def prefetch_commute_estimates(pairs):
+	"""Fetches estimates for many pairs in a few batched calls, for get_traffic_data to reuse."""
+	for pair, estimate in get_commute_estimates(pairs).items():
+		if estimate is not None:
+			shared_estimates.prime(pair, estimate)
+
+def maps_api_call(user=None):
+	if user:
+		origin, destination = user.origin_address, user.dest_address
+	else:
+		origin, destination = get_setting("ORIGIN_ADDRESS"), get_setting("DEST_ADDRESS")
+
+	return shared_routes.do((origin, destination), get_traffic_data, origin, destination)
 #		
 #def main():
 #    maps_api_call()
@@ -1,123 +1,123 @@
 import os
-import requests
 import json
 import time
-from dotenv import load_dotenv
+import random
+import tempfile
+from utils.briefing_context import TeslaStatus
+from utils import telemetry, resilience, http_client
+from utils.config import get_setting, get_client
 
 # --- Configuration ---
-load_dotenv()
-
-CLIENT_ID = os.getenv("TESLA_CLIENT_ID")
-CLIENT_SECRET = os.getenv("TESLA_CLIENT_SECRET")
-REDIRECT_URI = os.getenv("TESLA_REDIRECT_URI")
-TESLA_REGION = os.getenv("TESLA_REGION", "na") # default region North America
+# Settings are read on use: TESLA_CLIENT_ID, TESLA_CLIENT_SECRET, TESLA_REGION,
+# TESLA_API_BASE_URL, TOKEN_FILE (current access/refresh tokens and their expiry time; see
+# utils.token_store for TESLA_TOKEN_* refresh settings) and
+# VEHICLE_SNAPSHOT_FILE / VEHICLE_SNAPSHOT_MAX_AGE (last known vehicle ID and
+# charge state, used instead of waking a sleeping car).
 
 # Tesla API Endpoints
 AUTH_BASE_URL = "https://fleet-auth.prd.vn.cloud.tesla.com/oauth2/v3/token"
-API_BASE_URL = f"https://fleet-api.prd.{TESLA_REGION}.vn.cloud.tesla.com/api/1"
 
-# File to store current tokens (access_token, refresh_token, and their expiry time)
-TOKEN_FILE = os.getenv("TOKEN_FILE")
-output_filename = os.getenv("PROMPT_INPUT_FILENAME")
+def api_base_url():
+    # TESLA_API_BASE_URL overrides the regional endpoint (e.g. a local fixture server)
+    override = get_setting("TESLA_API_BASE_URL")
+    if override:
+        return override.rstrip("/")
+    region = get_setting("TESLA_REGION", "na") # default region North America
+    return f"https://fleet-api.prd.{region}.vn.cloud.tesla.com/api/1"
 
-# --- Token Management Functions ---
+def client_credentials():
+    return get_setting("TESLA_CLIENT_ID"), get_setting("TESLA_CLIENT_SECRET")
 
-def load_tokens():
-    """Loads tokens from a local JSON file."""
-    if os.path.exists(TOKEN_FILE):
-        try:
-            with open(TOKEN_FILE, 'r') as f:
-                tokens = json.load(f)
-                # print(f"Tokens loaded from {TOKEN_FILE}.")
-                return tokens
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from. File might be corrupted.")
-            return None
-    print(f"No tokens file found.")
-    return None
+async def tesla_request_async(endpoint, method, url, allow_status=(), span_attributes=None, retry_policy=None, **kwargs):
+    """
+    Makes one Tesla API request on the shared HTTP loop, under the shared
+    retry policy (utils.resilience).
 
-def save_tokens(tokens):
-    """Saves tokens to a local JSON file."""
-    try:
-        with open(TOKEN_FILE, 'w') as f:
-            json.dump(tokens, f, indent=4)
-        print(f"Tokens saved.")
-    except IOError as e:
-        print(f"Error saving tokens: {e}")
+    Args:
+        endpoint (str): Span and endpoint name, e.g. "tesla.vehicle_data".
+        method (str): HTTP method.
+        url (str): Request URL.
+        allow_status (tuple): Error statuses returned to the caller instead of raised (e.g. 408).
+        span_attributes (dict, optional): Extra span attributes, e.g. the vehicle ID.
+        retry_policy (resilience.RetryPolicy, optional): Overrides the "tesla" policy.
+        **kwargs: Passed on to http_client.request (headers, data, params...).
+
+    Raises:
+        resilience.UpstreamError: Once retries are exhausted or the error is permanent.
+    """
+    async def attempt():
+        with telemetry.span(endpoint, **(span_attributes or {})) as call:
+            response = await http_client.request(method, url, api="tesla", timeout=resilience.attempt_timeout("tesla"), **kwargs)
+            call.set(http_status=response.status_code)
+            if response.status_code not in allow_status:
+                response.raise_for_status()
+        return response
+    return await resilience.call_async(endpoint, attempt, retry_policy)
+
+def tesla_request(endpoint, method, url, allow_status=(), span_attributes=None, retry_policy=None, **kwargs):
+    """Blocking form of tesla_request_async, for callers outside the HTTP loop."""
+    return http_client.run(tesla_request_async(endpoint, method, url, allow_status, span_attributes, retry_policy, **kwargs))
+
+def print_request_error(message, error):
+    """Prints an UpstreamError, with the response body when the API sent one."""
+    print(f"{message}: {error}")
+    response = getattr(error.cause, "response", None)
+    if response is not None and response.text:
+        print(f"Response content: {response.text}")
+
+# --- Token Management Functions ---
 
 def refresh_access_token(current_refresh_token):
     """Refreshes the access token using the refresh token."""
     print("Attempting to refresh access token...")
+    client_id, client_secret = client_credentials()
     payload = {
         'grant_type': 'refresh_token',
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
+        'client_id': client_id,
+        'client_secret': client_secret,
         'refresh_token': current_refresh_token,
-        'audience': API_BASE_URL.replace("/api/1", "") 
+        'audience': api_base_url().replace("/api/1", "") 
     }
     headers = {
         'Content-Type': 'application/x-www-form-urlencoded'
     }
 
+    # Not retried: Tesla may have rotated the refresh token before the response
+    # was lost, and a retry would spend the retired one. The token manager's next
+    # attempt re-reads the token file instead.
     try:
-        response = requests.post(AUTH_BASE_URL, data=payload, headers=headers)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        new_tokens = response.json()
-        
-        # Store the current time when the token was obtained for expiration checks
-        new_tokens['obtained_at'] = int(time.time())
-        print("Access token refreshed successfully.")
-        return new_tokens
-    except requests.exceptions.RequestException as e:
-        print(f"Error refreshing token: {e}")
-        if response is not None and response.text:
-            print(f"Response content: {response.text}")
+        response = tesla_request("tesla.refresh_token", "post", AUTH_BASE_URL, data=payload, headers=headers,
+                                 retry_policy=resilience.with_overrides(resilience.policy("tesla"), attempts=1))
+    except resilience.UpstreamError as e:
+        print_request_error("Error refreshing token", e)
         return None
+    new_tokens = response.json()
 
-def get_valid_access_token():
+    # Store the current time when the token was obtained for expiration checks
+    new_tokens['obtained_at'] = int(time.time())
+    print("Access token refreshed successfully.")
+    return new_tokens
+
+def get_valid_access_token(token_file=None):
     """
     Ensures a valid access token is available.
-    Refreshes if expired or close to expiration.
-    Handles initial token setup from .env if no token file exists.
-    """
-    tokens = load_tokens()
-
-    # If no tokens file, try to use an initial refresh token from .env
-    if not tokens:
-        initial_refresh_token = os.getenv("TESLA_INITIAL_REFRESH_TOKEN")
-        if initial_refresh_token:
-            print("No token file found. Attempting to use initial refresh token from .env for first time setup.")
-            tokens = refresh_access_token(initial_refresh_token)
-            if tokens:
-                save_tokens(tokens) # Save the newly obtained tokens
-                return tokens['access_token']
-            else:
-                print("Failed to get initial tokens using TESLA_INITIAL_REFRESH_TOKEN. "
-                      "Ensure it's correct and you have the 'offline_access' scope.")
-                return None
-        else:
-            print("No tokens found and TESLA_INITIAL_REFRESH_TOKEN not set in .env. "
-                  "Please perform initial browser authorization to get a refresh token.")
-            return None
+    Refreshes if expired or close to expiration, and ahead of expiry in the
+    background (see utils.token_store). Handles initial token setup from .env
+    if no token file exists.
 
-    # Check if existing access token is expired or close to expiration
-    # Tesla tokens are usually 1 hour (3600 seconds), refresh if less than 5 minutes (300 seconds) remain
-    if 'obtained_at' in tokens and 'expires_in' in tokens:
-        current_time = int(time.time())
-        if tokens['obtained_at'] + tokens['expires_in'] - current_time < 300: # 5 minutes buffer
-            print("Access token is expiring soon or has expired.")
-            new_tokens = refresh_access_token(tokens['refresh_token'])
-            if new_tokens:
-                save_tokens(new_tokens) # Save the new tokens (new refresh_token included)
-                return new_tokens['access_token']
-            else:
-                print("Failed to refresh token. The refresh token might be invalid or expired. "
-                      "Manual re-authorization may be required.")
-                return None
-    
-    # If the access token is still valid
-    print("Using existing valid access token.")
-    return tokens['access_token']
+    Args:
+        token_file (str, optional): Token file of the account. Defaults to TOKEN_FILE.
+    """
+    token_file = token_file or get_setting("TOKEN_FILE")
+    try:
+        token = get_client("tesla_tokens").access_token(token_file, get_setting("TESLA_INITIAL_REFRESH_TOKEN"))
+    except TimeoutError as e:
+        # Another run has been refreshing this account for too long
+        print(f"Could not get a Tesla access token: {e}")
+        return None
+    if token:
+        print("Using a valid access token.")
+    return token
 
 # --- Vehicle Interaction Functions ---
 
@@ -128,18 +128,16 @@ def wake_up_vehicle(access_token, vehicle_id):
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
-    url = f"{API_BASE_URL}/vehicles/{vehicle_id}/wake_up" 
+    url = f"{api_base_url()}/vehicles/{vehicle_id}/wake_up" 
     
     try:
-        response = requests.post(url, headers=headers, data='{}')
-        response.raise_for_status()
-        print(f"Wake up command sent for vehicle {vehicle_id}.")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending wake up command: {e}")
-        if response is not None and response.text:
-            print(f"Response content: {response.text}")
+        response = tesla_request("tesla.wake_up", "post", url, span_attributes={"vehicle_id": vehicle_id},
+                                 headers=headers, data='{}')
+    except resilience.UpstreamError as e:
+        print_request_error("Error sending wake up command", e)
         return None
+    print(f"Wake up command sent for vehicle {vehicle_id}.")
+    return response.json()
 
 def get_vehicles(access_token):
     """Fetches the list of vehicles associated with the account."""
@@ -148,73 +146,136 @@ def get_vehicles(access_token):
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
-    url = f"{API_BASE_URL}/vehicles"
+    url = f"{api_base_url()}/vehicles"
     
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        # print("Vehicle list fetched successfully.")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching vehicles: {e}")
-        if response is not None and response.text:
-            print(f"Response: {response.text}")
+        response = tesla_request("tesla.vehicles", "get", url, headers=headers)
+    except resilience.UpstreamError as e:
+        print_request_error("Error fetching vehicles", e)
         return None
+    # print("Vehicle list fetched successfully.")
+    return response.json()
 
-def get_vehicle_data(access_token, vehicle_id, max_retries=5, initial_delay=8):
+def get_vehicle(access_token, vehicle_id):
     """
-    Fetches detailed vehicle data, with retry logic for 408 (Vehicle Offline) errors.
-    
+    Fetches the basic vehicle record, including its 'state' (online, asleep, offline).
+    Unlike vehicle_data this endpoint does not wake the car, so it is cheap to poll.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    url = f"{api_base_url()}/vehicles/{vehicle_id}"
+
+    try:
+        response = tesla_request("tesla.vehicle", "get", url, span_attributes={"vehicle_id": vehicle_id}, headers=headers)
+    except resilience.UpstreamError as e:
+        print_request_error("Error fetching vehicle state", e)
+        return None
+    return response.json()
+
+def get_vehicle_state(access_token, vehicle_id):
+    """Returns the vehicle's state string (e.g. 'online', 'asleep'), or None if unknown."""
+    vehicle = get_vehicle(access_token, vehicle_id)
+    if vehicle and 'response' in vehicle and vehicle['response']:
+        return vehicle['response'].get('state')
+    return None
+
+def wait_for_vehicle_online(access_token, vehicle_id, deadline, base_delay=1.0, max_delay=16.0):
+    """
+    Polls the vehicle state with exponential backoff and full jitter until it
+    reports 'online' or the deadline passes.
+
+    Args:
+        access_token (str): The current valid access token.
+        vehicle_id (str): The ID of the vehicle to poll.
+        deadline (float): time.monotonic() value after which polling stops.
+        base_delay (float): Upper bound of the first (jittered) wait in seconds.
+        max_delay (float): Cap on the backoff window in seconds.
+
+    Returns:
+        bool: True once the vehicle is online, False if the deadline passed first.
+    """
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        window = min(max_delay, base_delay * (2 ** attempt))
+        time.sleep(min(random.uniform(0, window), remaining))
+        attempt += 1
+
+        state = get_vehicle_state(access_token, vehicle_id)
+        telemetry.increment("tesla_wake_polls_total")
+        print(f"Vehicle {vehicle_id} state: {state}")
+        if state == 'online':
+            return True
+
+def get_vehicle_data(access_token, vehicle_id, wake_timeout=None, base_delay=1.0, max_delay=16.0):
+    """
+    Fetches detailed vehicle data, waking the vehicle if it is asleep (HTTP 408).
+
+    A single wake_up command is sent, then the cheap vehicle state endpoint is
+    polled with exponential backoff and jitter. vehicle_data is only requested
+    again once the vehicle reports 'online'.
+
     Args:
         access_token (str): The current valid access token.
         vehicle_id (str): The ID of the vehicle to fetch data for.
-        max_retries (int): Maximum number of attempts to fetch data.
-        initial_delay (int): Initial delay in seconds before first retry after a wake-up.
-                              Subsequent delays increase.
+        wake_timeout (float, optional): Overall seconds to wait for the vehicle to wake.
+                                        Defaults to TESLA_WAKE_TIMEOUT or 90, and never
+                                        runs past the current deadline.
+        base_delay (float): Initial backoff window in seconds between state polls.
+        max_delay (float): Cap on the backoff window in seconds.
+
+    Returns:
+        dict: The vehicle_data response, or None if it could not be fetched.
     """
+    if wake_timeout is None:
+        wake_timeout = float(get_setting("TESLA_WAKE_TIMEOUT", 90))
+    left = resilience.remaining()
+    if left is not None:
+        wake_timeout = min(wake_timeout, left)
+
     headers = {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
-    url = f"{API_BASE_URL}/vehicles/{vehicle_id}/vehicle_data"
+    url = f"{api_base_url()}/vehicles/{vehicle_id}/vehicle_data"
+
+    deadline = time.monotonic() + wake_timeout
+    wake_sent = False
 
-    for attempt in range(max_retries):
-        print(f"Attempt {attempt + 1}/{max_retries} to fetch vehicle data for {vehicle_id}...")
+    while True:
+        print(f"Fetching vehicle data for {vehicle_id}...")
         try:
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 408:
-                print(f"Vehicle {vehicle_id} is offline/unavailable (HTTP 408). Attempting to wake up...")
-                wake_up_response = wake_up_vehicle(access_token, vehicle_id)
-                
-                if wake_up_response:
-                    # Implement increasing delay for retries
-                    current_delay = initial_delay * (attempt + 1)
-                    print(f"Wake-up command sent. Waiting {current_delay} seconds before retrying...")
-                    time.sleep(current_delay)
-                else:
-                    print("Failed to send wake up command. Aborting further retries for data fetch.")
-                    return None # Could not even send wake up command, no point in continuing
-                
-                continue # Go to the next attempt in the loop
-            
-            # If not 408, check for other errors or return success
-            response.raise_for_status() # Will raise HTTPError for 4xx or 5xx status codes
-            # print(f"Successfully fetched data for vehicle {vehicle_id}.")
+            # 408 means asleep: handled below rather than retried as a transient error
+            response = tesla_request("tesla.vehicle_data", "get", url, allow_status=(408,),
+                                     span_attributes={"vehicle_id": vehicle_id}, headers=headers)
+        except resilience.UpstreamError as e:
+            print_request_error("Request error fetching vehicle data", e)
+            return None
+
+        if response.status_code != 408:
             return response.json()
 
-        except requests.exceptions.RequestException as e:
-            # Catch general request errors (network, other HTTP errors)
-            print(f"Request error fetching vehicle data (attempt {attempt + 1}): {e}")
-            if response is not None and response.text:
-                print(f"Full error response: {response.text}")
-            
-            # For non-408 errors, you might choose to exit immediately or retry
-            # For simplicity, we'll exit after any non-408 error on the first try.
-            return None # Exit function on other types of errors
+        telemetry.retry("tesla", "vehicle_asleep")
+        if not wake_sent:
+            print(f"Vehicle {vehicle_id} is offline/unavailable (HTTP 408). Attempting to wake up...")
+            if not wake_up_vehicle(access_token, vehicle_id):
+                print("Failed to send wake up command. Aborting data fetch.")
+                return None
+            wake_sent = True
 
-    print(f"Failed to fetch vehicle data for {vehicle_id} after {max_retries} attempts due to persistent 408 errors or other issues.")
-    return None
+        # Wait on the cheap state endpoint instead of re-sending wake commands
+        with telemetry.span("tesla.wait_online", vehicle_id=vehicle_id) as waiting:
+            online = wait_for_vehicle_online(access_token, vehicle_id, deadline, base_delay, max_delay)
+            if not online:
+                waiting.fail("timed out")
+        if not online:
+            print(f"Vehicle {vehicle_id} did not come online within {wake_timeout:.0f} seconds.")
+            return None
 
 def send_vehicle_command(access_token, vehicle_id, command_name, command_data=None):
     """
@@ -231,77 +292,162 @@ def send_vehicle_command(access_token, vehicle_id, command_name, command_data=No
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
-    url = f"{API_BASE_URL}/vehicles/{vehicle_id}/command/{command_name}"
+    url = f"{api_base_url()}/vehicles/{vehicle_id}/command/{command_name}"
     
     # Ensure command_data is an empty dict if None, as some commands need an empty JSON body
     payload = json.dumps(command_data if command_data is not None else {})
 
     try:
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status() # Raise an exception for bad status codes
-        
-        # Tesla command responses often have a 'response' object with 'result' (bool) and 'reason' (str)
-        command_response = response.json()
-        if 'response' in command_response and command_response['response'].get('result') is True:
-            print(f"Command '{command_name}' sent successfully! Reason: {command_response['response'].get('reason', 'N/A')}")
-        else:
-            # Command was accepted by API but vehicle might have rejected it
-            print(f"Command '{command_name}' failed at vehicle. API Response: {command_response.get('response', 'No specific response object')}")
-        return command_response
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending command '{command_name}': {e}")
-        if response is not None and response.text:
-            print(f"Full error response: {response.text}")
+        response = tesla_request("tesla.command", "post", url,
+                                 span_attributes={"vehicle_id": vehicle_id, "command": command_name},
+                                 headers=headers, data=payload)
+    except resilience.UpstreamError as e:
+        print_request_error(f"Error sending command '{command_name}'", e)
         return None
-def make_tesla_api_calls():
-	# 1. Get a valid access token (will refresh if needed, or use initial from .env)
-    if not CLIENT_ID or not CLIENT_SECRET:
-        print("Error: TESLA_CLIENT_ID and TESLA_CLIENT_SECRET must be set in your .env file.")
+
+    # Tesla command responses often have a 'response' object with 'result' (bool) and 'reason' (str)
+    command_response = response.json()
+    if 'response' in command_response and command_response['response'].get('result') is True:
+        print(f"Command '{command_name}' sent successfully! Reason: {command_response['response'].get('reason', 'N/A')}")
+    else:
+        # Command was accepted by API but vehicle might have rejected it
+        print(f"Command '{command_name}' failed at vehicle. API Response: {command_response.get('response', 'No specific response object')}")
+    return command_response
+# --- Vehicle Snapshot Functions ---
+
+def load_vehicle_snapshot(snapshot_file=None):
+    """Loads the cached vehicle ID and last known charge state, if any."""
+    snapshot_file = snapshot_file or get_setting("VEHICLE_SNAPSHOT_FILE", ".cache/vehicle_snapshot.json")
+    if os.path.exists(snapshot_file):
+        try:
+            with open(snapshot_file, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("Error decoding vehicle snapshot. Ignoring it.")
+    return {}
+
+def save_vehicle_snapshot(snapshot, snapshot_file=None):
+    """
+    Saves the vehicle snapshot (vehicle_id, charge_state, taken_at). It goes
+    through a temp file and an atomic rename, so a crash or a concurrent
+    reader never sees a truncated file.
+    """
+    snapshot_file = snapshot_file or get_setting("VEHICLE_SNAPSHOT_FILE", ".cache/vehicle_snapshot.json")
+    try:
+        directory = os.path.dirname(os.path.abspath(snapshot_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, snapshot_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    except IOError as e:
+        print(f"Error saving vehicle snapshot: {e}")
+
+def is_snapshot_fresh(snapshot, vehicle_id, max_age=None):
+    """True if the snapshot holds charge data for this vehicle taken within max_age seconds."""
+    if max_age is None:
+        max_age = get_setting("VEHICLE_SNAPSHOT_MAX_AGE", 6 * 60 * 60, float) # seconds
+    if not snapshot.get('charge_state') or snapshot.get('vehicle_id') != vehicle_id:
+        return False
+    return time.time() - snapshot.get('taken_at', 0) <= max_age
+
+def last_known_status(user=None):
+    """
+    Fallback for the Tesla stage: the last snapshot's charge state, however old,
+    marked as stale. Returns None when there is no snapshot.
+    """
+    snapshot = load_vehicle_snapshot(user.vehicle_snapshot_file if user else None)
+    if not snapshot.get('charge_state'):
+        print("Tesla data unavailable and no vehicle snapshot to fall back to.")
+        return None
+    age_hours = (time.time() - snapshot.get('taken_at', 0)) / 3600
+    print(f"Tesla data unavailable. Using the last known charge state from {age_hours:.1f} hours ago.")
+    charge_state = snapshot['charge_state']
+    return TeslaStatus(battery_level=charge_state["battery_level"], charge_state=charge_state["charging_state"],
+                       battery_range=charge_state["battery_range"], stale=True)
+
+def make_tesla_api_calls(user=None):
+    """
+    Returns the TeslaStatus for one account.
+
+    Args:
+        user (UserProfile, optional): Whose token and snapshot files to use.
+                                      Defaults to the single-user .env settings.
+
+    Raises:
+        RuntimeError: If the account is not configured or no vehicle data is available.
+    """
+    token_file = user.token_file if user else None
+    snapshot_file = user.vehicle_snapshot_file if user else None
+
+    client_id, client_secret = client_credentials()
+    if not client_id or not client_secret:
         print("Please create a .env file with these variables and TESLA_INITIAL_REFRESH_TOKEN (after first manual auth).")
-        exit(1)
+        raise RuntimeError("TESLA_CLIENT_ID and TESLA_CLIENT_SECRET must be set in your .env file")
 
     # 1. Get a valid access token (will refresh if needed, or use initial from .env)
-    token = get_valid_access_token()
+    token = get_valid_access_token(token_file)
 
     if not token:
-        print("Failed to get a valid access token. Cannot proceed with API calls.")
-        exit(1)
-	# 2. List vehicles to get the ID of the primary vehicle
-    print("\n--- Fetching Vehicle List ---")
-    vehicles_data = get_vehicles(token)
-    first_vehicle_id = None
-    if vehicles_data and 'response' in vehicles_data and vehicles_data['response']:
-    
-	    first_vehicle_id = vehicles_data['response'][0]['id']
-	    # print(f"Found primary vehicle ID: {first_vehicle_id}")
-#        print("Full vehicle list response:")
-#        print(json.dumps(vehicles_data, indent=2))
-    else:
-	    print("No vehicles found in your Tesla account or unable to retrieve list.")
-        
-	# Proceed with data fetch and commands only if a vehicle ID was successfully found
-    if first_vehicle_id:
-	# 3. Fetch Detailed Vehicle Data (with automatic wake-up for 408 errors)
-        # print(f"\n--- Attempting to Fetch Detailed Data for Vehicle {first_vehicle_id} ---")
-        detailed_data = get_vehicle_data(token, first_vehicle_id, max_retries=5, initial_delay=8)
-	
-        if detailed_data and 'response' in detailed_data:
-            print(f"Detailed vehicle data found for {first_vehicle_id}:")
-#		print(json.dumps(detailed_data, indent=2))
+        raise RuntimeError("Failed to get a valid Tesla access token")
+
+    # 2. Use the cached vehicle ID when we have one, so the list call is skipped
+    snapshot = load_vehicle_snapshot(snapshot_file)
+    vehicle_id = snapshot.get('vehicle_id')
+    vehicle_state = get_vehicle_state(token, vehicle_id) if vehicle_id else None
+
+    if vehicle_state is None:
+        print("\n--- Fetching Vehicle List ---")
+        vehicles_data = get_vehicles(token)
+        if vehicles_data and 'response' in vehicles_data and vehicles_data['response']:
+            vehicle_id = vehicles_data['response'][0]['id']
+            vehicle_state = vehicles_data['response'][0].get('state')
         else:
-            print(f"Could not retrieve detailed vehicle data for {first_vehicle_id} after retries.")
-	
-        json_output = {"tesla_status": {"battery_level": detailed_data["response"]["charge_state"]["battery_level"], "charge_state": detailed_data["response"]["charge_state"]["charging_state"], "battery_range": detailed_data["response"]["charge_state"]["battery_range"]  }}
-	
-        with open(output_filename, "w") as json_file:
-            json.dump(json_output, json_file, indent=4)
+            raise RuntimeError("No vehicles found in your Tesla account or unable to retrieve list")
+
+    # 3. Don't wake a sleeping car if the last snapshot is recent enough
+    use_snapshot = vehicle_state != 'online' and is_snapshot_fresh(snapshot, vehicle_id)
+    if vehicle_state != 'online':
+        telemetry.cache_result("vehicle_snapshot", use_snapshot)
+    if use_snapshot:
+        age_minutes = round((time.time() - snapshot['taken_at']) / 60)
+        print(f"Vehicle {vehicle_id} is {vehicle_state}. Using charge snapshot from {age_minutes} minutes ago.")
+        charge_state, taken_at = snapshot['charge_state'], snapshot['taken_at']
+    else:
+        # 4. Fetch Detailed Vehicle Data (wakes the vehicle if needed)
+        detailed_data = get_vehicle_data(token, vehicle_id)
+
+        if not detailed_data or not detailed_data.get('response'):
+            # The stage falls back to last_known_status()
+            raise RuntimeError(f"Could not retrieve detailed vehicle data for {vehicle_id}")
+
+        print(f"Detailed vehicle data found for {vehicle_id}:")
+        charge_state = {
+            "battery_level": detailed_data["response"]["charge_state"]["battery_level"],
+            "charging_state": detailed_data["response"]["charge_state"]["charging_state"],
+            "battery_range": detailed_data["response"]["charge_state"]["battery_range"]
+        }
+        taken_at = int(time.time())
+
+    save_vehicle_snapshot({
+        "vehicle_id": vehicle_id,
+        "charge_state": charge_state,
+        "taken_at": taken_at
+    }, snapshot_file)
+
+    return TeslaStatus(battery_level=charge_state["battery_level"], charge_state=charge_state["charging_state"], battery_range=charge_state["battery_range"])
 
 
 # --- Main execution block ---
 if __name__ == "__main__":
     # 0. Initial Setup Check
-    if not CLIENT_ID or not CLIENT_SECRET:
+    client_id, client_secret = client_credentials()
+    if not client_id or not client_secret:
         print("Error: TESLA_CLIENT_ID and TESLA_CLIENT_SECRET must be set in your .env file.")
         print("Please create a .env file with these variables and TESLA_INITIAL_REFRESH_TOKEN (after first manual auth).")
         exit(1)
@@ -329,8 +475,8 @@ if __name__ == "__main__":
     if first_vehicle_id:
         # 3. Fetch Detailed Vehicle Data (with automatic wake-up for 408 errors)
         print(f"\n--- Attempting to Fetch Detailed Data for Vehicle {first_vehicle_id} ---")
-        # Adjust max_retries and initial_delay as per your preference
-        detailed_data = get_vehicle_data(token, first_vehicle_id, max_retries=5, initial_delay=8)
+        # Adjust TESLA_WAKE_TIMEOUT as per your preference
+        detailed_data = get_vehicle_data(token, first_vehicle_id)
         
         if detailed_data and 'response' in detailed_data:
             print(f"Detailed vehicle data for {first_vehicle_id}:")
@@ -345,11 +491,12 @@ if __name__ == "__main__":
                 print("Drive state data not available in detailed response.")
         else:
             print(f"Could not retrieve detailed vehicle data for {first_vehicle_id} after retries.")
+            exit(1)
         print("LLM Prompt: {}% battery remaining. Charge State: {}. Estimated range: {} miles.".format(detailed_data["response"]["charge_state"]["battery_level"],detailed_data["response"]["charge_state"]["charging_state"],detailed_data["response"]["charge_state"]["battery_range"]))
     
         json_output = {"tesla_status": {"battery_level": detailed_data["response"]["charge_state"]["battery_level"], "charge_state": detailed_data["response"]["charge_state"]["charging_state"], "battery_range": detailed_data["response"]["charge_state"]["battery_range"]  }}
 		
-        with open(output_filename, "w") as json_file:
+        with open(get_setting("PROMPT_INPUT_FILENAME"), "w") as json_file:
             json.dump(json_output, json_file, indent=4)
 			
     print("\n--- Script execution finished ---")
@@ -1,60 +1,123 @@
-import os
-import requests
+from dataclasses import asdict
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import json
+from utils.briefing_context import WeatherForecast, WeatherData
+from utils.disk_cache import cache_key
+from utils import telemetry, resilience, http_client
+from utils.single_flight import SingleFlight
+from utils.config import get_setting, get_client
 
 
 
 ##configuration
-load_dotenv()
-API_KEY = os.getenv("WEATHER_API_KEY")
-output_filename = os.getenv("PROMPT_INPUT_FILENAME")
+API_URL = "https://api.openweathermap.org/data/3.0/onecall"
 
-def get_weather_info(LATITUDE, LONGITUDE, UNITS = "imperial"):
-	
-	if not API_KEY:
+def grid_cell(LATITUDE, LONGITUDE):
+	# Coordinates are rounded to WEATHER_GRID_PRECISION decimals (2 ~= 1.1km) so that
+	# nearby locations, e.g. home and office in the same grid cell, share one forecast
+	precision = get_setting("WEATHER_GRID_PRECISION", 2, int)
+	return round(LATITUDE, precision), round(LONGITUDE, precision)
+
+async def get_weather_info_async(LATITUDE, LONGITUDE, UNITS = "imperial"):
+	"""
+	Tomorrow's forecast for the grid cell of a location, fetched on the shared
+	HTTP loop. Falls back to an expired cached forecast if the API is down.
+	"""
+
+	api_key = get_setting("WEATHER_API_KEY")
+	if not api_key:
 		print("API Key Undefined")
 		return
-	
-	
-	api_url = "https://api.openweathermap.org/data/3.0/onecall?lat={}&lon={}&units={}&exclude=minutely,hourly,alerts&appid={}".format(LATITUDE, LONGITUDE, UNITS,API_KEY)
-	# print(api_url)
-	# try:
-	response = requests.get(api_url)
-	response.raise_for_status()
-	data = response.json()
-	
-	# print(data)
-	
+
+	lat, lon = grid_cell(LATITUDE, LONGITUDE)
 	next_day_date = (datetime.now() + timedelta(days=1)).date()
-	
+	key = cache_key("onecall", lat, lon, UNITS, next_day_date.isoformat())
+
+	forecast_cache = get_client("forecast_cache")
+	cached = forecast_cache.get(key)
+	if cached is not None:
+		return WeatherForecast(**cached)
+
+	# Only the daily forecast is used, so skip the rest of the OneCall payload
+	params = {"lat": lat, "lon": lon, "units": UNITS, "exclude": "current,minutely,hourly,alerts", "appid": api_key}
+
+	async def fetch():
+		with telemetry.span("weather.onecall", lat=lat, lon=lon) as call:
+			# Pooled, kept-alive connections shared with every other request on the loop
+			response = await http_client.request("get", get_setting("WEATHER_API_URL", API_URL), api="weather",
+												 params=params, timeout=resilience.attempt_timeout("weather"))
+			call.set(http_status=response.status_code)
+			response.raise_for_status()
+		return response
+
+	try:
+		data = (await resilience.call_async("weather.onecall", fetch)).json()
+	except resilience.UpstreamError as e:
+		# Fall back to an expired forecast for the same day rather than none
+		stale, age = forecast_cache.get_stale(key)
+		if stale is None:
+			raise
+		print(f"Weather API unavailable ({e}). Using the forecast cached {age / 3600:.1f} hours ago.")
+		return WeatherForecast(**stale)
+
+	# print(data)
+
 	tomorrow_index = 1
 	if len(data["daily"]) < 2:
 		raise ValueError("Not enough daily data for tomorrow")
-	
-	
+
+
 	entry = data["daily"][tomorrow_index]
-	
+
 	readable_date = datetime.fromtimestamp(entry["dt"]).strftime("%A, %B %d")
 	temp_min = round(entry["temp"]["min"])
 	temp_max = round(entry["temp"]["max"])
 	description = entry["weather"][0]["description"]
-	
-	return {
-		"date": readable_date,
-			"min_temp": temp_min,
-			"max_temp": temp_max,
-			"description": description
-}
-
-
-def weather_api_calls():
-	with open(output_filename, "r") as f:
-		data = json.load(f)
-	
-	data["weather_data"] = {"origin": get_weather_info(float(os.getenv("ORIGIN_LATITUDE")), float(os.getenv("ORIGIN_LONGITUDE"))), "destination": get_weather_info(float(os.getenv("DEST_LATITUDE")), float(os.getenv("DEST_LONGITUDE")))}
-	
-	with open(output_filename, "w") as f:
-		json.dump(data, f, indent=4)
-	
+
+	forecast = WeatherForecast(
+		date=readable_date,
+		min_temp=temp_min,
+		max_temp=temp_max,
+		description=description
+	)
+	forecast_cache.set(key, asdict(forecast))
+	return forecast
+
+def get_weather_info(LATITUDE, LONGITUDE, UNITS = "imperial"):
+	"""Blocking form of get_weather_info_async, for callers outside the HTTP loop."""
+	return http_client.run(get_weather_info_async(LATITUDE, LONGITUDE, UNITS))
+
+
+# Concurrent users asking for the same grid cell share one request
+shared_forecasts = SingleFlight()
+
+def weather_api_calls(user=None):
+	"""
+	Returns the WeatherData for one commute. A location whose forecast can't
+	be fetched (and isn't cached) is left as None rather than failing the stage.
+	"""
+	if user:
+		origin = (user.origin_latitude, user.origin_longitude)
+		destination = (user.dest_latitude, user.dest_longitude)
+	else:
+		origin = (float(get_setting("ORIGIN_LATITUDE")), float(get_setting("ORIGIN_LONGITUDE")))
+		destination = (float(get_setting("DEST_LATITUDE")), float(get_setting("DEST_LONGITUDE")))
+
+	# Locations in the same grid cell only need one request
+	cells = {}
+	for lat, lon in (origin, destination):
+		cells.setdefault(grid_cell(lat, lon), (lat, lon))
+
+	async def forecast(lat, lon):
+		try:
+			return await shared_forecasts.do_async(grid_cell(lat, lon), get_weather_info_async, lat, lon)
+		except resilience.UpstreamError as e:
+			print(f"No forecast for {lat}, {lon}: {e}")
+			return None
+
+	async def fetch_all():
+		import asyncio
+		# Both locations are fetched at once on the shared HTTP loop
+		return await asyncio.gather(*(forecast(lat, lon) for lat, lon in cells.values()))
+
+	forecasts = dict(zip(cells, http_client.run(fetch_all())))
+	return WeatherData(origin=forecasts[grid_cell(*origin)], destination=forecasts[grid_cell(*destination)])
@@ -0,0 +1,178 @@
+import json
+import threading
+import contextvars
+from concurrent.futures import Future
+from utils.config import get_setting, get_client
+
+# Shared async HTTP layer for the Tesla Fleet API and OpenWeatherMap.
+#
+# One aiohttp session runs on one event loop in a background thread:
+#   - connections are pooled and kept alive per host (HTTP_MAX_CONNECTIONS_PER_HOST,
+#     and HTTP_MAX_CONNECTIONS in total);
+#   - every request has a connect and a read timeout (HTTP_CONNECT_TIMEOUT,
+#     HTTP_READ_TIMEOUT), and callers can add a total per attempt;
+#   - responses are negotiated and decoded as gzip or deflate;
+#   - requests tagged with an API wait for one of its <API>_MAX_CONCURRENCY slots.
+# Coroutines are handed to the loop from any thread with run(), which carries
+# the caller's context (deadline, current span) along. The requests of every
+# stage and every user overlap on the one loop and share its pools.
+#
+# aiohttp (and asyncio) are only imported when the client is first built.
+
+
+class HTTPStatusError(Exception):
+    """An HTTP error status. Like requests' HTTPError, it carries the response."""
+
+    def __init__(self, message, response):
+        super().__init__(message)
+        self.response = response
+
+
+class Response:
+    """A response whose body has been read in full."""
+    __slots__ = ("status_code", "reason", "headers", "content", "url")
+
+    def __init__(self, status_code, reason, headers, content, url):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise HTTPStatusError(f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}", self)
+
+
+class AsyncHTTPClient:
+    """
+    One event loop thread and one pooled aiohttp session.
+
+    Args:
+        connect_timeout (float): Seconds to establish a connection.
+        read_timeout (float): Seconds to wait for each read from the socket.
+        max_connections (int): Open connections across all hosts.
+        max_per_host (int): Open connections per host.
+    """
+
+    def __init__(self, connect_timeout=5.0, read_timeout=30.0, max_connections=100, max_per_host=8):
+        import asyncio
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self._session = None
+        self._slots = {}
+        self._tasks = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http-loop", daemon=True)
+        self._thread.start()
+
+    # --- On the loop ---
+
+    def _get_session(self):
+        # Only called on the loop thread, so no lock is needed
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host,
+                                               ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=self.read_timeout),
+                headers={"Accept-Encoding": "gzip, deflate"}
+            )
+        return self._session
+
+    def _slot(self, api, default_limit=4):
+        import asyncio
+        slot = self._slots.get(api)
+        if slot is None:
+            limit = get_setting(f"{api.upper()}_MAX_CONCURRENCY", default_limit, int)
+            slot = self._slots[api] = asyncio.Semaphore(max(limit, 1))
+        return slot
+
+    async def request(self, method, url, api=None, timeout=None, **kwargs):
+        """
+        Makes one request on the loop and reads the whole response.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            api (str, optional): Waits for one of the API's <API>_MAX_CONCURRENCY slots, e.g. "tesla".
+            timeout (float, optional): Total seconds for this request, on top of the
+                                       connect and read timeouts.
+            **kwargs: params, data, json, headers... as aiohttp takes them.
+
+        Returns:
+            Response: Whatever the status; call raise_for_status() to fail on errors.
+        """
+        import aiohttp
+        import contextlib
+
+        session = self._get_session()
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, connect=self.connect_timeout, sock_read=self.read_timeout)
+        async with (self._slot(api) if api else contextlib.nullcontext()):
+            async with session.request(method, url, **kwargs) as response:
+                content = await response.read()
+                return Response(response.status, response.reason, response.headers.copy(), content, str(response.url))
+
+    # --- From other threads ---
+
+    def run(self, coro):
+        """
+        Runs `coro` on the loop and returns its result, blocking the calling
+        thread (which must not be the loop's own) until it is done.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("run() was called on the HTTP loop; await the coroutine instead")
+        future = Future()
+
+        async def bridge():
+            try:
+                future.set_result(await coro)
+            except BaseException as e:
+                future.set_exception(e)
+
+        def start():
+            # Runs inside the caller's context, which the task copies
+            task = self._loop.create_task(bridge())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        self._loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return future.result()
+
+    def close(self):
+        """Closes the session and stops the loop."""
+        if self._loop.is_closed():
+            return
+
+        async def shutdown():
+            if self._session is not None:
+                await self._session.close()
+
+        try:
+            self.run(shutdown())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+
+
+async def request(method, url, api=None, timeout=None, **kwargs):
+    """Makes one request with the shared client (see AsyncHTTPClient.request). Await it on the loop."""
+    return await get_client("http").request(method, url, api=api, timeout=timeout, **kwargs)
+
+
+def run(coro):
+    """Runs `coro` on the shared client's loop and returns its result."""
+    return get_client("http").run(coro)
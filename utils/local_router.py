@@ -0,0 +1,390 @@
+import os
+import csv
+import json
+import math
+import heapq
+from dataclasses import dataclass
+import numpy as np
+
+# Offline road-network router.
+#
+# An extract is a directory of flat arrays: the road graph in CSR form (edges
+# sorted by source node, so indptr[u]:indptr[u + 1] are u's outgoing edges)
+# plus each edge's length, free-flow speed, freeway and speed profile. The
+# arrays are memory-mapped, so opening an extract reads almost nothing and
+# processes on one host share the pages. Routing is time-dependent A*: an
+# edge's speed is its free-flow speed scaled by its profile's factor for the
+# weekday and time slot in which the edge is entered.
+#
+# Extract layout (written by build_extract):
+#   meta.json      counts, slot length, top speed, freeway names, named places
+#   coords.npy     float64 (nodes, 2)   latitude, longitude in degrees
+#   indptr.npy     int64 (nodes + 1)
+#   indices.npy    int32 (edges)        target node
+#   length_m.npy   float32 (edges)
+#   speed_mps.npy  float32 (edges)      free-flow speed
+#   freeway.npy    int16 (edges)        index into meta["freeways"], -1 for other roads
+#   profile.npy    int16 (edges)        row of profiles.npy, -1 for none (optional)
+#   profiles.npy   float32 (profiles, 7 * slots per day)  speed factors, Monday first (optional)
+
+EXTRACT_VERSION = 1
+EARTH_RADIUS_M = 6371008.8
+
+# Slowest speed an edge is ever assumed to have, so a zero factor can't stall a route
+MIN_SPEED_MPS = 0.5
+
+
+@dataclass(slots=True)
+class Path:
+    """One route through the graph."""
+    duration_s: float
+    distance_m: float
+    edges: tuple
+    # Freeway names in travel order, deduplicated
+    freeways: tuple
+
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters between two points given in radians."""
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def week_seconds(departure_time):
+    """Seconds since Monday midnight."""
+    return (departure_time.weekday() * 24 * 60 * 60 + departure_time.hour * 60 * 60
+            + departure_time.minute * 60 + departure_time.second)
+
+
+class RoadGraph:
+    """
+    A memory-mapped road-network extract.
+
+    Args:
+        directory (str): Extract written by build_extract.
+
+    Raises:
+        FileNotFoundError: If the directory has no extract.
+        ValueError: If the extract was written by an incompatible version.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != EXTRACT_VERSION:
+            raise ValueError(f"Routing extract in {directory} has version {meta.get('version')}, expected {EXTRACT_VERSION}")
+
+        def load(name):
+            # Plain ndarray views of the mapping; np.memmap slicing is several times slower
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r").view(np.ndarray)
+
+        self.directory = directory
+        self.slot_s = meta["slot_minutes"] * 60
+        self.max_speed_mps = meta["max_speed_mps"]
+        self.freeway_names = meta["freeways"]
+        self.places = meta.get("places", {})
+        self.coords = load("coords")
+        self.indptr = load("indptr")
+        self.indices = load("indices")
+        self.length_m = load("length_m")
+        self.speed_mps = load("speed_mps")
+        self.freeway = load("freeway")
+        self.profile = self.profiles = None
+        if meta.get("profiles"):
+            self.profile = load("profile")
+            self.profiles = load("profiles")
+
+    @property
+    def node_count(self):
+        return len(self.coords)
+
+    # --- Places ---
+
+    def resolve(self, place):
+        """
+        Node for a named place in the extract, or the node nearest a "lat,lng" string.
+
+        Raises:
+            LookupError: If the place is neither.
+        """
+        node = self.places.get(place)
+        if node is not None:
+            return node
+        try:
+            lat, lng = (float(part) for part in place.split(","))
+        except ValueError:
+            raise LookupError(f"{place!r} is not a place in the routing extract or a \"lat,lng\" pair") from None
+        return self.nearest_node(lat, lng)
+
+    def nearest_node(self, lat, lng):
+        # Equirectangular distance is plenty to pick the closest node
+        dlat = self.coords[:, 0] - lat
+        dlng = (self.coords[:, 1] - lng) * math.cos(math.radians(lat))
+        return int(np.argmin(dlat * dlat + dlng * dlng))
+
+    def time_slot(self, departure_time):
+        """Speed-profile slot of the week a departure falls in."""
+        return week_seconds(departure_time) // self.slot_s
+
+    # --- Routing ---
+
+    def _edge_seconds(self, length, speed, profile, at_s):
+        if profile >= 0:
+            slots = self.profiles.shape[1]
+            speed *= float(self.profiles[profile, int(at_s // self.slot_s) % slots])
+        return length / max(speed, MIN_SPEED_MPS)
+
+    def _edges_of(self, node):
+        begin, end = int(self.indptr[node]), int(self.indptr[node + 1])
+        profiles = self.profile[begin:end].tolist() if self.profile is not None else [-1] * (end - begin)
+        return zip(range(begin, end), self.indices[begin:end].tolist(), self.length_m[begin:end].tolist(),
+                   self.speed_mps[begin:end].tolist(), profiles)
+
+    def shortest_path(self, source, target, departure_time, penalized=(), penalty=1.0):
+        """
+        Fastest path from `source` to `target` leaving at `departure_time`, by
+        time-dependent A*. Edges in `penalized` cost `penalty` times as much.
+
+        Returns:
+            Path, or None if `target` can't be reached.
+        """
+        start_s = week_seconds(departure_time)
+        coords = self.coords
+        target_lat, target_lng = (math.radians(value) for value in coords[target].tolist())
+        # A lower bound on the remaining time: straight line at the top speed anywhere in the extract
+        top_speed = self.max_speed_mps
+
+        bounds = {}
+
+        def heuristic(node):
+            bound = bounds.get(node)
+            if bound is None:
+                lat, lng = coords[node].tolist()
+                bound = bounds[node] = _haversine_m(math.radians(lat), math.radians(lng), target_lat, target_lng) / top_speed
+            return bound
+
+        best = {source: 0.0}
+        parents = {}
+        closed = set()
+        heap = [(heuristic(source), 0.0, source)]
+        while heap:
+            _, elapsed, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            for edge, neighbor, length, speed, profile in self._edges_of(node):
+                if neighbor in closed:
+                    continue
+                cost = self._edge_seconds(length, speed, profile, start_s + elapsed)
+                if edge in penalized:
+                    cost *= penalty
+                arrival = elapsed + cost
+                if arrival < best.get(neighbor, math.inf):
+                    best[neighbor] = arrival
+                    parents[neighbor] = (node, edge)
+                    heapq.heappush(heap, (arrival + heuristic(neighbor), arrival, neighbor))
+        else:
+            return None
+
+        edges = []
+        node = target
+        while node != source:
+            node, edge = parents[node]
+            edges.append(edge)
+        edges.reverse()
+        return self._replay(edges, start_s)
+
+    def _replay(self, edges, start_s):
+        """Unpenalized duration, distance and freeways of a path."""
+        elapsed = distance = 0.0
+        names = []
+        for edge in edges:
+            length = float(self.length_m[edge])
+            profile = int(self.profile[edge]) if self.profile is not None else -1
+            elapsed += self._edge_seconds(length, float(self.speed_mps[edge]), profile, start_s + elapsed)
+            distance += length
+            freeway = int(self.freeway[edge])
+            if freeway >= 0:
+                names.append(self.freeway_names[freeway])
+        return Path(duration_s=elapsed, distance_m=distance, edges=tuple(edges), freeways=tuple(dict.fromkeys(names)))
+
+    def routes(self, source, target, departure_time, alternatives=1, penalty=1.4, max_overlap=0.8):
+        """
+        Up to `alternatives` distinct paths, fastest first. Alternatives are
+        found by re-running A* with the edges of the paths found so far made
+        `penalty` times slower; a path sharing more than `max_overlap` of its
+        length with an earlier one is dropped.
+        """
+        paths = []
+        penalized = set()
+        for _ in range(max(alternatives, 1) + 2):
+            path = self.shortest_path(source, target, departure_time, penalized, penalty)
+            if path is None:
+                break
+            shared = [sum(float(self.length_m[edge]) for edge in set(path.edges) & set(earlier.edges)) for earlier in paths]
+            if all(length <= max_overlap * path.distance_m for length in shared):
+                paths.append(path)
+                if len(paths) >= alternatives:
+                    break
+            fresh = set(path.edges) - penalized
+            if not fresh:
+                break
+            penalized |= fresh
+        return sorted(paths, key=lambda path: path.duration_s)
+
+
+# --- Preprocessing ---
+
+def build_extract(directory, coords, edges, places=None, profiles=None, slot_minutes=15):
+    """
+    Writes a routing extract.
+
+    Args:
+        directory (str): Created if missing; existing extract files are replaced.
+        coords (array-like): (latitude, longitude) in degrees per node.
+        edges (iterable): Directed edges as (source, target, length_m, speed_mps,
+                          freeway name or None, profile row or -1) tuples; two-way
+                          roads need one edge per direction.
+        places (dict, optional): Address -> node, for resolving origins and destinations.
+        profiles (array-like, optional): Speed factors, one row per profile and one
+                                         column per `slot_minutes` slot of the week.
+        slot_minutes (int): Length of a profile slot.
+
+    Returns:
+        dict: The extract's metadata.
+    """
+    if (24 * 60) % slot_minutes:
+        raise ValueError(f"slot_minutes must divide a day, got {slot_minutes}")
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    edges = list(edges)
+    node_count = len(coords)
+
+    freeway_ids = {}
+    sources = np.fromiter((edge[0] for edge in edges), dtype=np.int64, count=len(edges))
+    targets = np.fromiter((edge[1] for edge in edges), dtype=np.int64, count=len(edges))
+    if len(edges) and (min(sources.min(), targets.min()) < 0 or max(sources.max(), targets.max()) >= node_count):
+        raise ValueError("Edge refers to a node outside the coordinates")
+    columns = {
+        "length_m": np.fromiter((edge[2] for edge in edges), dtype=np.float32, count=len(edges)),
+        "speed_mps": np.fromiter((edge[3] for edge in edges), dtype=np.float32, count=len(edges)),
+        "freeway": np.fromiter((-1 if edge[4] is None else freeway_ids.setdefault(edge[4], len(freeway_ids))
+                                for edge in edges), dtype=np.int16, count=len(edges)),
+        "profile": np.fromiter((edge[5] for edge in edges), dtype=np.int16, count=len(edges)),
+    }
+
+    if profiles is not None:
+        profiles = np.asarray(profiles, dtype=np.float32)
+        slots_per_week = 7 * 24 * 60 // slot_minutes
+        if profiles.ndim != 2 or profiles.shape[1] != slots_per_week:
+            raise ValueError(f"profiles must have shape (profiles, {slots_per_week}), got {profiles.shape}")
+        if columns["profile"].size and columns["profile"].max() >= len(profiles):
+            raise ValueError("Edge refers to a profile that doesn't exist")
+    else:
+        columns.pop("profile")
+
+    # CSR: edges grouped by source node, in input order within a node
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+    arrays = {"coords": coords, "indptr": indptr, "indices": targets[order].astype(np.int32)}
+    arrays.update({name: column[order] for name, column in columns.items()})
+    if profiles is not None:
+        arrays["profiles"] = profiles
+
+    max_speed = float(columns["speed_mps"].max()) if len(edges) else 1.0
+    if profiles is not None and profiles.size:
+        max_speed *= max(1.0, float(profiles.max()))
+    meta = {
+        "version": EXTRACT_VERSION,
+        "nodes": node_count,
+        "edges": len(edges),
+        "slot_minutes": slot_minutes,
+        "max_speed_mps": max_speed,
+        "profiles": profiles is not None,
+        "freeways": list(freeway_ids),
+        "places": {name: int(node) for name, node in (places or {}).items()},
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+    # Metadata last, so an interrupted build is never picked up as an extract
+    temp_path = os.path.join(directory, f"meta.json.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(temp_path, os.path.join(directory, "meta.json"))
+    return meta
+
+
+def build_extract_from_csv(directory, nodes_csv, edges_csv, places_json=None, profiles_npy=None, slot_minutes=15):
+    """
+    Builds an extract from CSV exports of a road network.
+
+    Args:
+        nodes_csv (str): Columns id, lat, lng.
+        edges_csv (str): Columns from, to, length_m, speed_kph and optionally
+                         freeway and profile. One row per direction of travel.
+        places_json (str, optional): {"address": node id} object.
+        profiles_npy (str, optional): Speed factor array, see build_extract.
+    """
+    node_ids, coords = {}, []
+    with open(nodes_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            node_ids[row["id"]] = len(coords)
+            coords.append((float(row["lat"]), float(row["lng"])))
+
+    edges = []
+    with open(edges_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            edges.append((node_ids[row["from"]], node_ids[row["to"]], float(row["length_m"]),
+                          float(row["speed_kph"]) / 3.6, row.get("freeway") or None, int(row.get("profile") or -1)))
+
+    places = {}
+    if places_json:
+        with open(places_json, "r", encoding="utf-8") as f:
+            places = {address: node_ids[str(node)] for address, node in json.load(f).items()}
+    profiles = np.load(profiles_npy) if profiles_npy else None
+    return build_extract(directory, coords, edges, places, profiles, slot_minutes)
+
+
+def main():
+    import time
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Build or query a local routing extract.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build an extract from CSV exports")
+    build.add_argument("directory")
+    build.add_argument("--nodes", required=True, help="CSV with id, lat, lng")
+    build.add_argument("--edges", required=True, help="CSV with from, to, length_m, speed_kph[, freeway, profile]")
+    build.add_argument("--places", help="JSON object of address -> node id")
+    build.add_argument("--profiles", help=".npy array of speed factors per profile and slot of the week")
+    build.add_argument("--slot-minutes", type=int, default=15)
+    route = commands.add_parser("route", help="Route between two places")
+    route.add_argument("directory")
+    route.add_argument("origin", help="Place in the extract or \"lat,lng\"")
+    route.add_argument("destination")
+    route.add_argument("--at", help="Departure, YYYY-MM-DDTHH:MM (default now)")
+    route.add_argument("--alternatives", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        meta = build_extract_from_csv(args.directory, args.nodes, args.edges, args.places, args.profiles, args.slot_minutes)
+        print(f"Wrote {meta['nodes']} nodes and {meta['edges']} edges to {args.directory}.")
+        return
+
+    graph = RoadGraph(args.directory)
+    departure_time = datetime.fromisoformat(args.at) if args.at else datetime.now()
+    started = time.perf_counter()
+    paths = graph.routes(graph.resolve(args.origin), graph.resolve(args.destination), departure_time, args.alternatives)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for path in paths:
+        print(f"{path.duration_s / 60:6.1f} min {path.distance_m / 1000:7.1f} km  {', '.join(path.freeways) or '-'}")
+    print(f"{len(paths)} route(s) in {elapsed_ms:.2f} ms" if paths else "No route.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import math
+from utils.route_model import rank_routes, records_to_array, battery_drain, format_distance, METERS_PER_MILE
+
+# Renders the stage outputs as compact prompt text. Commute options become a
+# pipe-separated table, one line per departure slot and route, instead of
+# the repr of a list of dicts, and the table is trimmed to a token budget.
+
+# Rough characters-per-token ratio for English and tabular text, used when
+# the prompt isn't counted by the API
+CHARS_PER_TOKEN = 3.5
+
+# Applied in order until the prompt fits the budget
+TRIM_STEPS = ("failed", "dominated", "alternatives")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def render_weather(label, address, forecast):
+    if forecast is None:
+        return "{} ({}): forecast unavailable".format(label, address)
+    return "{} ({}): {}, high {}F, low {}F".format(label, address, forecast.description, forecast.max_temp, forecast.min_temp)
+
+
+def render_tesla(tesla_status):
+    if tesla_status is None:
+        return "unavailable (car unreachable)"
+    status = "{}% battery, charging state {}, {} mi range".format(tesla_status.battery_level, tesla_status.charge_state, tesla_status.battery_range)
+    return status + (" (last known reading, car unreachable)" if tesla_status.stale else "")
+
+
+def dominated_routes(routes):
+    """
+    Marks alternatives that another alternative for the same departure beats
+    on both duration and distance (at least as good on each, better on one).
+
+    Returns:
+        numpy.ndarray: Boolean mask over `routes`.
+    """
+    import numpy as np
+
+    array = records_to_array(routes)
+    ok = array["ok"]
+    duration, distance = array["duration_s"], np.nan_to_num(array["distance_m"], nan=np.inf)
+    same_departure = array["departure_ts"][:, None] == array["departure_ts"][None, :]
+    no_worse = (duration[:, None] <= duration[None, :]) & (distance[:, None] <= distance[None, :])
+    better = (duration[:, None] < duration[None, :]) | (distance[:, None] < distance[None, :])
+    # beats[i, j]: route i dominates route j
+    beats = same_departure & no_worse & better & ok[:, None]
+    return beats.any(axis=0) & ok
+
+
+def render_commute_table(routes, keep=None):
+    """
+    Renders route records as a table ordered by departure, fastest
+    alternative first.
+
+    Args:
+        routes (list): RouteRecords.
+        keep (numpy.ndarray, optional): Boolean mask of routes to include.
+    """
+    if not routes:
+        return "No commute options available."
+    order, best = rank_routes(routes)
+    drains = battery_drain(records_to_array(routes)["distance_m"])
+
+    dates = {route.departure_time.date() for route in routes}
+    time_format = "%I:%M%p" if len(dates) == 1 else "%a %I:%M%p"
+    lines = [
+        "Departures on {} (min=minutes in traffic, ~=predicted from history, typ=p10-p90 minutes, *=fastest for that departure)".format(
+            min(dates).strftime("%A %b %d")),
+        "depart|min|typ|mi|batt%|route"
+    ]
+    for i in order:
+        if keep is not None and not keep[i]:
+            continue
+        route = routes[i]
+        depart = route.departure_time.strftime(time_format)
+        if route.error or route.duration_s is None:
+            lines.append(f"{depart}|unavailable")
+            continue
+        minutes = ("~" if route.source == "history" else "") + str(round(route.duration_s / 60))
+        typical = "" if route.p10_s is None else "{}-{}".format(round(route.p10_s / 60), round(route.p90_s / 60))
+        miles = f"{route.distance_m / METERS_PER_MILE:.1f}"
+        path = ">".join(route.freeway_names) or "local roads"
+        lines.append(f"{depart}|{minutes}|{typical}|{miles}|{float(drains[i]):g}|{path}{'*' if best[i] else ''}")
+    return "\n".join(lines)
+
+
+def render_commute(traffic_data, keep=None):
+    return "Distance {}, minimum battery drain {}%\n{}".format(
+        format_distance(traffic_data.commute_distance_m), traffic_data.minimum_battery_drainage,
+        render_commute_table(traffic_data.routes, keep))
+
+
+def fit_commute(traffic_data, count_tokens, budget):
+    """
+    Renders the commute section, dropping failed probes, then dominated
+    alternatives, then every non-fastest alternative until
+    `count_tokens(section)` is within `budget`.
+
+    Args:
+        traffic_data (TrafficData): Traffic stage output, or None if unavailable.
+        count_tokens (callable): Returns the prompt's token count for a commute section.
+        budget (int): Input token budget for the whole prompt.
+
+    Returns:
+        tuple: (commute section, token count, trim steps applied)
+    """
+    import numpy as np
+
+    if traffic_data is None:
+        commute = "Commute data unavailable."
+        return commute, count_tokens(commute), []
+    routes = traffic_data.routes
+    keep = np.ones(len(routes), dtype=bool)
+    commute = render_commute(traffic_data)
+    tokens = count_tokens(commute)
+    applied = []
+    for step in TRIM_STEPS:
+        if tokens <= budget or not routes:
+            break
+        if step == "failed":
+            keep &= records_to_array(routes)["ok"]
+        elif step == "dominated":
+            keep &= ~dominated_routes(routes)
+        elif step == "alternatives":
+            keep &= rank_routes(routes)[1]
+        commute = render_commute(traffic_data, keep)
+        tokens = count_tokens(commute)
+        applied.append(step)
+    return commute, tokens, applied
@@ -0,0 +1,66 @@
+import threading
+import time
+from utils.config import get_setting
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Each call
+    to `acquire` takes one token, blocking only as long as needed for the next
+    token to become available, instead of sleeping a fixed amount per request.
+
+    Args:
+        rate (float): Sustained requests per second.
+        capacity (int, optional): Maximum burst size. Defaults to `rate` (min 1).
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available, then takes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_for = (tokens - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+# --- Per-API concurrency limits ---
+
+_api_semaphores = {}
+_api_semaphores_lock = threading.Lock()
+
+def api_slot(api_name, default_limit=4):
+    """
+    Returns the process-wide semaphore bounding concurrent calls to one external
+    API. The limit comes from <API_NAME>_MAX_CONCURRENCY, e.g. TESLA_MAX_CONCURRENCY.
+
+    Usage:
+        with api_slot("tesla"):
+            response = requests.get(...)
+    """
+    with _api_semaphores_lock:
+        semaphore = _api_semaphores.get(api_name)
+        if semaphore is None:
+            limit = int(get_setting(f"{api_name.upper()}_MAX_CONCURRENCY", default_limit))
+            semaphore = threading.BoundedSemaphore(max(limit, 1))
+            _api_semaphores[api_name] = semaphore
+        return semaphore
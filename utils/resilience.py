@@ -0,0 +1,437 @@
+import sys
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from utils import telemetry
+from utils.config import get_setting
+
+# Retries, deadlines and circuit breakers shared by every external call.
+#
+# call(endpoint, func), or call_async() for a coroutine, runs one upstream
+# request under the policy of its API, the part of the endpoint name before
+# the dot ("tesla" for "tesla.vehicle_data"):
+#   - transient failures (connection errors, timeouts, HTTP 408/429/5xx,
+#     OVER_QUERY_LIMIT, SMTP 4xx) are retried with exponential backoff and
+#     full jitter, up to RETRY_<API>_ATTEMPTS attempts;
+#   - retries also draw on a per-endpoint budget, so a struggling upstream is
+#     not hit with a multiple of its normal traffic;
+#   - no attempt starts, and no backoff sleeps, past the current deadline
+#     (see deadline()), which the stage scheduler sets from each stage's timeout;
+#   - after <API>_BREAKER_THRESHOLD consecutive transient failures the
+#     endpoint's circuit opens and its calls fail immediately for
+#     <API>_BREAKER_RESET seconds, after which a single trial call is let through.
+# Budgets and breakers are kept per endpoint, so a failing endpoint (say the
+# token refresh) doesn't shut off or use up the retries of its API's others.
+# Every failure surfaces as an UpstreamError, which callers catch to fail over
+# to cached or partial data.
+
+RETRYABLE_HTTP_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504, 529})
+RETRYABLE_MAPS_STATUS = frozenset({"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"})
+
+
+class UpstreamError(Exception):
+    """
+    An external call failed for good (or was not attempted).
+
+    Args:
+        endpoint (str): Dotted endpoint name, e.g. "weather.onecall".
+        message (str): What happened.
+        cause (BaseException, optional): The last error raised by the call.
+    """
+
+    def __init__(self, endpoint, message, cause=None):
+        super().__init__(f"{endpoint}: {message}")
+        self.endpoint = endpoint
+        self.cause = cause
+
+
+class CircuitOpen(UpstreamError):
+    """The API's circuit breaker is open, so the call was not attempted."""
+
+
+class DeadlineExceeded(UpstreamError):
+    """The current deadline left no time for (another) attempt."""
+
+
+# --- Policies ---
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Args:
+        attempts (int): Attempts per call, the first one included.
+        base_delay (float): Upper bound of the first (jittered) backoff in seconds.
+        max_delay (float): Cap on the backoff window in seconds.
+        timeout (float): Seconds one attempt may take (connect and read).
+    """
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    timeout: float = 30.0
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+DEFAULT_POLICIES = {
+    "tesla": RetryPolicy(attempts=3, base_delay=0.5, max_delay=4.0, timeout=15.0),
+    "weather": RetryPolicy(attempts=3, base_delay=0.5, max_delay=4.0, timeout=10.0),
+    "maps": RetryPolicy(attempts=4, base_delay=0.5, max_delay=4.0, timeout=10.0),
+    "anthropic": RetryPolicy(attempts=3, base_delay=1.0, max_delay=8.0, timeout=60.0),
+    "smtp": RetryPolicy(attempts=3, base_delay=1.0, max_delay=8.0, timeout=30.0),
+}
+
+
+def policy(api):
+    """
+    Returns the retry policy of `api`, with overrides from RETRY_<API>_ATTEMPTS,
+    RETRY_<API>_BASE_DELAY, RETRY_<API>_MAX_DELAY and <API>_TIMEOUT.
+    """
+    prefix = api.upper()
+    default = DEFAULT_POLICIES.get(api, RetryPolicy())
+    return RetryPolicy(
+        attempts=max(1, get_setting(f"RETRY_{prefix}_ATTEMPTS", default.attempts, int)),
+        base_delay=get_setting(f"RETRY_{prefix}_BASE_DELAY", default.base_delay, float),
+        max_delay=get_setting(f"RETRY_{prefix}_MAX_DELAY", default.max_delay, float),
+        timeout=get_setting(f"{prefix}_TIMEOUT", default.timeout, float),
+    )
+
+
+def with_overrides(retry_policy, **overrides):
+    """Returns `retry_policy` with the given fields replaced, skipping None values."""
+    return replace(retry_policy, **{key: value for key, value in overrides.items() if value is not None})
+
+
+# --- Deadlines ---
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Bounds every call made in the block to `seconds` from now, including calls
+    on worker threads started through telemetry.bind(). A nested deadline can
+    only shorten the current one. None leaves the current deadline as it is.
+    """
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, or None without one."""
+    at = _deadline.get()
+    return None if at is None else max(at - time.monotonic(), 0.0)
+
+
+def attempt_timeout(api):
+    """The per-attempt timeout of `api`, shortened to what is left of the deadline."""
+    timeout = policy(api).timeout
+    left = remaining()
+    return timeout if left is None else max(min(timeout, left), 0.001)
+
+
+# --- Circuit breakers and retry budgets ---
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures. While open, allow() is False
+    until `reset_after` seconds have passed; then one trial call is allowed,
+    which closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, name, threshold=5, reset_after=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = "half_open"
+                return True
+            # Open, or half open with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"Circuit for {self.name} closed.")
+                telemetry.increment("circuit_transitions_total", endpoint=self.name, state="closed")
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.threshold):
+                print(f"Circuit for {self.name} opened after {self._failures} consecutive failures.")
+                telemetry.increment("circuit_transitions_total", endpoint=self.name, state="open")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Allows retries up to `ratio` of the calls made in the last `window`
+    seconds, plus `min_retries`, so retries stay a bounded share of traffic.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, window=60.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self._calls, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_retry(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._calls):
+                return False
+            self._retries.append(now)
+            return True
+
+
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+
+def breaker(endpoint):
+    """
+    The process-wide circuit breaker of `endpoint`, configured by its API's
+    <API>_BREAKER_THRESHOLD and <API>_BREAKER_RESET.
+    """
+    prefix = endpoint.split(".", 1)[0].upper()
+    with _registry_lock:
+        circuit = _breakers.get(endpoint)
+        if circuit is None:
+            circuit = _breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                threshold=get_setting(f"{prefix}_BREAKER_THRESHOLD", 5, int),
+                reset_after=get_setting(f"{prefix}_BREAKER_RESET", 30, float)
+            )
+        return circuit
+
+
+def retry_budget(endpoint):
+    """
+    The process-wide retry budget of `endpoint`, configured by its API's
+    RETRY_<API>_BUDGET_RATIO and RETRY_<API>_BUDGET_MIN.
+    """
+    prefix = endpoint.split(".", 1)[0].upper()
+    with _registry_lock:
+        budget = _budgets.get(endpoint)
+        if budget is None:
+            budget = _budgets[endpoint] = RetryBudget(
+                ratio=get_setting(f"RETRY_{prefix}_BUDGET_RATIO", 0.2, float),
+                min_retries=get_setting(f"RETRY_{prefix}_BUDGET_MIN", 10, int)
+            )
+        return budget
+
+
+def reset():
+    """Forgets every breaker and budget, e.g. between benchmark runs."""
+    with _registry_lock:
+        _breakers.clear()
+        _budgets.clear()
+
+
+# --- Classification ---
+
+def _http_status(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None and isinstance(getattr(error, "status", None), int):
+        status = error.status
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """True for failures a later attempt may not hit: network trouble, overload, rate limits."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = _http_status(error)
+    if status is not None:
+        return status in RETRYABLE_HTTP_STATUS
+
+    # Only libraries that are already loaded are checked; importing them here
+    # would undo their lazy imports
+    requests = sys.modules.get("requests")
+    if requests and isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    googlemaps = sys.modules.get("googlemaps")
+    if googlemaps:
+        exceptions = googlemaps.exceptions
+        if isinstance(error, (exceptions.Timeout, exceptions.TransportError)):
+            return True
+        if isinstance(error, exceptions.ApiError):
+            return error.status in RETRYABLE_MAPS_STATUS
+    aiohttp = sys.modules.get("aiohttp")
+    if aiohttp and isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True
+    anthropic = sys.modules.get("anthropic")
+    if anthropic and isinstance(error, anthropic.APIConnectionError):
+        return True
+    smtplib = sys.modules.get("smtplib")
+    if smtplib:
+        if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+            return True
+        # 4xx replies are temporary by definition (421 service not available, 451...)
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+    return False
+
+
+def _reason(error):
+    status = _http_status(error)
+    if status is not None:
+        return f"http_{status}"
+    maps_status = getattr(error, "status", None)
+    return maps_status if isinstance(maps_status, str) else type(error).__name__
+
+
+# --- Calls ---
+
+class _Attempts:
+    """Bookkeeping for the attempts of one call, shared by call() and call_async()."""
+
+    def __init__(self, endpoint, retry_policy):
+        self.endpoint = endpoint
+        self.api = endpoint.split(".", 1)[0]
+        self.policy = retry_policy or policy(self.api)
+        self.circuit = breaker(endpoint)
+        self.budget = retry_budget(endpoint)
+        self.budget.record_call()
+        self.last_error = None
+
+    def start(self, attempt):
+        """Raises if the deadline or the circuit rules out this attempt."""
+        if remaining() == 0:
+            raise DeadlineExceeded(self.endpoint, f"deadline passed before attempt {attempt + 1}", self.last_error)
+        if not self.circuit.allow():
+            telemetry.increment("circuit_rejections_total", endpoint=self.endpoint)
+            raise CircuitOpen(self.endpoint, f"circuit open after repeated {self.endpoint} failures", self.last_error)
+
+    def succeeded(self):
+        self.circuit.record_success()
+
+    def failed(self, attempt, error):
+        """Returns the backoff before the next attempt, or raises UpstreamError if there is none."""
+        endpoint, retry_policy = self.endpoint, self.policy
+        if not is_transient(error):
+            # The upstream answered, so this says nothing about its health
+            self.circuit.record_success()
+            raise UpstreamError(endpoint, str(error) or type(error).__name__, error) from error
+        self.circuit.record_failure()
+        self.last_error = error
+        described = str(error) or type(error).__name__
+
+        if attempt + 1 >= retry_policy.attempts:
+            raise UpstreamError(endpoint, f"failed after {retry_policy.attempts} attempts: {described}", error) from error
+        if not self.budget.try_retry():
+            telemetry.increment("retry_budget_exhausted_total", endpoint=self.endpoint)
+            raise UpstreamError(endpoint, f"retry budget exhausted: {described}", error) from error
+
+        delay = max(retry_policy.backoff(attempt), _retry_after(error) or 0)
+        left = remaining()
+        if left is not None and delay >= left:
+            raise DeadlineExceeded(endpoint, f"no time left to retry: {described}", error) from error
+        telemetry.retry(self.api, _reason(error))
+        print(f"{endpoint} failed ({described}); retrying in {delay:.1f}s (attempt {attempt + 2}/{retry_policy.attempts})")
+        return delay
+
+
+def call(endpoint, func, retry_policy=None):
+    """
+    Runs `func()` (one upstream request) with the retry policy of the
+    endpoint's API and the endpoint's circuit breaker and retry budget, within
+    the current deadline.
+
+    Args:
+        endpoint (str): Dotted endpoint name; the part before the dot names the API.
+        func (callable): Makes the request and raises on failure (e.g. raise_for_status()).
+                         Keep it to the request itself: anything it raises counts as an
+                         upstream failure.
+        retry_policy (RetryPolicy, optional): Overrides the API's policy.
+
+    Returns:
+        Whatever `func` returns.
+
+    Raises:
+        UpstreamError: On a permanent error, when the attempts or the retry budget
+            run out, when the circuit is open (CircuitOpen) or when the deadline
+            leaves no time (DeadlineExceeded). `cause` holds the last error.
+    """
+    attempts = _Attempts(endpoint, retry_policy)
+    for attempt in range(attempts.policy.attempts):
+        attempts.start(attempt)
+        try:
+            result = func()
+        except Exception as e:
+            delay = attempts.failed(attempt, e)
+        else:
+            attempts.succeeded()
+            return result
+        time.sleep(delay)
+
+
+async def call_async(endpoint, func, retry_policy=None):
+    """
+    Like call(), for a coroutine function: each attempt awaits `func()`, and
+    backoffs sleep without blocking the event loop.
+    """
+    import asyncio
+
+    attempts = _Attempts(endpoint, retry_policy)
+    for attempt in range(attempts.policy.attempts):
+        attempts.start(attempt)
+        try:
+            result = await func()
+        except Exception as e:
+            delay = attempts.failed(attempt, e)
+        else:
+            attempts.succeeded()
+            return result
+        await asyncio.sleep(delay)
@@ -0,0 +1,197 @@
+import re
+import html
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+
+# Numeric route model. Routes keep Google's machine values (seconds, meters)
+# and interned freeway IDs; ranking and battery math run vectorized over all
+# departure slots and alternatives, and text is only produced when the
+# prompt is rendered.
+
+METERS_PER_MILE = 1609.344
+
+
+class FreewayRegistry:
+    """Interns freeway names ("US-101") as small integer IDs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = []
+
+    def intern(self, name):
+        with self._lock:
+            freeway_id = self._ids.get(name)
+            if freeway_id is None:
+                freeway_id = len(self._names)
+                self._ids[name] = freeway_id
+                self._names.append(name)
+            return freeway_id
+
+    def intern_all(self, names):
+        return tuple(self.intern(name) for name in names)
+
+    def name(self, freeway_id):
+        return self._names[freeway_id]
+
+    def names(self, freeway_ids):
+        return [self._names[freeway_id] for freeway_id in freeway_ids]
+
+
+freeways = FreewayRegistry()
+
+
+# --- Freeway extraction from Directions steps ---
+
+STATE_CODES = (
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY",
+    "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND",
+    "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY",
+)
+
+# Spelled-out and abbreviated highway types, mapped to one canonical prefix
+# so "Interstate 280", "I 280" and "I-280" intern to the same ID. Matching is
+# case-sensitive on purpose: "in 500 ft" must not read as Indiana 500.
+HIGHWAY_PREFIXES = {
+    "Interstate": "I", "I": "I",
+    "US": "US", "U.S.": "US",
+    "State Route": "SR", "State Highway": "SR", "SR": "SR",
+    "Highway": "Hwy", "Hwy": "Hwy", "HWY": "Hwy",
+    **{code: code for code in STATE_CODES},
+}
+
+_HTML_TAG = re.compile(r"<[^>]+>")
+_HIGHWAY = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(p) for p in HIGHWAY_PREFIXES), key=len, reverse=True)) + r")"
+    r"[- ]?(\d{1,4}[A-Z]?)\b"
+)
+
+STEP_CACHE_MAX_ENTRIES = 16384
+
+_step_cache_lock = threading.Lock()
+_step_cache = {}
+
+
+def extract_freeways(instructions):
+    """
+    Returns the highway names in one step's html_instructions, normalized
+    ("Merge onto <b>Interstate 280 S</b>" -> ["I-280"]).
+    """
+    text = html.unescape(_HTML_TAG.sub(" ", instructions))
+    return [f"{HIGHWAY_PREFIXES[prefix]}-{number}" for prefix, number in _HIGHWAY.findall(text)]
+
+
+def step_freeway_ids(step):
+    """
+    Interned freeway IDs for one Directions step, memoized by the step's
+    polyline (or its instructions when there is none). Alternatives repeat
+    across departure slots, so most steps are only parsed once per process.
+    """
+    instructions = step.get("html_instructions", "")
+    key = (step.get("polyline") or {}).get("points") or instructions
+    ids = _step_cache.get(key)
+    if ids is None:
+        ids = freeways.intern_all(extract_freeways(instructions))
+        with _step_cache_lock:
+            if len(_step_cache) >= STEP_CACHE_MAX_ENTRIES:
+                _step_cache.clear()
+            _step_cache[key] = ids
+    return ids
+
+
+def route_freeway_ids(steps):
+    """Interned freeway IDs along a route's steps, deduplicated in travel order."""
+    return tuple(dict.fromkeys(freeway_id for step in steps for freeway_id in step_freeway_ids(step)))
+
+
+@dataclass(slots=True)
+class RouteRecord:
+    """One route alternative for one departure time."""
+    departure_time: datetime
+    duration_s: int = None
+    distance_m: int = None
+    freeway_ids: tuple = ()
+    error: str = None
+    # "live" (Directions call), "local" (local road graph) or "history" (predicted, no call made)
+    source: str = "live"
+    # Historical p10/p90 duration for this departure slot, if known
+    p10_s: float = None
+    p90_s: float = None
+    history_samples: int = 0
+
+    @property
+    def freeway_names(self):
+        return freeways.names(self.freeway_ids)
+
+
+ROUTE_DTYPE = [
+    ("departure_ts", "i8"),
+    ("duration_s", "f8"),
+    ("distance_m", "f8"),
+    ("ok", "?"),
+]
+
+
+def records_to_array(records):
+    """Packs route records into a NumPy structured array (NaN where a probe failed)."""
+    import numpy as np
+
+    array = np.zeros(len(records), dtype=ROUTE_DTYPE)
+    for i, record in enumerate(records):
+        ok = record.error is None and record.duration_s is not None
+        array[i] = (
+            int(record.departure_time.timestamp()),
+            record.duration_s if ok else np.nan,
+            record.distance_m if ok and record.distance_m is not None else np.nan,
+            ok,
+        )
+    return array
+
+
+def battery_drain(distance_m, drain_per_mile=0.5):
+    """Battery percentage used for a distance in meters. Works on scalars and arrays."""
+    import numpy as np
+
+    return np.round(np.asarray(distance_m, dtype=float) / METERS_PER_MILE * drain_per_mile, 1)
+
+
+def rank_routes(records):
+    """
+    Orders routes by departure time, fastest alternative first within each
+    departure, with failed probes last.
+
+    Returns:
+        tuple: (order, best) where `order` is the index order and `best` is a
+               boolean array marking the fastest route of each departure.
+    """
+    import numpy as np
+
+    array = records_to_array(records)
+    if not len(array):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    durations = np.where(array["ok"], array["duration_s"], np.inf)
+    order = np.lexsort((durations, array["departure_ts"]))
+
+    sorted_ts = array["departure_ts"][order]
+    first_of_departure = np.ones(len(order), dtype=bool)
+    first_of_departure[1:] = sorted_ts[1:] != sorted_ts[:-1]
+
+    best = np.zeros(len(array), dtype=bool)
+    best[order[first_of_departure & array["ok"][order]]] = True
+    return order, best
+
+
+# --- Formatting (prompt-render time only) ---
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"{minutes} mins"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} hour{'s' if hours > 1 else ''} {minutes} mins"
+
+
+def format_distance(meters):
+    return f"{meters / METERS_PER_MILE:.1f} mi"
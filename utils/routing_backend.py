@@ -0,0 +1,273 @@
+import time
+import threading
+from collections import OrderedDict
+from utils import telemetry, resilience
+from utils.config import get_setting, get_client
+from utils.rate_limiter import api_slot
+from utils.route_model import RouteRecord, battery_drain, route_freeway_ids, freeways as freeway_registry
+
+# Routing backends behind the traffic stage.
+#
+# utils.get_routes_data and the legacy utils.get_maps_data only talk to the
+# backend returned by routing_backend(), chosen with ROUTING_BACKEND:
+#   google - Distance Matrix and Directions with live traffic (default)
+#   local  - A* over the road-network extract in ROUTING_GRAPH_DIR (see
+#            utils.local_router); no network calls and no Maps quota
+
+# Distance Matrix limits per request
+MAX_MATRIX_ORIGINS = 25
+MAX_MATRIX_DESTINATIONS = 25
+MAX_MATRIX_ELEMENTS = 100
+
+
+def _estimate(duration_s, distance_m):
+    return {
+        "duration_s": duration_s,
+        "distance_m": distance_m,
+        "battery_drainage": float(battery_drain(distance_m))
+    }
+
+
+class RoutingBackend:
+    """
+    Interface of a routing backend.
+
+    `live_traffic` tells whether results reflect the traffic at call time.
+    Only those are recorded in the traffic history, and only those are worth
+    replacing with a history prediction.
+    """
+    name = None
+    live_traffic = False
+
+    def commute_estimates(self, pairs, departure_time):
+        """
+        Estimates many commutes at once.
+
+        Args:
+            pairs (list): Distinct (origin, destination) tuples.
+            departure_time (datetime)
+
+        Returns:
+            dict: (origin, destination) -> estimate dict, or None if there is no route.
+
+        Raises:
+            resilience.UpstreamError: If the backend can't be reached.
+        """
+        raise NotImplementedError
+
+    def departure_routes(self, origin, destination, departure_time, alternatives=True):
+        """
+        Looks up the routes for a single departure time. A failed lookup is
+        returned as one record with `error` set.
+
+        Returns:
+            list: RouteRecords, one per alternative (or just the best one).
+        """
+        raise NotImplementedError
+
+
+# --- Google Maps ---
+
+def plan_distance_matrix_requests(pairs):
+    """
+    Packs (origin, destination) pairs into as few Distance Matrix requests as the
+    per-request limits allow. Origins that need the same set of destinations (e.g.
+    everyone commuting to one office) share requests.
+
+    Returns:
+        list: (origins, destinations) tuples, one per request.
+    """
+    destinations_by_origin = {}
+    for origin, destination in pairs:
+        destinations_by_origin.setdefault(origin, [])
+        if destination not in destinations_by_origin[origin]:
+            destinations_by_origin[origin].append(destination)
+
+    origins_by_destinations = {}
+    for origin, destinations in destinations_by_origin.items():
+        origins_by_destinations.setdefault(tuple(destinations), []).append(origin)
+
+    batches = []
+    for destinations, origins in origins_by_destinations.items():
+        for d in range(0, len(destinations), MAX_MATRIX_DESTINATIONS):
+            dest_chunk = list(destinations[d:d + MAX_MATRIX_DESTINATIONS])
+            origins_per_request = max(1, min(MAX_MATRIX_ORIGINS, MAX_MATRIX_ELEMENTS // len(dest_chunk)))
+            for o in range(0, len(origins), origins_per_request):
+                batches.append((origins[o:o + origins_per_request], dest_chunk))
+    return batches
+
+
+def _acquire_maps_quota():
+    started = time.monotonic()
+    get_client("maps_rate_limiter").acquire()
+    telemetry.observe("rate_limit_wait_seconds", time.monotonic() - started, api="maps")
+
+
+class GoogleRoutingBackend(RoutingBackend):
+    """Distance Matrix and Directions through the shared googlemaps client."""
+    name = "google"
+    live_traffic = True
+
+    def commute_estimates(self, pairs, departure_time):
+        wanted = set(pairs)
+        estimates = {}
+
+        for origins, destinations in plan_distance_matrix_requests(pairs):
+            def fetch():
+                with telemetry.span("maps.distance_matrix", origins=len(origins), destinations=len(destinations)), api_slot("maps"):
+                    # Shared across threads so concurrent calls stay within the Maps QPS quota
+                    _acquire_maps_quota()
+                    return get_client("gmaps").distance_matrix(
+                        origins=origins,
+                        destinations=destinations,
+                        departure_time=departure_time,
+                        units="imperial",
+                        traffic_model="best_guess"
+                    )
+
+            result = resilience.call("maps.distance_matrix", fetch)
+
+            for row, origin in zip(result["rows"], origins):
+                for element, destination in zip(row["elements"], destinations):
+                    if (origin, destination) not in wanted:
+                        continue
+                    if element.get("status") != "OK":
+                        estimates[(origin, destination)] = None
+                        continue
+                    # Machine values (seconds, meters), not the localized display text
+                    estimates[(origin, destination)] = _estimate(
+                        (element.get("duration_in_traffic") or element["duration"])["value"], element["distance"]["value"])
+
+        return estimates
+
+    def departure_routes(self, origin, destination, departure_time, alternatives=True):
+        def fetch():
+            with telemetry.span("maps.directions", departure_time=departure_time.strftime("%H:%M")), api_slot("maps"):
+                _acquire_maps_quota()
+                return get_client("gmaps").directions(
+                    origin,
+                    destination,
+                    mode="driving",
+                    departure_time=departure_time,
+                    traffic_model="best_guess",
+                    alternatives=alternatives
+                )
+
+        try:
+            directions_result = resilience.call("maps.directions", fetch)
+        except resilience.UpstreamError as e:
+            return [RouteRecord(departure_time=departure_time, error=str(e))]
+        if not directions_result:
+            return [RouteRecord(departure_time=departure_time, error="No results")]
+
+        results = []
+        for route in directions_result:
+            leg = route["legs"][0]
+            results.append(RouteRecord(
+                departure_time=departure_time,
+                duration_s=(leg.get("duration_in_traffic") or leg["duration"])["value"],
+                distance_m=leg["distance"]["value"],
+                freeway_ids=route_freeway_ids(leg["steps"])
+            ))
+        return results
+
+
+# --- Local road graph ---
+
+class LocalRoutingBackend(RoutingBackend):
+    """
+    Routes over a local road-network extract. Origins and destinations are
+    places named in the extract or "lat,lng" strings. Answers are memoized
+    per speed-profile slot, so repeat lookups (the same commute every run,
+    departures a few minutes apart) cost a dictionary lookup.
+
+    Args:
+        directory (str): Extract written by utils.local_router.build_extract.
+        alternatives (int): Routes per departure, like Google's alternatives.
+        cache_entries (int): Memoized lookups kept.
+    """
+    name = "local"
+    live_traffic = False
+
+    def __init__(self, directory, alternatives=3, cache_entries=4096):
+        from utils.local_router import RoadGraph
+        self.graph = RoadGraph(directory)
+        self.alternatives = alternatives
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._paths = OrderedDict()
+
+    def paths(self, origin, destination, departure_time, alternatives):
+        """
+        Paths for one trip, fastest first.
+
+        Raises:
+            LookupError: If the origin or destination isn't in the extract.
+        """
+        source, target = self.graph.resolve(origin), self.graph.resolve(destination)
+        key = (source, target, self.graph.time_slot(departure_time), alternatives)
+        with self._lock:
+            paths = self._paths.get(key)
+            if paths is not None:
+                self._paths.move_to_end(key)
+        telemetry.cache_result("local_routes", paths is not None)
+        if paths is not None:
+            return paths
+
+        with telemetry.span("routing.local", departure_time=departure_time.strftime("%H:%M")):
+            paths = self.graph.routes(source, target, departure_time, alternatives)
+        with self._lock:
+            self._paths[key] = paths
+            while len(self._paths) > self.cache_entries:
+                self._paths.popitem(last=False)
+        return paths
+
+    def commute_estimates(self, pairs, departure_time):
+        estimates = {}
+        for origin, destination in pairs:
+            try:
+                paths = self.paths(origin, destination, departure_time, 1)
+            except LookupError as e:
+                print(f"Local router: {e}")
+                paths = []
+            estimates[(origin, destination)] = _estimate(round(paths[0].duration_s), round(paths[0].distance_m)) if paths else None
+        return estimates
+
+    def departure_routes(self, origin, destination, departure_time, alternatives=True):
+        try:
+            paths = self.paths(origin, destination, departure_time, self.alternatives if alternatives else 1)
+        except LookupError as e:
+            return [RouteRecord(departure_time=departure_time, error=str(e), source="local")]
+        if not paths:
+            return [RouteRecord(departure_time=departure_time, error="No results", source="local")]
+        return [RouteRecord(
+            departure_time=departure_time,
+            duration_s=round(path.duration_s),
+            distance_m=round(path.distance_m),
+            freeway_ids=freeway_registry.intern_all(path.freeways),
+            source="local"
+        ) for path in paths]
+
+
+def create_backend(name=None):
+    """
+    Builds the routing backend named `name` (ROUTING_BACKEND, default "google").
+
+    Raises:
+        ValueError: For an unknown backend, or "local" without ROUTING_GRAPH_DIR.
+    """
+    name = (name or get_setting("ROUTING_BACKEND", "google")).lower()
+    if name == "google":
+        return GoogleRoutingBackend()
+    if name == "local":
+        directory = get_setting("ROUTING_GRAPH_DIR")
+        if not directory:
+            raise ValueError("ROUTING_BACKEND=local needs ROUTING_GRAPH_DIR (a directory built by utils.local_router)")
+        return LocalRoutingBackend(directory, alternatives=get_setting("LOCAL_ROUTER_ALTERNATIVES", 3, int),
+                                   cache_entries=get_setting("LOCAL_ROUTER_CACHE_ENTRIES", 4096, int))
+    raise ValueError(f"Unknown ROUTING_BACKEND: {name}")
+
+
+def routing_backend():
+    """The shared routing backend."""
+    return get_client("routing")
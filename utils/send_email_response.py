@@ -1,44 +1,167 @@
 import json
 import smtplib
+import html
+import re
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import os
 from datetime import datetime, timedelta
 
-from dotenv import load_dotenv
+from utils.rate_limiter import api_slot
+from utils import telemetry, resilience
+from utils.config import get_setting
 
-load_dotenv()
 # -- Config --
-SMTP_SERVER = os.getenv("SMTP_SERVER")
-SMTP_PORT = os.getenv("SMTP_PORT")
-SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-SENDER_PASSWORD = os.getenv("SENDER_PASSWORD")
-RECIPIENT_EMAIL =  os.getenv("RECIPIENT_EMAIL")
-JSON_FILE_PATH = os.getenv("PROMPT_OUTPUT_FILENAME")
+# Read on use: SMTP_SERVER, SMTP_PORT, SENDER_EMAIL, SENDER_PASSWORD, RECIPIENT_EMAIL,
+# PROMPT_OUTPUT_FILENAME, SMTP_USE_SSL (set to false to talk plain SMTP, e.g. to a
+# local aiosmtpd/debugging server) and EMAIL_HTML.
 
-def send_email():
-	with open(JSON_FILE_PATH, "r", encoding="utf-8") as f:
-		data = json.load(f)
+# Connection-level failures worth reconnecting for
+RETRYABLE_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError, ConnectionError, TimeoutError)
 
-	decoded_text = data["claude_output"]
 
-	# -- Compose --
+def briefing_to_html(text):
+	"""Renders the briefing's light markdown (**bold**, line breaks) as HTML."""
+	escaped = html.escape(text)
+	escaped = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", escaped)
+	return "<html><body>{}</body></html>".format(escaped.replace("\n", "<br>\n"))
+
+
+def build_briefing_message(briefing, html_body=None):
+	"""
+	Builds the MIME message once. Only the To header changes per recipient, so
+	the same message can be re-sent to many recipients without rebuilding it.
+	"""
 	msg = MIMEMultipart("alternative")
 	dt = datetime.now() + timedelta(days=1)
 	formatted_date = dt.strftime("%B %d, %Y")
 	msg["Subject"] = "{} - Commute Briefing".format(formatted_date)
-	msg["From"] = SENDER_EMAIL
-	msg["To"] = RECIPIENT_EMAIL
+	msg["From"] = get_setting("SENDER_EMAIL")
+	msg["To"] = ""
+
+	# Add plain text version (and HTML, which clients prefer when present)
+	msg.attach(MIMEText(briefing, "plain"))
+	if html_body:
+		msg.attach(MIMEText(html_body, "html"))
+	return msg
+
+
+class SMTPMailer:
+	"""
+	Keeps one authenticated SMTP connection open and sends many messages over it.
+
+	The connection is opened on first use, re-opened if the server drops it, and
+	failed sends are retried under the "smtp" policy of utils.resilience. Only
+	the exchange with the server is serialized, so one mailer can be shared by
+	several threads and a send backing off between retries doesn't hold up the rest.
+
+	Args:
+		server (str): SMTP host. Defaults to the SMTP_SERVER setting.
+		port (int): SMTP port. Defaults to the SMTP_PORT setting.
+		use_ssl (bool): Use SMTP over SSL. Defaults to the SMTP_USE_SSL setting.
+		max_retries (int, optional): Attempts per message. Defaults to RETRY_SMTP_ATTEMPTS (3).
+		base_delay (float, optional): Initial backoff in seconds. Defaults to RETRY_SMTP_BASE_DELAY (1).
+		timeout (float, optional): Socket timeout in seconds. Defaults to SMTP_TIMEOUT (30).
+	"""
+
+	def __init__(self, server=None, port=None, use_ssl=None, max_retries=None, base_delay=None, timeout=None):
+		self.server = server or get_setting("SMTP_SERVER")
+		self.port = int(port or get_setting("SMTP_PORT"))
+		self.use_ssl = get_setting("SMTP_USE_SSL", "true").lower() != "false" if use_ssl is None else use_ssl
+		self.sender = get_setting("SENDER_EMAIL")
+		self.password = get_setting("SENDER_PASSWORD")
+		self.policy = resilience.with_overrides(resilience.policy("smtp"), attempts=max_retries, base_delay=base_delay, timeout=timeout)
+		self.timeout = self.policy.timeout
+		self._connection = None
+		self._lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
 
-	# Add plain text version
-	msg.attach(MIMEText(decoded_text, "plain"))
+	def _connect(self):
+		smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+		connection = smtp_class(self.server, self.port, timeout=self.timeout)
+		if self.password:
+			try:
+				connection.login(self.sender, self.password)
+			except Exception:
+				# Not kept as self._connection, so nothing else would close it
+				connection.close()
+				raise
+		self._connection = connection
+
+	def close(self):
+		with self._lock:
+			self._disconnect()
+
+	def _disconnect(self):
+		if self._connection is not None:
+			try:
+				self._connection.quit()
+			except Exception:
+				pass
+			self._connection = None
+
+	def send(self, msg, recipient):
+		"""Sends `msg` to one recipient, reconnecting and retrying as needed. Returns True on success."""
+		with self._lock:
+			# The message may be shared between threads; address and serialize it in one go
+			if "To" in msg:
+				msg.replace_header("To", recipient)
+			else:
+				msg["To"] = recipient
+			payload = msg.as_string()
+
+		def attempt():
+			with telemetry.span("smtp.send", bytes=len(payload)), api_slot("smtp"):
+				# Only the exchange with the server holds the lock, so other
+				# sends aren't blocked while this one backs off between retries
+				with self._lock:
+					try:
+						if self._connection is None:
+							with telemetry.span("smtp.connect", server=self.server):
+								self._connect()
+						self._connection.sendmail(self.sender, recipient, payload)
+					except RETRYABLE_ERRORS:
+						# Reconnect on the next attempt
+						self._disconnect()
+						raise
+
+		try:
+			resilience.call("smtp.send", attempt, self.policy)
+			return True
+		except resilience.UpstreamError as e:
+			# Rejected recipients and auth failures aren't retried at all
+			print(f"Failed to send email to {recipient}: {e}")
+			return False
+
+
+def send_email(briefing=None, recipient=None, mailer=None):
+	"""
+	Emails the briefing. Without arguments, the briefing is read from
+	PROMPT_OUTPUT_FILENAME and sent to RECIPIENT_EMAIL. Pass a shared
+	SMTPMailer to reuse its connection across many emails.
+	"""
+	if briefing is None:
+		with open(get_setting("PROMPT_OUTPUT_FILENAME"), "r", encoding="utf-8") as f:
+			data = json.load(f)
+		briefing = data["claude_output"]
+	recipient = recipient or get_setting("RECIPIENT_EMAIL")
+
+	# -- Compose --
+	email_html = get_setting("EMAIL_HTML", "false").lower() == "true"
+	msg = build_briefing_message(briefing, briefing_to_html(briefing) if email_html else None)
 
 	# -- Send --
-	try:
-		with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-			server.login(SENDER_EMAIL, SENDER_PASSWORD)
-			server.sendmail(SENDER_EMAIL, RECIPIENT_EMAIL, msg.as_string())
-		print("Email sent successfully!")
-	except Exception as e:
-		print(f"Failed to send email: {e}")
+	if mailer is not None:
+		sent = mailer.send(msg, recipient)
+	else:
+		with SMTPMailer() as mailer:
+			sent = mailer.send(msg, recipient)
 
+	if sent:
+		print("Email sent successfully!")
+	return sent
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Shares the result of identical lookups within a process.
+
+    The first caller for a key runs the function; concurrent and later callers
+    with the same key wait for and reuse that result. Failures are not kept,
+    so the next caller retries. Call `clear` to start a fresh batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                with self._lock:
+                    self._futures.pop(key, None)
+                future.set_exception(e)
+
+        return future.result()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """
+        Like `do`, for a coroutine function. Waiting for another caller's
+        result doesn't block the event loop; callers of `do` and `do_async`
+        share results with each other.
+        """
+        import asyncio
+
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+
+        if owner:
+            try:
+                future.set_result(await func(*args, **kwargs))
+            except BaseException as e:
+                with self._lock:
+                    self._futures.pop(key, None)
+                future.set_exception(e)
+
+        return await asyncio.wrap_future(future)
+
+    def prime(self, key, value):
+        """Stores an already known result, e.g. from a batched lookup."""
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._futures[key] = future
+
+    def clear(self):
+        with self._lock:
+            self._futures.clear()
@@ -0,0 +1,254 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from utils import telemetry, resilience
+
+
+class StageTimeout(Exception):
+    """Raised (and recorded) when a stage runs past its timeout."""
+
+
+class StageSkipped(Exception):
+    """Recorded for a stage whose dependencies did not complete."""
+
+
+@dataclass
+class Stage:
+    """
+    A single step of the briefing pipeline.
+
+    Args:
+        name (str): Unique stage name. Other stages refer to it in `deps`.
+        func (callable): Called with the results of its dependencies as keyword
+                         arguments, named after the dependency stages.
+        deps (tuple): Names of stages that must finish before this one starts.
+        timeout (float, optional): Seconds the stage may run before it is
+                                   abandoned and marked as timed out. Also the
+                                   deadline for the stage's external calls.
+        fallback (callable, optional): Called without arguments when the stage
+                                       fails or times out; its return value (e.g.
+                                       cached data, or None for "unavailable") is
+                                       used instead and dependents still run.
+    """
+    name: str
+    func: callable
+    deps: tuple = ()
+    timeout: float = None
+    fallback: callable = None
+
+
+@dataclass
+class StageResult:
+    name: str
+    value: object = None
+    error: BaseException = None
+    started_at: float = None
+    wall_time: float = None
+    # The failure the value stands in for, when it came from the stage's fallback
+    fallback_from: BaseException = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class _StagePool:
+    """
+    A minimal thread pool whose workers are daemon threads. ThreadPoolExecutor
+    workers are joined when the interpreter exits, so a stage abandoned at its
+    timeout would still hold the process open until it returned.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix="stage"):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queue = queue.SimpleQueue()
+        self._threads = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._queue.put((future, fn, args))
+        if len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._work, name=f"{self.thread_name_prefix}_{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        """Cancels stages that haven't started and lets idle workers exit, without waiting."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+        for _ in self._threads:
+            self._queue.put(None)
+
+
+def _check_graph(stages):
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError("Stage names must be unique")
+
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    # Reject cycles up front, otherwise the scheduler would simply never start them
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at stage '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def run_stages(stages, max_workers=None):
+    """
+    Runs a dependency graph of stages, starting every stage as soon as all of
+    its dependencies have finished. Independent stages run concurrently on a
+    thread pool, so total latency is bounded by the slowest path through the
+    graph rather than the sum of all stages.
+
+    A stage that raises or times out is recorded as failed, and every stage
+    depending on it is skipped, unless the stage has a fallback: its value is
+    then used instead. Threads cannot be interrupted, so a timed out stage is
+    abandoned rather than killed; its external calls stop retrying at the
+    stage's deadline. Stages run on daemon threads, so an abandoned stage
+    doesn't keep the process from exiting either.
+
+    Args:
+        stages (list[Stage]): The stages to run.
+        max_workers (int, optional): Thread pool size. Defaults to one thread per stage.
+
+    Returns:
+        dict: Stage name -> StageResult, in the order the stages were given.
+    """
+    _check_graph(stages)
+
+    pending = {stage.name: stage for stage in stages}
+    results = {stage.name: StageResult(stage.name) for stage in stages}
+    running = {}  # future -> stage
+
+    executor = _StagePool(max_workers or max(len(stages), 1), thread_name_prefix="stage")
+
+    def run(stage, kwargs):
+        results[stage.name].started_at = time.monotonic()
+        with telemetry.span(f"stage.{stage.name}"), resilience.deadline(stage.timeout):
+            return stage.func(**kwargs)
+
+    def finish(stage, value=None, error=None):
+        result = results[stage.name]
+        if error is not None and stage.fallback is not None and not isinstance(error, StageSkipped):
+            try:
+                value, result.fallback_from, error = stage.fallback(), error, None
+            except Exception as e:
+                print(f"Fallback for stage '{stage.name}' failed: {e}")
+        result.value = value
+        result.error = error
+        if result.started_at is not None:
+            result.wall_time = time.monotonic() - result.started_at
+        else:
+            result.wall_time = 0.0
+
+    try:
+        while pending or running:
+            # Start (or skip) every stage whose dependencies are settled
+            for name, stage in list(pending.items()):
+                dep_results = [results[dep] for dep in stage.deps]
+                if any(dep.wall_time is None for dep in dep_results):
+                    continue
+                del pending[name]
+
+                failed = [dep.name for dep in dep_results if not dep.ok]
+                if failed:
+                    finish(stage, error=StageSkipped(f"Skipped because {', '.join(failed)} failed"))
+                    continue
+
+                kwargs = {dep.name: dep.value for dep in dep_results}
+                future = executor.submit(telemetry.bind(run), stage, kwargs)
+                running[future] = stage
+
+            if not running:
+                continue
+
+            # Wake up either when a stage finishes or when the nearest timeout expires
+            now = time.monotonic()
+            deadlines = [
+                results[stage.name].started_at + stage.timeout
+                for stage in running.values()
+                if stage.timeout is not None and results[stage.name].started_at is not None
+            ]
+            wait_for = max(min(deadlines) - now, 0) if deadlines else None
+            if any(stage.timeout is not None and results[stage.name].started_at is None
+                   for stage in running.values()):
+                # A stage with a timeout has not started yet; poll until it does
+                wait_for = 0.05 if wait_for is None else min(wait_for, 0.05)
+
+            done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    finish(stage, value=future.result())
+                except Exception as e:
+                    finish(stage, error=e)
+
+            now = time.monotonic()
+            for future, stage in list(running.items()):
+                started_at = results[stage.name].started_at
+                if stage.timeout is not None and started_at is not None and now - started_at >= stage.timeout:
+                    del running[future]
+                    future.cancel()
+                    finish(stage, error=StageTimeout(f"Stage '{stage.name}' timed out after {stage.timeout}s"))
+    finally:
+        # Returns without waiting for abandoned (timed out) stages
+        executor.shutdown()
+
+    return results
+
+
+def print_stage_report(results):
+    """Prints the wall time and outcome of every stage."""
+    print("<---------------------------->")
+    print("Stage timings:")
+    for result in results.values():
+        if result.fallback_from is not None:
+            status = f"degraded, used fallback ({result.fallback_from})"
+        elif result.ok:
+            status = "ok"
+        elif isinstance(result.error, StageSkipped):
+            status = "skipped"
+        elif isinstance(result.error, StageTimeout):
+            status = "timed out"
+        else:
+            status = f"failed ({result.error})"
+        print(f"  {result.name:<10} {result.wall_time:7.2f}s  {status}")
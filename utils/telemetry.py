@@ -0,0 +1,272 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import partial
+from utils.config import get_setting
+
+# In-process tracing and metrics.
+#
+# Every stage and every external call runs inside a span; spans nest through
+# a context variable, so a slow run can be traced down to the hop that caused
+# it. Metrics are counters and latency histograms keyed by name and labels.
+# Nothing leaves the process until flush() writes the configured outputs:
+#   TELEMETRY_PROMETHEUS_FILE - metrics in Prometheus text format (textfile collector)
+#   TELEMETRY_OTEL_FILE       - spans as OTLP/JSON (OpenTelemetry)
+
+METRIC_PREFIX = "briefer_"
+SERVICE_NAME = "commute-briefer"
+
+# Seconds; wide enough for a 90s Tesla wake-up
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_spans = []
+_dropped_spans = 0
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+# --- Metrics ---
+
+def increment(name, amount=1, **labels):
+    """Adds `amount` to the counter `name` with the given labels."""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Records one observation (in seconds) in the histogram `name`."""
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[-1] += value
+
+
+def cache_result(cache, hit):
+    """Counts a cache lookup; hit rates are hits / (hits + misses)."""
+    increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def retry(api, reason):
+    increment("retries_total", api=api, reason=reason)
+
+
+# --- Spans ---
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.error = None
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, message):
+        """Marks the span as failed without raising, e.g. for an HTTP error the caller handles."""
+        self.error = str(message)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times a block as a span named `name`, nested under the current span.
+
+    Args:
+        name (str): Dotted span name, e.g. "tesla.vehicle_data".
+        **attributes: Span attributes (vehicle ID, departure time, HTTP status...).
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _finish(current)
+
+
+def _finish(finished):
+    global _dropped_spans
+    observe("span_duration_seconds", finished.duration, span=finished.name)
+    if finished.error:
+        increment("span_errors_total", span=finished.name)
+    max_spans = get_setting("TELEMETRY_MAX_SPANS", 10000, int)
+    with _lock:
+        if len(_spans) < max_spans:
+            _spans.append(finished)
+        else:
+            _dropped_spans += 1
+
+
+def bind(func):
+    """
+    Returns `func` bound to the current span context, for handing work to a
+    thread pool: spans opened by the worker nest under the submitter's span.
+    """
+    return partial(contextvars.copy_context().run, func)
+
+
+def finished_spans():
+    with _lock:
+        return list(_spans)
+
+
+def clear_spans():
+    """Drops the finished spans but keeps the metrics, e.g. once a long-running process has flushed them."""
+    global _dropped_spans
+    with _lock:
+        _spans.clear()
+        _dropped_spans = 0
+
+
+def reset():
+    """Drops all recorded spans and metrics."""
+    global _dropped_spans
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _spans.clear()
+        _dropped_spans = 0
+
+
+# --- Export ---
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def prometheus_text():
+    """Renders every counter and histogram in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+        dropped = _dropped_spans
+
+    lines = []
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        for (counter_name, labels), value in counters:
+            if counter_name == name:
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for (name, _), _ in histograms}):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+        for (histogram_name, labels), values in histograms:
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {cumulative}")
+
+    lines.append(f"# TYPE {METRIC_PREFIX}dropped_spans_total counter")
+    lines.append(f"{METRIC_PREFIX}dropped_spans_total {dropped}")
+    return "\n".join(lines) + "\n"
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otel_json():
+    """Renders the finished spans as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for finished in finished_spans():
+        record = {
+            "traceId": finished.trace_id,
+            "spanId": finished.span_id,
+            "name": finished.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(finished.start_ns),
+            "endTimeUnixNano": str(finished.end_ns),
+            "attributes": [{"key": key, "value": _otel_value(value)} for key, value in finished.attributes.items()],
+            # STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+            "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+        }
+        if finished.parent_id:
+            record["parentSpanId"] = finished.parent_id
+        spans.append(record)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "utils.telemetry"}, "spans": spans}],
+        }]
+    }
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def flush():
+    """Writes TELEMETRY_PROMETHEUS_FILE and/or TELEMETRY_OTEL_FILE, if set."""
+    import json
+
+    prometheus_file = get_setting("TELEMETRY_PROMETHEUS_FILE")
+    if prometheus_file:
+        _write_atomic(prometheus_file, prometheus_text())
+    otel_file = get_setting("TELEMETRY_OTEL_FILE")
+    if otel_file:
+        _write_atomic(otel_file, json.dumps(otel_json(), separators=(",", ":")))
+
+
+def print_slowest_spans(count=5):
+    """Prints the slowest external calls of the run (spans without children)."""
+    spans = finished_spans()
+    parents = {finished.parent_id for finished in spans}
+    leaves = sorted((s for s in spans if s.span_id not in parents), key=lambda s: s.duration, reverse=True)[:count]
+    if not leaves:
+        return
+    print("Slowest calls:")
+    for finished in leaves:
+        status = f"  FAILED: {finished.error}" if finished.error else ""
+        print(f"  {finished.name:<24} {finished.duration:7.2f}s{status}")
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from utils import telemetry
+
+# Tesla OAuth tokens, shared safely between threads and processes.
+#
+# Refresh tokens rotate: every refresh returns a new one and retires the old
+# one, so two runs refreshing the same account at once would leave one of
+# them holding a dead token. Per token file (one account), this module
+# keeps the tokens in memory, lets one thread per process refresh at a time,
+# and holds an exclusive lock on "<token file>.lock" across processes while
+# reading, refreshing and writing. A refresh that finds a fresh token already
+# on disk adopts it instead of spending the refresh token. Writes go through
+# a temp file and an atomic rename, so readers never see a partial file.
+#
+# Tokens are refreshed in the background once they are within
+# `refresh_ahead` seconds of expiry. Briefings only wait for the OAuth
+# endpoint when the token is within `refresh_margin` seconds of expiry.
+
+# Retry delay after a failed background refresh
+BACKGROUND_RETRY_S = 60
+
+
+def read_tokens(token_file):
+    """Reads a token file; returns None if it is missing or unreadable."""
+    try:
+        with open(token_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not read tokens from {token_file}: {e}")
+        return None
+
+
+def write_tokens(token_file, tokens):
+    """Writes a token file atomically, readable by its owner only."""
+    directory = os.path.dirname(os.path.abspath(token_file))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tokens-", suffix=".tmp")  # created with mode 0600
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(tokens, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, token_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def seconds_left(tokens, now=None):
+    """Seconds until the access token expires, or None if the expiry isn't recorded."""
+    if "obtained_at" not in tokens or "expires_in" not in tokens:
+        return None
+    return tokens["obtained_at"] + tokens["expires_in"] - (time.time() if now is None else now)
+
+
+@contextmanager
+def file_lock(path, timeout):
+    """
+    Holds an exclusive lock on `path` (created if missing).
+
+    Raises:
+        TimeoutError: If another process holds the lock for `timeout` seconds.
+    """
+    started = time.monotonic()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as lock:
+        while True:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() - started >= timeout:
+                    raise TimeoutError(f"Timed out after {timeout:.0f}s waiting for {path}") from None
+                time.sleep(0.05)
+        telemetry.observe("token_lock_wait_seconds", time.monotonic() - started)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+class _Account:
+    __slots__ = ("token_file", "tokens", "lock", "timer")
+
+    def __init__(self, token_file):
+        self.token_file = token_file
+        self.tokens = None
+        # Held while refreshing, so one refresh per account is in flight
+        self.lock = threading.Lock()
+        # Pending background refresh; guarded by the manager's lock
+        self.timer = None
+
+
+class TokenManager:
+    """
+    Hands out valid access tokens, one account per token file.
+
+    Args:
+        refresh (callable): refresh(refresh_token) returns the new token dict
+                            (with "obtained_at"), or None if the refresh failed.
+        refresh_margin (float): Seconds before expiry below which a caller waits for a refresh.
+        refresh_ahead (float): Seconds before expiry at which the background refresh starts.
+        background (bool): Set to False to only refresh when a caller needs it.
+        lock_timeout (float): Seconds to wait for another process's refresh.
+    """
+
+    def __init__(self, refresh, refresh_margin=300, refresh_ahead=900, background=True, lock_timeout=30):
+        self.refresh = refresh
+        self.refresh_margin = refresh_margin
+        self.refresh_ahead = max(refresh_ahead, refresh_margin)
+        self.background = background
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._closed = False
+
+    def _account(self, token_file):
+        path = os.path.abspath(token_file)
+        with self._lock:
+            account = self._accounts.get(path)
+            if account is None:
+                account = self._accounts[path] = _Account(path)
+            return account
+
+    def _fresh(self, tokens, margin):
+        if not tokens:
+            return False
+        left = seconds_left(tokens)
+        return left is None or left >= margin
+
+    def access_token(self, token_file, initial_refresh_token=None):
+        """
+        Returns a valid access token for the account in `token_file`.
+
+        Args:
+            token_file (str): The account's token file.
+            initial_refresh_token (str, optional): Used when the file doesn't exist yet.
+
+        Returns:
+            str: The access token, or None if there are no tokens and none could be obtained.
+        """
+        account = self._account(token_file)
+        tokens = account.tokens
+        if tokens is None:
+            tokens = account.tokens = read_tokens(account.token_file)
+            telemetry.cache_result("tesla_tokens", False)
+        else:
+            telemetry.cache_result("tesla_tokens", True)
+
+        if not self._fresh(tokens, self.refresh_margin):
+            if tokens:
+                print("Access token is expiring soon or has expired.")
+            tokens = self._refresh(account, self.refresh_margin, initial_refresh_token, mode="inline")
+        if not tokens:
+            return None
+        self._schedule(account)
+        return tokens["access_token"]
+
+    def watch(self, token_file):
+        """Loads an account's tokens and arms its background refresh, without refreshing now."""
+        account = self._account(token_file)
+        if account.tokens is None:
+            account.tokens = read_tokens(account.token_file)
+        if account.tokens:
+            self._schedule(account)
+
+    def _refresh(self, account, margin, initial_refresh_token=None, mode="inline"):
+        """Refreshes unless another thread or process already has; returns the tokens or None."""
+        with account.lock:
+            # Another thread may have refreshed while this one waited
+            if self._fresh(account.tokens, margin):
+                return account.tokens
+            with file_lock(f"{account.token_file}.lock", self.lock_timeout):
+                # ... or another process, which rotated the refresh token on disk
+                on_disk = read_tokens(account.token_file)
+                if self._fresh(on_disk, margin):
+                    account.tokens = on_disk
+                    return on_disk
+
+                current = on_disk or account.tokens
+                refresh_token = (current or {}).get("refresh_token") or initial_refresh_token
+                if not refresh_token:
+                    print("No tokens found and TESLA_INITIAL_REFRESH_TOKEN not set in .env. "
+                          "Please perform initial browser authorization to get a refresh token.")
+                    return None
+                if not current:
+                    print("No token file found. Attempting to use initial refresh token from .env for first time setup.")
+
+                new_tokens = self.refresh(refresh_token)
+                telemetry.increment("token_refreshes_total", mode=mode, result="ok" if new_tokens else "failed")
+                if not new_tokens:
+                    print("Failed to refresh token. The refresh token might be invalid or expired. "
+                          "Manual re-authorization may be required.")
+                    return None
+                write_tokens(account.token_file, new_tokens)
+                account.tokens = new_tokens
+                print("Tokens saved.")
+                return new_tokens
+
+    # --- Background refresh ---
+
+    def _schedule(self, account, delay=None):
+        """Arms the account's refresh-ahead timer, unless one is pending or disabled."""
+        if not self.background or self._closed:
+            return
+        # Not the account lock: that one is held for the whole OAuth call
+        with self._lock:
+            if account.timer is not None:
+                return
+            if delay is None:
+                left = seconds_left(account.tokens or {})
+                if left is None:
+                    return
+                delay = max(left - self.refresh_ahead, 0)
+            # The timer only waits, so it must not keep the process alive
+            account.timer = threading.Timer(delay, self._start_background_refresh, (account,))
+            account.timer.daemon = True
+            account.timer.start()
+
+    def _start_background_refresh(self, account):
+        # The refresh itself runs in a non-daemon thread: if the process exits
+        # meanwhile, it waits for the rotated token to be saved
+        try:
+            threading.Thread(target=self._background_refresh, args=(account,), name="token-refresh").start()
+        except RuntimeError:
+            # Interpreter shutdown; the next run refreshes instead
+            with self._lock:
+                account.timer = None
+
+    def _background_refresh(self, account):
+        try:
+            tokens = self._refresh(account, self.refresh_ahead, mode="background")
+        except Exception as e:
+            print(f"Background token refresh failed: {e}")
+            tokens = None
+        with self._lock:
+            account.timer = None
+        if tokens:
+            self._schedule(account)
+        elif self._fresh(account.tokens, self.refresh_margin):
+            # Still usable for now; try again shortly
+            self._schedule(account, BACKGROUND_RETRY_S)
+
+    def close(self):
+        """Cancels pending background refreshes."""
+        with self._lock:
+            self._closed = True
+            for account in self._accounts.values():
+                if account.timer is not None:
+                    account.timer.cancel()
+                    account.timer = None
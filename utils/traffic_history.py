@@ -0,0 +1,181 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+# Local time-series store of observed Directions results, and a per-slot
+# predictor on top of it. Slots that history can answer confidently don't
+# need a live Directions call; the rest are probed and recorded.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    route_key TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    departure_date TEXT NOT NULL,
+    freeways TEXT NOT NULL,
+    duration_s INTEGER NOT NULL,
+    distance_m INTEGER NOT NULL,
+    observed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_observations_slot ON observations (route_key, weekday, slot);
+"""
+
+
+def route_key(origin, destination):
+    """Stable key for an origin/destination pair."""
+    return hashlib.sha1(f"{origin}\n{destination}".encode("utf-8")).hexdigest()[:16]
+
+
+def departure_slot(departure_time):
+    """Minutes since midnight of the departure time."""
+    return departure_time.hour * 60 + departure_time.minute
+
+
+@dataclass(slots=True)
+class SlotPrediction:
+    slot: int
+    samples: int
+    p10: float
+    p50: float
+    p90: float
+    last_observed_at: float
+    freeways: tuple
+    distance_m: int
+
+    @property
+    def spread(self):
+        """Relative width of the p10-p90 band."""
+        return (self.p90 - self.p10) / self.p50 if self.p50 else float("inf")
+
+    def is_confident(self, min_samples, max_spread, max_age_s, now=None):
+        now = time.time() if now is None else now
+        return (self.samples >= min_samples
+                and self.spread <= max_spread
+                and now - self.last_observed_at <= max_age_s)
+
+
+class TrafficHistory:
+    """
+    SQLite-backed history of duration_in_traffic observations, keyed by route,
+    weekday, departure slot and freeway list.
+
+    Args:
+        db_path (str): SQLite database file. Created if missing.
+    """
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def record(self, key, departure_time, routes):
+        """
+        Stores every alternative observed for one departure time.
+
+        Args:
+            key (str): route_key() of the origin/destination pair.
+            departure_time (datetime): The probed departure time.
+            routes (list): (duration_s, distance_m, freeways) tuples.
+        """
+        now = time.time()
+        rows = [
+            (key, departure_time.weekday(), departure_slot(departure_time), departure_time.date().isoformat(),
+             ",".join(freeways or ()), int(duration_s), int(distance_m), now)
+            for duration_s, distance_m, freeways in routes
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def predict(self, key, weekday, slots, max_age_days=56):
+        """
+        Predicts the best-route duration for each slot on a weekday.
+
+        Only the fastest alternative of each observed departure counts, since
+        that is the route the briefing would recommend.
+
+        Returns:
+            dict: slot -> SlotPrediction, for slots with at least one sample.
+        """
+        import numpy as np
+
+        slots = sorted(set(slots))
+        if not slots:
+            return {}
+        since = time.time() - max_age_days * 24 * 60 * 60
+        placeholders = ",".join("?" for _ in slots)
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT slot, departure_date, MIN(duration_s), MAX(observed_at)
+                FROM observations
+                WHERE route_key = ? AND weekday = ? AND slot IN ({placeholders}) AND observed_at >= ?
+                GROUP BY slot, departure_date
+                """,
+                [key, weekday, *slots, since]
+            ).fetchall()
+            fastest = self._connection.execute(
+                f"""
+                SELECT o.slot, o.freeways, o.distance_m
+                FROM observations o
+                JOIN (
+                    SELECT slot, departure_date, MIN(duration_s) AS best
+                    FROM observations
+                    WHERE route_key = ? AND weekday = ? AND slot IN ({placeholders}) AND observed_at >= ?
+                    GROUP BY slot, departure_date
+                ) b ON o.slot = b.slot AND o.departure_date = b.departure_date AND o.duration_s = b.best
+                WHERE o.route_key = ? AND o.weekday = ?
+                """,
+                [key, weekday, *slots, since, key, weekday]
+            ).fetchall()
+
+        if not rows:
+            return {}
+
+        # Pad every slot's samples into one (slots x samples) matrix so the
+        # quantiles for all slots come from a single vectorized call
+        slot_index = {slot: i for i, slot in enumerate(slots)}
+        counts = np.zeros(len(slots), dtype=np.int64)
+        for slot, _, _, _ in rows:
+            counts[slot_index[slot]] += 1
+        matrix = np.full((len(slots), counts.max()), np.nan)
+        last_seen = np.zeros(len(slots))
+        fill = np.zeros(len(slots), dtype=np.int64)
+        for slot, _, duration_s, observed_at in rows:
+            i = slot_index[slot]
+            matrix[i, fill[i]] = duration_s
+            fill[i] += 1
+            last_seen[i] = max(last_seen[i], observed_at)
+
+        observed = counts > 0
+        quantiles = np.full((3, len(slots)), np.nan)
+        quantiles[:, observed] = np.nanquantile(matrix[observed], [0.1, 0.5, 0.9], axis=1)
+
+        # Most common fastest route per slot
+        routes_by_slot = {}
+        for slot, freeways, distance_m in fastest:
+            routes_by_slot.setdefault(slot, Counter())[(freeways, distance_m)] += 1
+
+        predictions = {}
+        for slot, i in slot_index.items():
+            if not observed[i]:
+                continue
+            freeways, distance_m = routes_by_slot[slot].most_common(1)[0][0]
+            predictions[slot] = SlotPrediction(
+                slot=slot,
+                samples=int(counts[i]),
+                p10=float(quantiles[0, i]),
+                p50=float(quantiles[1, i]),
+                p90=float(quantiles[2, i]),
+                last_observed_at=float(last_seen[i]),
+                freeways=tuple(f for f in freeways.split(",") if f),
+                distance_m=int(distance_m)
+            )
+        return predictions
@@ -0,0 +1,71 @@
+import os
+import json
+from dataclasses import dataclass, fields
+from utils.config import get_setting
+
+
+
+@dataclass(slots=True)
+class UserProfile:
+    """Everything that used to come from the single-user environment variables."""
+    name: str
+    origin_address: str
+    dest_address: str
+    origin_latitude: float
+    origin_longitude: float
+    dest_latitude: float
+    dest_longitude: float
+    recipient_email: str
+    token_file: str = None
+    vehicle_snapshot_file: str = None
+    # "HH:MM" local time the daemon sends the briefing at. Defaults to BRIEFING_TIME.
+    briefing_time: str = None
+
+    @classmethod
+    def from_env(cls):
+        """Builds the profile for the classic single-user setup (.env)."""
+        return cls(
+            name=get_setting("USER_NAME", "default"),
+            origin_address=get_setting("ORIGIN_ADDRESS"),
+            dest_address=get_setting("DEST_ADDRESS"),
+            origin_latitude=float(get_setting("ORIGIN_LATITUDE")),
+            origin_longitude=float(get_setting("ORIGIN_LONGITUDE")),
+            dest_latitude=float(get_setting("DEST_LATITUDE")),
+            dest_longitude=float(get_setting("DEST_LONGITUDE")),
+            recipient_email=get_setting("RECIPIENT_EMAIL"),
+            token_file=get_setting("TOKEN_FILE"),
+            vehicle_snapshot_file=get_setting("VEHICLE_SNAPSHOT_FILE", ".cache/vehicle_snapshot.json"),
+            briefing_time=get_setting("BRIEFING_TIME")
+        )
+
+
+def load_roster(path):
+    """
+    Loads a roster of users from a JSON file: a list of objects using the
+    UserProfile field names. vehicle_snapshot_file defaults to one file per user.
+
+    Example:
+        [{"name": "alex", "origin_address": "...", "dest_address": "...",
+          "origin_latitude": 37.38, "origin_longitude": -122.08,
+          "dest_latitude": 37.77, "dest_longitude": -122.41,
+          "recipient_email": "alex@example.com", "token_file": "tokens/alex.json",
+          "briefing_time": "21:30"}]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    known = {field.name for field in fields(UserProfile)}
+    users = []
+    for entry in entries:
+        unknown = set(entry) - known
+        if unknown:
+            raise ValueError(f"Unknown roster field(s) for {entry.get('name')}: {', '.join(sorted(unknown))}")
+        user = UserProfile(**entry)
+        if not user.vehicle_snapshot_file:
+            user.vehicle_snapshot_file = os.path.join(".cache", f"vehicle_snapshot_{user.name}.json")
+        users.append(user)
+
+    names = [user.name for user in users]
+    if len(names) != len(set(names)):
+        raise ValueError("Roster user names must be unique")
+    return users